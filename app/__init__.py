@@ -15,8 +15,80 @@ class Constants:
     GOOGLE_ENDPOINT_ID = 'GOOGLE_ENDPOINT_ID'
     GOOGLE_PROJECT_ID = 'GOOGLE_PROJECT_ID'
     GOOGLE_REGION = 'GOOGLE_REGION'
+    CLASSIFIER_MAX_BATCH_SIZE = 'CLASSIFIER_MAX_BATCH_SIZE'
+    CLASSIFIER_TOP_K = 'CLASSIFIER_TOP_K'
     TOGETHER_AI_API_KEY = 'TOGETHER_AI_API_KEY'
+    MESSAGE_POOL_DEPTH = 'MESSAGE_POOL_DEPTH'
     DEBUG = 'DEBUG'
+    # Pipeline
+    PIPELINE_MODE = 'PIPELINE_MODE'
+    RENDER_FACES = 'RENDER_FACES'
+    OUTPUT_FORMAT = 'OUTPUT_FORMAT'
+    OUTPUT_QUALITY = 'OUTPUT_QUALITY'
+    OUTPUT_CACHE_CONTROL = 'OUTPUT_CACHE_CONTROL'
+    PIPELINE_TMP_DIR = 'PIPELINE_TMP_DIR'
+    PIPELINE_MAX_WORKERS = 'PIPELINE_MAX_WORKERS'
+    ASGI_CPU_WORKERS = 'ASGI_CPU_WORKERS'
+    BATCH_MAX_IMAGES = 'BATCH_MAX_IMAGES'
+    BATCH_MAX_BYTES = 'BATCH_MAX_BYTES'
+    JOB_QUEUE = 'JOB_QUEUE'
+    JOB_QUEUE_PATH = 'JOB_QUEUE_PATH'
+    JOB_WORKERS = 'JOB_WORKERS'
+    JOB_LEASE_SECONDS = 'JOB_LEASE_SECONDS'
+    JOB_MAX_ATTEMPTS = 'JOB_MAX_ATTEMPTS'
+    ASSET_CACHE_SIZE = 'ASSET_CACHE_SIZE'
+    ASSET_WIDTH_STEP = 'ASSET_WIDTH_STEP'
+    RESULT_CACHE_SIZE = 'RESULT_CACHE_SIZE'
+    RESULT_CACHE_TTL = 'RESULT_CACHE_TTL'
+    RESULT_CACHE_PERCEPTUAL = 'RESULT_CACHE_PERCEPTUAL'
+    RESULT_CACHE_SHARED_PATH = 'RESULT_CACHE_SHARED_PATH'
+    ENCODER_MAX_DIMENSION = 'ENCODER_MAX_DIMENSION'
+    ENCODER_CLASSIFIER_MAX_BYTES = 'ENCODER_CLASSIFIER_MAX_BYTES'
+    FACE_PREFILTER = 'FACE_PREFILTER'
+    FACE_PREFILTER_CASCADES = 'FACE_PREFILTER_CASCADES'
+    FACE_PREFILTER_MIN_NEIGHBORS = 'FACE_PREFILTER_MIN_NEIGHBORS'
+    FACE_PREFILTER_MIN_FACE = 'FACE_PREFILTER_MIN_FACE'
+    FACE_PREFILTER_MAX_DIMENSION = 'FACE_PREFILTER_MAX_DIMENSION'
+    # Admission control
+    ADMISSION_MAX_IN_FLIGHT = 'ADMISSION_MAX_IN_FLIGHT'
+    ADMISSION_MAX_QUEUED = 'ADMISSION_MAX_QUEUED'
+    ADMISSION_QUEUE_TIMEOUT = 'ADMISSION_QUEUE_TIMEOUT'
+    ADMISSION_RETRY_AFTER = 'ADMISSION_RETRY_AFTER'
+    ADMISSION_GLOBAL_MAX_IN_FLIGHT = 'ADMISSION_GLOBAL_MAX_IN_FLIGHT'
+    ADMISSION_LOCK_DIR = 'ADMISSION_LOCK_DIR'
+    # Backends
+    BACKEND_MODE = 'BACKEND_MODE'
+    OBJECT_STORE_BACKEND = 'OBJECT_STORE_BACKEND'
+    FACE_DETECTOR_BACKEND = 'FACE_DETECTOR_BACKEND'
+    CLASSIFIER_BACKEND = 'CLASSIFIER_BACKEND'
+    LLM_BACKEND = 'LLM_BACKEND'
+    LOCAL_OBJECT_STORE_PATH = 'LOCAL_OBJECT_STORE_PATH'
+    LOCAL_BACKEND_LATENCY_MS = 'LOCAL_BACKEND_LATENCY_MS'
+    LOCAL_BACKEND_ERROR_RATE = 'LOCAL_BACKEND_ERROR_RATE'
+    FAKE_FACES_PER_IMAGE = 'FAKE_FACES_PER_IMAGE'
+    FAKE_CLASSIFIER_LABEL = 'FAKE_CLASSIFIER_LABEL'
+    # Uploads
+    MAX_CONTENT_LENGTH = 'MAX_CONTENT_LENGTH'
+    IMAGE_MAX_BYTES = 'IMAGE_MAX_BYTES'
+    IMAGE_MAX_PIXELS = 'IMAGE_MAX_PIXELS'
+    IMAGE_MAX_FRAMES = 'IMAGE_MAX_FRAMES'
+    UPLOAD_QUEUE_SIZE = 'UPLOAD_QUEUE_SIZE'
+    UPLOAD_WORKERS = 'UPLOAD_WORKERS'
+    UPLOAD_FLUSH_TIMEOUT = 'UPLOAD_FLUSH_TIMEOUT'
+    UPLOAD_MULTIPART_THRESHOLD_MB = 'UPLOAD_MULTIPART_THRESHOLD_MB'
+    UPLOAD_MULTIPART_CHUNKSIZE_MB = 'UPLOAD_MULTIPART_CHUNKSIZE_MB'
+    UPLOAD_MAX_CONCURRENCY = 'UPLOAD_MAX_CONCURRENCY'
+    # Outbound clients
+    OUTBOUND_POOL_SIZE = 'OUTBOUND_POOL_SIZE'
+    OUTBOUND_CONNECT_TIMEOUT_MS = 'OUTBOUND_CONNECT_TIMEOUT_MS'
+    OUTBOUND_READ_TIMEOUT_MS = 'OUTBOUND_READ_TIMEOUT_MS'
+    OUTBOUND_MAX_RETRIES = 'OUTBOUND_MAX_RETRIES'
+    HEDGE_AFTER_MS = 'HEDGE_AFTER_MS'
+    HEDGE_MAX_IN_FLIGHT = 'HEDGE_MAX_IN_FLIGHT'
+    # Observability
+    METRICS_DIR = 'METRICS_DIR'
+    METRICS_FLUSH_INTERVAL = 'METRICS_FLUSH_INTERVAL'
+    TRACE_SAMPLE_RATE = 'TRACE_SAMPLE_RATE'
 
 
 app = Flask(__name__)
@@ -33,8 +105,137 @@ app.config[Constants.AWS_REGION] = os.getenv(Constants.AWS_REGION)
 app.config[Constants.GOOGLE_ENDPOINT_ID] = os.getenv(Constants.GOOGLE_ENDPOINT_ID)
 app.config[Constants.GOOGLE_PROJECT_ID] = os.getenv(Constants.GOOGLE_PROJECT_ID)
 app.config[Constants.GOOGLE_REGION] = os.getenv(Constants.GOOGLE_REGION)
+# maximum number of face crops per Vertex AI predict request
+app.config[Constants.CLASSIFIER_MAX_BATCH_SIZE] = os.getenv(Constants.CLASSIFIER_MAX_BATCH_SIZE, '16')
+# labels the classifier answers with per face crop, most confident first; only the first one picks the overlay
+app.config[Constants.CLASSIFIER_TOP_K] = os.getenv(Constants.CLASSIFIER_TOP_K, '1')
 
 app.config[Constants.TOGETHER_AI_API_KEY] = os.getenv(Constants.TOGETHER_AI_API_KEY)
+# pre-generated LLM rewordings kept ready per label, 0 always answers with the base prompt
+app.config[Constants.MESSAGE_POOL_DEPTH] = os.getenv(Constants.MESSAGE_POOL_DEPTH, '5')
+
+# 'memory' (default) or 'disk' to spill intermediate images to PIPELINE_TMP_DIR
+app.config[Constants.PIPELINE_MODE] = os.getenv(Constants.PIPELINE_MODE, 'memory')
+# where every request spilling to disk gets its own workspace directory, e.g. /dev/shm to keep it on tmpfs
+app.config[Constants.PIPELINE_TMP_DIR] = os.getenv(Constants.PIPELINE_TMP_DIR, './tmp')
+# 'best' (default) decorates the most confidently recognized face only, 'all' every recognized face of the photo
+app.config[Constants.RENDER_FACES] = os.getenv(Constants.RENDER_FACES, 'best')
+# encoding of results when the request does not ask for one: 'jpeg' (progressive), 'webp' or 'png', and the quality
+app.config[Constants.OUTPUT_FORMAT] = os.getenv(Constants.OUTPUT_FORMAT, 'jpeg')
+app.config[Constants.OUTPUT_QUALITY] = os.getenv(Constants.OUTPUT_QUALITY, '95')
+# Cache-Control of results answered as the image itself (?output=image); their ETag is the hash of their content
+app.config[Constants.OUTPUT_CACHE_CONTROL] = os.getenv(Constants.OUTPUT_CACHE_CONTROL,
+                                                       'private, max-age=31536000, immutable')
+# threads per worker process shared by all /process-images requests to run the stages of their images concurrently
+app.config[Constants.PIPELINE_MAX_WORKERS] = os.getenv(Constants.PIPELINE_MAX_WORKERS, '16')
+# threads per ASGI worker process for the CPU-bound stages (decoding, cropping, encoding, compositing), 0 for one
+# per CPU
+app.config[Constants.ASGI_CPU_WORKERS] = os.getenv(Constants.ASGI_CPU_WORKERS, '0')
+# most images accepted by one /process-images request, including the contents of zip archives
+app.config[Constants.BATCH_MAX_IMAGES] = os.getenv(Constants.BATCH_MAX_IMAGES, '50')
+# most bytes of images accepted by one /process-images request once zip archives are expanded
+app.config[Constants.BATCH_MAX_BYTES] = os.getenv(Constants.BATCH_MAX_BYTES, str(200 * 1024 * 1024))
+# queue behind /process-image?async=true: 'memory' (per worker process) or 'sqlite' (durable, shared by all workers
+# on the host), and the background threads per worker processing it
+app.config[Constants.JOB_QUEUE] = os.getenv(Constants.JOB_QUEUE, 'memory')
+app.config[Constants.JOB_QUEUE_PATH] = os.getenv(Constants.JOB_QUEUE_PATH, 'jobs.sqlite3')
+app.config[Constants.JOB_WORKERS] = os.getenv(Constants.JOB_WORKERS, '2')
+# a sqlite job whose worker was killed mid-job, with no stage update for JOB_LEASE_SECONDS, runs again; after
+# JOB_MAX_ATTEMPTS claims it fails instead
+app.config[Constants.JOB_LEASE_SECONDS] = os.getenv(Constants.JOB_LEASE_SECONDS, '300')
+app.config[Constants.JOB_MAX_ATTEMPTS] = os.getenv(Constants.JOB_MAX_ATTEMPTS, '3')
+# resized accessory overlays kept per worker, and the width rounding used as their cache key
+app.config[Constants.ASSET_CACHE_SIZE] = os.getenv(Constants.ASSET_CACHE_SIZE, '256')
+app.config[Constants.ASSET_WIDTH_STEP] = os.getenv(Constants.ASSET_WIDTH_STEP, '8')
+# results of processed uploads: entries per worker (0 disables), TTL in seconds, whether to also match re-encoded
+# copies by perceptual hash, and an optional SQLite file shared by all workers
+app.config[Constants.RESULT_CACHE_SIZE] = os.getenv(Constants.RESULT_CACHE_SIZE, '1024')
+app.config[Constants.RESULT_CACHE_TTL] = os.getenv(Constants.RESULT_CACHE_TTL, '3600')
+app.config[Constants.RESULT_CACHE_PERCEPTUAL] = os.getenv(Constants.RESULT_CACHE_PERCEPTUAL, 'False')
+app.config[Constants.RESULT_CACHE_SHARED_PATH] = os.getenv(Constants.RESULT_CACHE_SHARED_PATH)
+# longest side in pixels of the image sent to face detection; larger uploads (or small PNGs that decode to huge
+# bitmaps) are downscaled to it and re-encoded under Rekognition's 5 MB limit
+app.config[Constants.ENCODER_MAX_DIMENSION] = os.getenv(Constants.ENCODER_MAX_DIMENSION, '4096')
+# byte budget of every face crop sent to the classifier, so a batch of CLASSIFIER_MAX_BATCH_SIZE crops stays under
+# Vertex AI's 1.5 MB request limit once base64 encoded
+app.config[Constants.ENCODER_CLASSIFIER_MAX_BYTES] = os.getenv(Constants.ENCODER_CLASSIFIER_MAX_BYTES, '65536')
+
+# skip face detection for uploads in which OpenCV's cascades find no face at all. The cascades are file names from
+# cv2.data.haarcascades or paths; a lower MIN_NEIGHBORS or MIN_FACE (smallest face as a share of the shorter side)
+# lets more images through to the face detector. Images are searched at most MAX_DIMENSION pixels wide or high.
+app.config[Constants.FACE_PREFILTER] = os.getenv(Constants.FACE_PREFILTER, 'False')
+app.config[Constants.FACE_PREFILTER_CASCADES] = os.getenv(
+    Constants.FACE_PREFILTER_CASCADES, 'haarcascade_frontalface_default.xml,haarcascade_profileface.xml')
+app.config[Constants.FACE_PREFILTER_MIN_NEIGHBORS] = os.getenv(Constants.FACE_PREFILTER_MIN_NEIGHBORS, '3')
+app.config[Constants.FACE_PREFILTER_MIN_FACE] = os.getenv(Constants.FACE_PREFILTER_MIN_FACE, '0.06')
+app.config[Constants.FACE_PREFILTER_MAX_DIMENSION] = os.getenv(Constants.FACE_PREFILTER_MAX_DIMENSION, '480')
+
+# image processing requests each worker runs at once, how many more may wait for one of them to finish and for how
+# many seconds, before being refused with 503 and a Retry-After of ADMISSION_RETRY_AFTER seconds. /health and the
+# Swagger UI are never limited. ADMISSION_GLOBAL_MAX_IN_FLIGHT (0 disables) also caps the requests all workers on the
+# host run at once, with lock files in ADMISSION_LOCK_DIR (a temporary directory by default).
+app.config[Constants.ADMISSION_MAX_IN_FLIGHT] = os.getenv(Constants.ADMISSION_MAX_IN_FLIGHT, '4')
+app.config[Constants.ADMISSION_MAX_QUEUED] = os.getenv(Constants.ADMISSION_MAX_QUEUED, '4')
+app.config[Constants.ADMISSION_QUEUE_TIMEOUT] = os.getenv(Constants.ADMISSION_QUEUE_TIMEOUT, '2')
+app.config[Constants.ADMISSION_RETRY_AFTER] = os.getenv(Constants.ADMISSION_RETRY_AFTER, '2')
+app.config[Constants.ADMISSION_GLOBAL_MAX_IN_FLIGHT] = os.getenv(Constants.ADMISSION_GLOBAL_MAX_IN_FLIGHT, '0')
+app.config[Constants.ADMISSION_LOCK_DIR] = os.getenv(Constants.ADMISSION_LOCK_DIR)
+
+# 'cloud' (default) talks to S3, Rekognition, Vertex AI and Together AI, 'local' uses offline stand-ins for all of
+# them. Each backend can be switched on its own, e.g. FACE_DETECTOR_BACKEND=local.
+app.config[Constants.BACKEND_MODE] = os.getenv(Constants.BACKEND_MODE, 'cloud')
+app.config[Constants.OBJECT_STORE_BACKEND] = os.getenv(Constants.OBJECT_STORE_BACKEND)
+app.config[Constants.FACE_DETECTOR_BACKEND] = os.getenv(Constants.FACE_DETECTOR_BACKEND)
+app.config[Constants.CLASSIFIER_BACKEND] = os.getenv(Constants.CLASSIFIER_BACKEND)
+app.config[Constants.LLM_BACKEND] = os.getenv(Constants.LLM_BACKEND)
+# directory the local object store writes images to
+app.config[Constants.LOCAL_OBJECT_STORE_PATH] = os.getenv(Constants.LOCAL_OBJECT_STORE_PATH, './local-bucket')
+# latency in milliseconds and error rate added to the local stand-ins, either one value for all of them or per
+# backend, e.g. '20,face_detector=250,llm=1500' (backends: object_store, face_detector, classifier, llm)
+app.config[Constants.LOCAL_BACKEND_LATENCY_MS] = os.getenv(Constants.LOCAL_BACKEND_LATENCY_MS, '0')
+app.config[Constants.LOCAL_BACKEND_ERROR_RATE] = os.getenv(Constants.LOCAL_BACKEND_ERROR_RATE, '0')
+# faces the local face detector finds in every image (a count or a range like '0-3'), and the label the local
+# classifier gives them
+app.config[Constants.FAKE_FACES_PER_IMAGE] = os.getenv(Constants.FAKE_FACES_PER_IMAGE, '1')
+app.config[Constants.FAKE_CLASSIFIER_LABEL] = os.getenv(Constants.FAKE_CLASSIFIER_LABEL, 'Mary')
+
+# largest request body in bytes, refused with 413 before it is read (Flask needs it as a number). Every uploaded
+# image is also checked while it is read: at most IMAGE_MAX_BYTES, a PNG or JPEG whose header shows at most
+# IMAGE_MAX_PIXELS pixels and IMAGE_MAX_FRAMES frames, or it is refused before the rest is buffered or decoded
+app.config[Constants.MAX_CONTENT_LENGTH] = int(os.getenv(Constants.MAX_CONTENT_LENGTH, str(200 * 1024 * 1024)))
+app.config[Constants.IMAGE_MAX_BYTES] = os.getenv(Constants.IMAGE_MAX_BYTES, str(20 * 1024 * 1024))
+app.config[Constants.IMAGE_MAX_PIXELS] = os.getenv(Constants.IMAGE_MAX_PIXELS, '50000000')
+app.config[Constants.IMAGE_MAX_FRAMES] = os.getenv(Constants.IMAGE_MAX_FRAMES, '1')
+
+# originals are archived in the background: uploads waiting per worker (when full, the request uploads its original
+# itself), the threads uploading them, and how many seconds a stopping worker waits for the queue to drain
+app.config[Constants.UPLOAD_QUEUE_SIZE] = os.getenv(Constants.UPLOAD_QUEUE_SIZE, '32')
+app.config[Constants.UPLOAD_WORKERS] = os.getenv(Constants.UPLOAD_WORKERS, '2')
+app.config[Constants.UPLOAD_FLUSH_TIMEOUT] = os.getenv(Constants.UPLOAD_FLUSH_TIMEOUT, '25')
+# S3 uploads above the threshold (MB) are sent in parts of the chunk size (MB), up to UPLOAD_MAX_CONCURRENCY at once
+app.config[Constants.UPLOAD_MULTIPART_THRESHOLD_MB] = os.getenv(Constants.UPLOAD_MULTIPART_THRESHOLD_MB, '8')
+app.config[Constants.UPLOAD_MULTIPART_CHUNKSIZE_MB] = os.getenv(Constants.UPLOAD_MULTIPART_CHUNKSIZE_MB, '8')
+app.config[Constants.UPLOAD_MAX_CONCURRENCY] = os.getenv(Constants.UPLOAD_MAX_CONCURRENCY, '4')
+
+# connections each worker keeps per backend (defaults to PIPELINE_MAX_WORKERS + JOB_WORKERS, the threads that may call
+# a backend at once), connect and read timeouts in milliseconds for all backends or per backend
+# (object_store, face_detector, classifier, llm), and retries of a failed call
+app.config[Constants.OUTBOUND_POOL_SIZE] = os.getenv(Constants.OUTBOUND_POOL_SIZE)
+app.config[Constants.OUTBOUND_CONNECT_TIMEOUT_MS] = os.getenv(Constants.OUTBOUND_CONNECT_TIMEOUT_MS, '2000')
+app.config[Constants.OUTBOUND_READ_TIMEOUT_MS] = os.getenv(Constants.OUTBOUND_READ_TIMEOUT_MS, '10000,llm=60000')
+app.config[Constants.OUTBOUND_MAX_RETRIES] = os.getenv(Constants.OUTBOUND_MAX_RETRIES, '2')
+# send face detection and classification calls a second time when the first has not answered after this many
+# milliseconds, e.g. 'face_detector=800,classifier=1500' (0 disables), with at most HEDGE_MAX_IN_FLIGHT extra calls
+# at once per worker
+app.config[Constants.HEDGE_AFTER_MS] = os.getenv(Constants.HEDGE_AFTER_MS, '0')
+app.config[Constants.HEDGE_MAX_IN_FLIGHT] = os.getenv(Constants.HEDGE_MAX_IN_FLIGHT, '4')
+
+# directory where every worker process writes its metrics so /metrics reports the totals of all gunicorn workers, and
+# how often in seconds they do it. Unset, /metrics only reports the worker that answers it.
+app.config[Constants.METRICS_DIR] = os.getenv(Constants.METRICS_DIR)
+app.config[Constants.METRICS_FLUSH_INTERVAL] = os.getenv(Constants.METRICS_FLUSH_INTERVAL, '5')
+# share of requests, between 0 and 1, whose stage timings are logged as one JSON line with their request id
+app.config[Constants.TRACE_SAMPLE_RATE] = os.getenv(Constants.TRACE_SAMPLE_RATE, '0')
 
 # Set debug environment variable
 app.config[Constants.DEBUG] = os.getenv(Constants.DEBUG)
@@ -0,0 +1,183 @@
+import json
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NEED_DATA
+
+from app import app, Constants
+from app.routes import allowed_file
+from app.service.admission import Overloaded, admission
+from app.service.async_image_service import AsyncManipulateImageService
+from app.service.ingestion import IngestionStream, UploadRejected, ingestion_policy
+from app.service.metrics import metrics
+from app.service.output import ImageOutput
+
+
+class Upload:
+    """The image part of a /process-image request, checked while it streams in like ``IngestionRequest`` does."""
+
+    def __init__(self):
+        self.filename: Optional[str] = None
+        self.stream: Optional[IngestionStream] = None
+
+
+class AsgiApp:
+    """
+    ASGI entry point. ``POST /process-image`` is served natively: the body is parsed as it arrives and the pipeline
+    awaits its backend calls, see ``AsyncManipulateImageService``. Every other request, including queued
+    ``/process-image?async=true`` uploads, goes to the Flask app through asgiref's WSGI adapter, which runs it on a
+    thread.
+    """
+
+    def __init__(self, wsgi_app, max_content_length: Optional[int] = None):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.max_content_length = max_content_length
+
+    async def __call__(self, scope: Dict[str, Any], receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await AsgiApp.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/process-image' \
+                and AsgiApp.query(scope).get('async', '').lower() != 'true':
+            await self.process_image(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    @staticmethod
+    def query(scope: Dict[str, Any]) -> Dict[str, str]:
+        # the first value of every query parameter
+        return {name: values[0] for name, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+    @staticmethod
+    async def lifespan(receive, send) -> None:
+        # nothing to set up: clients and threads are created on first use
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def process_image(self, scope: Dict[str, Any], receive, send) -> None:
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        trace, token = metrics.start_trace(headers.get('x-request-id'))
+        status = 500
+        response_headers: List[Tuple[str, str]] = [('X-Request-ID', trace.request_id)]
+        try:
+            image = None
+            try:
+                body, status, extra_headers, image = await self.admitted(scope, headers, receive)
+            except Overloaded as e:
+                body, status, extra_headers = {'msg': e.description}, 503, [('Retry-After', str(e.retry_after))]
+            except HTTPException as e:
+                # uploads refused while the request body was read
+                body, status, extra_headers = {'msg': e.description}, e.code, []
+            except Exception:
+                traceback.print_exc()
+                body, status, extra_headers = {'msg': 'Internal Server Error'}, 500, []
+            if body is None:
+                await AsgiApp.send_image(send, status, image, response_headers + extra_headers)
+            else:
+                await AsgiApp.send_json(send, status, body, response_headers + extra_headers)
+        finally:
+            metrics.finish_trace(trace, token, 'manipulate_image', 'POST', status)
+
+    async def admitted(self, scope: Dict[str, Any], headers: Dict[str, str], receive) \
+            -> Tuple[Optional[Dict[str, Any]], int, List[Tuple[str, str]], Optional[bytes]]:
+        """The JSON body, status and headers to answer with; without a JSON body the answer is the image returned."""
+        slot = await admission.acquire_async()
+        try:
+            upload = await self.read_upload(headers, receive)
+            # the same answers as the Flask route
+            if upload is None:
+                return {'msg': 'No image provided'}, 400, [], None
+            if upload.filename == '':
+                return {'msg': 'No selected image file'}, 400, [], None
+            if not allowed_file(upload.filename):
+                return {'msg': 'Unsupported image format. Please provide a PNG, JPEG, or JPG file.'}, 400, [], None
+            try:
+                output = ImageOutput.from_request(AsgiApp.query(scope), Headers(list(headers.items())))
+            except ValueError as e:
+                return {'msg': str(e)}, 400, [], None
+            body, status, server_timing, image = await AsyncManipulateImageService.manipulate_image(
+                upload.filename, upload.stream.getvalue(), output)
+            status, json_body, output_headers = output.answer(body, status, image)
+            return json_body, status, [('Server-Timing', server_timing)] + output_headers, image
+        finally:
+            admission.release(slot)
+
+    async def read_upload(self, headers: Dict[str, str], receive) -> Optional[Upload]:
+        """
+        Reads the multipart body and returns its ``image`` part, or None if there is none. Raises ``UploadRejected``
+        as soon as the image breaks the ingestion policy, before the rest of the body is read.
+        """
+        if self.max_content_length is not None and int(headers.get('content-length') or 0) > self.max_content_length:
+            raise RequestEntityTooLarge()
+        mimetype, options = parse_options_header(headers.get('content-type', ''))
+        if mimetype != 'multipart/form-data' or 'boundary' not in options:
+            return None
+        decoder = MultipartDecoder(options['boundary'].encode('latin-1'))
+        upload: Optional[Upload] = None
+        # the part the decoder is in, only the image is kept
+        current: Optional[Upload] = None
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise UploadRejected('The client went away before the image was sent.', 400)
+            chunk = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            received += len(chunk)
+            if self.max_content_length is not None and received > self.max_content_length:
+                raise RequestEntityTooLarge()
+            decoder.receive_data(chunk)
+            if not more_body:
+                decoder.receive_data(None)
+            event = decoder.next_event()
+            while event is not NEED_DATA and not isinstance(event, Epilogue):
+                if isinstance(event, File):
+                    current = None
+                    if event.name == 'image' and upload is None:
+                        current = upload = Upload()
+                        upload.filename = event.filename
+                        upload.stream = IngestionStream(ingestion_policy)
+                elif isinstance(event, Data):
+                    if current is not None:
+                        current.stream.write(event.data)
+                        if not event.more_data:
+                            # a complete image too short to show its header is rejected now
+                            current.stream.seek(0)
+                            current = None
+                else:
+                    current = None
+                event = decoder.next_event()
+        return upload
+
+    @staticmethod
+    async def send_json(send, status: int, body: Dict[str, Any], headers: List[Tuple[str, str]]) -> None:
+        content = json.dumps(body).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())]
+                    + [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    @staticmethod
+    async def send_image(send, status: int, image: bytes, headers: List[Tuple[str, str]]) -> None:
+        # the headers carry the type and length; a 304 has no body
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        if status == 304:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        chunks = list(ImageOutput.chunks(image))
+        for idx, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': idx < len(chunks) - 1})
+
+
+application = AsgiApp(app, max_content_length=app.config.get(Constants.MAX_CONTENT_LENGTH))
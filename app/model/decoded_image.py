@@ -0,0 +1,78 @@
+import io
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class DecodedImage:
+    """
+    A single decoded copy of an image shared between PIL and OpenCV.
+
+    The pixels live in one C-contiguous ``uint8`` array laid out as RGBX (height x width x 4). That layout is the
+    one PIL can wrap without copying, and it lets OpenCV/NumPy consumers get RGB or BGR views simply by slicing the
+    channel axis. Crops are array slices that share the same buffer.
+    """
+    CHANNELS = 4
+
+    def __init__(self, pixels: np.ndarray):
+        if pixels.ndim != 3 or pixels.shape[2] != DecodedImage.CHANNELS or pixels.dtype != np.uint8:
+            raise ValueError(f"Expected an HxWx4 uint8 RGBX array, got {pixels.shape} {pixels.dtype}")
+        self.pixels = pixels
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DecodedImage':
+        with Image.open(io.BytesIO(data)) as img:
+            return cls.from_pil(img)
+
+    @classmethod
+    def from_pil(cls, img: Image.Image) -> 'DecodedImage':
+        if img.mode != 'RGBX':
+            img = img.convert('RGBX')
+        # np.array (not asarray) so the buffer is writable and owned by us
+        return cls(np.array(img))
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Zero-copy RGB view."""
+        return self.pixels[..., :3]
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """Zero-copy BGR view (negative channel stride), the channel order cv2 works in."""
+        return self.pixels[..., 2::-1]
+
+    def crop(self, left: int, top: int, right: int, bottom: int) -> 'DecodedImage':
+        """Returns a view of the given box, clipped to the image bounds. No pixels are copied."""
+        left, right = max(left, 0), min(right, self.width)
+        top, bottom = max(top, 0), min(bottom, self.height)
+        return DecodedImage(self.pixels[top:bottom, left:right])
+
+    def pil(self) -> Image.Image:
+        """
+        Wraps the buffer in a read-only PIL image. Full images are mapped without a copy; a crop is first made
+        contiguous, which copies only the crop.
+        """
+        pixels = self.pixels if self.pixels.flags['C_CONTIGUOUS'] else np.ascontiguousarray(self.pixels)
+        return Image.frombuffer('RGBX', (pixels.shape[1], pixels.shape[0]), pixels, 'raw', 'RGBX', 0, 1)
+
+    def encode(self, image_format: str = 'JPEG', **params) -> bytes:
+        img = self.pil()
+        if image_format.upper() == 'PNG':
+            # PNG has no RGBX mode
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, **params)
+        return buffer.getvalue()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+from app.model.decoded_image import DecodedImage
+from app.utils.utils import Utils
+
+
+class ImageContext:
+    """
+    Request-scoped state for one uploaded image as it moves through the /process-image pipeline.
+
+    By default everything stays in memory and bytes are only produced when a backend asks for them. With
+    ``on_disk=True`` the upload and every face crop are spilled to disk instead, which is the old behaviour and is kept
+    as a fallback for memory-constrained deployments. Every context then gets a workspace directory of its own inside
+    ``directory``, so concurrent requests never write to the same file, and ``cleanup`` removes it as a whole.
+    """
+    MEMORY = 'memory'
+    DISK = 'disk'
+
+    def __init__(self, file_name: str, data: bytes, on_disk: bool = False, directory: str = './tmp'):
+        self.file_name = file_name
+        self.on_disk = on_disk
+        self.directory = directory
+        self.file_path: Optional[str] = None
+        self.workspace: Optional[str] = None
+        self.faces: List[Dict[str, Any]] = []
+        # the encoded result, once rendered
+        self.result: Optional[bytes] = None
+        self._data: Optional[bytes] = None
+        self._image: Optional[DecodedImage] = None
+        # optional hook told about every pipeline stage the request enters, e.g. to report job progress
+        self.on_stage: Optional[Callable[[str], None]] = None
+        # seconds spent in every stage so far, the request starts out in 'received'
+        self.stage_durations: Dict[str, float] = {}
+        self._stage = 'received'
+        self._stage_started = time.perf_counter()
+        try:
+            self.set_data(data)
+        except BaseException:
+            # nobody gets a context to clean up
+            self.cleanup()
+            raise
+
+    @classmethod
+    def from_upload(cls, file: FileStorage, mode: str = MEMORY, directory: str = './tmp') -> 'ImageContext':
+        file_name = Utils.pre_append_date(file.filename)
+        return cls(file_name, file.read(), on_disk=mode == cls.DISK, directory=directory)
+
+    @property
+    def data(self) -> bytes:
+        if self.on_disk:
+            return Utils.read_binary_file(self.file_path)
+        return self._data
+
+    @property
+    def image(self) -> DecodedImage:
+        """The upload decoded once, on first use, and shared by every later stage."""
+        if self._image is None:
+            self._image = DecodedImage.from_bytes(self.data)
+        return self._image
+
+    def set_data(self, data: bytes) -> None:
+        """Replace the encoded image. The decoded image is dropped and decoded again from the new bytes."""
+        self._image = None
+        if self.on_disk:
+            if self.file_path is None:
+                # the client's file name is only trusted after it has been sanitized
+                self.file_path = os.path.join(self.workspace_dir(), secure_filename(self.file_name) or 'upload')
+            with open(self.file_path, 'wb') as file:
+                file.write(data)
+        else:
+            self._data = data
+
+    def store_face(self, idx: int, face_image: DecodedImage) -> Dict[str, Any]:
+        """Keep a face crop around for the classifier; returns the keys to merge into the face dict."""
+        if not self.on_disk:
+            return {"face_image": face_image, "face_image_path": ''}
+
+        face_image_path = os.path.join(self.workspace_dir(), f"face_{idx}.jpg")
+        face_image.pil().convert('RGB').save(face_image_path)
+        return {"face_image": None, "face_image_path": face_image_path}
+
+    def workspace_dir(self) -> str:
+        """This request's own directory for spilled files, created on first use."""
+        if self.workspace is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.workspace = tempfile.mkdtemp(prefix='request-', dir=self.directory)
+        return self.workspace
+
+    @staticmethod
+    def face_source(face: Dict[str, Any]) -> Union[str, Image.Image]:
+        """Returns whatever ``Utils.prepare_image`` should read the face crop from."""
+        return face["face_image"].pil() if face.get("face_image") is not None else face["face_image_path"]
+
+    def report_stage(self, stage: str) -> None:
+        self._close_stage()
+        self._stage = stage
+        if self.on_stage is not None:
+            self.on_stage(stage)
+
+    def _close_stage(self) -> None:
+        now = time.perf_counter()
+        self.stage_durations[self._stage] = self.stage_durations.get(self._stage, 0.0) + now - self._stage_started
+        self._stage_started = now
+
+    def server_timing(self) -> str:
+        """The time spent in every stage so far as a ``Server-Timing`` header value, in milliseconds."""
+        self._close_stage()
+        return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stage_durations.items())
+
+    def cleanup(self) -> None:
+        """Remove anything spilled to disk for this request. Safe to call more than once."""
+        if self.workspace is not None:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+            self.workspace = None
+            self.file_path = None
+        self._data = None
+        self._image = None
+        self.faces = []
+        self.result = None
+
+    def __enter__(self) -> 'ImageContext':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()
@@ -1,18 +1,25 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 
 class PredictionModel:
+    # one per label per face of every classified image; slots keep them small and quick to create
+    __slots__ = ('prediction_label', 'prediction_confidence', 'prediction_id', 'face_details', 'face_image_path')
+
     prediction_label: str
     prediction_confidence: float
     prediction_id: float
 
-    face_details: Dict[str, Any] = {}
-    face_image_path: str = ''
+    face_details: Dict[str, Any]
+    face_image_path: str
 
-    def __init__(self, prediction_label: str, prediction_confidence: float, prediction_id: float):
+    def __init__(self, prediction_label: str, prediction_confidence: float, prediction_id: float,
+                 face_details: Optional[Dict[str, Any]] = None, face_image_path: str = ''):
         self.prediction_label = prediction_label
         self.prediction_confidence = prediction_confidence
         self.prediction_id = prediction_id
+        # per instance, a class-level dict would be shared by every prediction of every request
+        self.face_details = {} if face_details is None else face_details
+        self.face_image_path = face_image_path
 
     def __str__(self):
         return f"PredictionModel(label={self.prediction_label}, confidence={self.prediction_confidence}, id={self.prediction_id}, face_image_path={self.face_image_path}, face_details={self.face_details})"
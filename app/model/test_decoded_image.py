@@ -0,0 +1,42 @@
+import io
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+from app.model.decoded_image import DecodedImage
+
+
+class TestDecodedImage(TestCase):
+
+    def setUp(self):
+        pixels = np.zeros((40, 60, 3), dtype=np.uint8)
+        pixels[..., 0] = 200  # red
+        pixels[..., 2] = 10  # blue
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        self.image = DecodedImage.from_bytes(buffer.getvalue())
+
+    def test_views_share_the_buffer(self):
+        self.assertEqual(self.image.size, (60, 40))
+        self.assertTrue(np.shares_memory(self.image.rgb, self.image.pixels))
+        self.assertTrue(np.shares_memory(self.image.bgr, self.image.pixels))
+        self.assertEqual(tuple(self.image.rgb[0, 0]), (200, 0, 10))
+        self.assertEqual(tuple(self.image.bgr[0, 0]), (10, 0, 200))
+
+    def test_pil_sees_writes_through_the_bgr_view(self):
+        pil_image = self.image.pil()
+        self.image.bgr[0, 0] = (1, 2, 3)
+        self.assertEqual(pil_image.getpixel((0, 0))[:3], (3, 2, 1))
+
+    def test_crop_is_a_clipped_view(self):
+        crop = self.image.crop(-10, 5, 30, 100)
+        self.assertEqual(crop.size, (30, 35))
+        self.assertTrue(np.shares_memory(crop.pixels, self.image.pixels))
+        self.assertEqual(crop.pil().size, (30, 35))
+
+    def test_encode_round_trip(self):
+        for image_format in ('JPEG', 'PNG'):
+            with Image.open(io.BytesIO(self.image.encode(image_format))) as decoded:
+                self.assertEqual(decoded.format, image_format)
+                self.assertEqual(decoded.size, (60, 40))
@@ -1,11 +1,39 @@
 from typing import Tuple, Dict
 
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+import json
 
 from app import app
-from flask import request, jsonify, redirect
+from flask import g, request, jsonify, redirect, Response, stream_with_context, url_for
 
+from app.service.admission import Overloaded, admission
+from app.service.batch_service import BatchImageService
 from app.service.image_service import ManipulateImageService
+from app.service.ingestion import IngestionRequest, UploadRejected
+from app.service.job_service import job_service
+from app.service.metrics import metrics
+from app.service.output import ImageOutput
+
+# uploaded images are checked while the request body is read
+app.request_class = IngestionRequest
+
+
+@app.before_request
+def start_trace():
+    # a request id sent by the caller or a proxy is kept, so log lines can be correlated across services
+    g.trace, g.trace_token = metrics.start_trace(request.headers.get('X-Request-ID'))
+
+
+@app.after_request
+def finish_trace(response: Response) -> Response:
+    trace = g.pop('trace', None)
+    if trace is not None:
+        metrics.finish_trace(trace, g.pop('trace_token'), request.endpoint or 'unknown', request.method,
+                             response.status_code)
+        response.headers['X-Request-ID'] = trace.request_id
+    return response
 
 
 @app.route('/health')
@@ -21,7 +49,23 @@ def health() -> Tuple[Dict[str, str], int]:
             'msg': 'API is up'}, 200
 
 
+@app.route('/metrics')
+def prometheus_metrics() -> Response:
+    """
+    Prometheus metrics: request and per-stage latency, faces per image, bytes in and out, result and accessory cache
+    hits, message pool depth and refill latency, and backend errors. Set METRICS_DIR to report the totals of all gunicorn workers.
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: The metrics in the Prometheus text exposition format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/process-image', methods=['POST'])
+@admission.limit
 def manipulate_image():
     """
     Endpoint to process an image.
@@ -32,11 +76,52 @@ def manipulate_image():
         type: file
         required: true
         description: The image file to be processed.
+      - name: async
+        in: query
+        type: boolean
+        required: false
+        description: Queue the image and return a job id right away instead of waiting for the result.
+      - name: output
+        in: query
+        type: string
+        enum: [url, inline, image]
+        required: false
+        description: Answer with the URL of the stored result (default), with the result as a data URI in the JSON
+          body, or with the result itself. Neither of the last two stores the result.
+      - name: format
+        in: query
+        type: string
+        enum: [webp, jpeg, png]
+        required: false
+        description: Encoding of the result. Negotiated from the Accept header if not given.
+      - name: quality
+        in: query
+        type: integer
+        required: false
+        description: Quality of a WebP or JPEG result, 1-100.
+      - name: size
+        in: query
+        type: integer
+        required: false
+        description: Longest side of the result in pixels; larger results are scaled down.
     responses:
       200:
-        description: The processed image.
+        description: The processed image. With output=image the body is the image, with a strong ETag of its
+          content hash, and the prediction and message are in the X-Prediction-Label and X-Message (percent-encoded)
+          headers.
+      304:
+        description: output=image and the If-None-Match header holds the ETag of the result.
+      202:
+        description: The image was queued. Poll statusUrl for progress and the result.
       400:
-        description: Bad request if no image is provided or no image file is selected.
+        description: Bad request if no image is provided, no image file is selected or an output parameter is
+          invalid.
+      413:
+        description: The image is larger than IMAGE_MAX_BYTES or has more than IMAGE_MAX_PIXELS pixels.
+      415:
+        description: The file is not a PNG or JPEG image, whatever its name says.
+      503:
+        description: The service is at capacity. Retry after the number of seconds in the Retry-After header.
     """
     # Check if the post request has the file part
     if 'image' not in request.files:
@@ -49,8 +134,80 @@ def manipulate_image():
     if not allowed_file(file.filename):
         return jsonify({'msg': 'Unsupported image format. Please provide a PNG, JPEG, or JPG file.'}), 400
 
+    if request.args.get('async', '').lower() == 'true':
+        job_id = job_service.submit(file)
+        return jsonify({'jobId': job_id, 'statusUrl': url_for('job_status', job_id=job_id)}), 202
+
+    try:
+        output = ImageOutput.from_request(request.args, request.headers)
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+
     # process the image
-    return ManipulateImageService.manipulate_image(file)
+    return ManipulateImageService.manipulate_image(file, output=output)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id: str):
+    """
+    Status and result of an image queued with /process-image?async=true.
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: The job. status is queued, running, succeeded or failed; stage is the pipeline stage it is in
+          (queued, detecting, classifying, rendering, done); result holds the status and body /process-image would
+          have answered with once the job is finished.
+      404:
+        description: Unknown or expired job id.
+    """
+    job = job_service.get(job_id)
+    if job is None:
+        return jsonify({'msg': 'Job not found'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/process-images', methods=['POST'])
+@admission.limit
+def manipulate_images():
+    """
+    Endpoint to process many images in one request.
+    ---
+    parameters:
+      - name: images
+        in: formData
+        type: file
+        required: true
+        description: The image files to be processed. A zip archive of images is expanded.
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: One JSON object per line and image, streamed as soon as each image is done. Every object has
+          the file name and the status the image would have got from /process-image.
+      400:
+        description: Bad request if no images are provided or there are too many of them.
+      503:
+        description: The service is at capacity. Retry after the number of seconds in the Retry-After header.
+    """
+    files = [file for file in request.files.getlist('images') if file.filename != '']
+    if not files:
+        return jsonify({'msg': 'No images provided'}), 400
+
+    try:
+        uploads = BatchImageService.read_uploads(files)
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+
+    def generate():
+        for result in BatchImageService.process_batch(uploads):
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # Helper function to check if the file is allowed
@@ -59,6 +216,21 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg'}
 
 
+# Uploads refused while the request body was read: too large, not an image, or too many pixels
+@app.errorhandler(UploadRejected)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_rejected(error: HTTPException):
+    return jsonify({'msg': error.description}), error.code
+
+
+# Requests refused by admission control, so they fail fast instead of queueing behind a slow backend
+@app.errorhandler(Overloaded)
+def overloaded(error: Overloaded):
+    response = jsonify({'msg': error.description})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+
 # Custom 404 error handler
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,214 @@
+import asyncio
+import fcntl
+import functools
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+from flask import current_app
+from werkzeug.exceptions import HTTPException
+
+from app import app, Constants
+from app.service.metrics import metrics
+
+
+class Overloaded(HTTPException):
+    """No capacity for another request right now; answered with 503 and ``Retry-After``."""
+    code = 503
+
+    def __init__(self, description: str, retry_after: int):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+
+class GlobalSlots:
+    """
+    In-flight slots shared by every worker process on the host: one lock file per slot in ``directory``, held with
+    ``flock`` while a request runs. The kernel drops the lock of a worker that dies, so a crashed worker never leaks
+    its slots.
+    """
+
+    def __init__(self, directory: str, slots: int):
+        self.paths = [os.path.join(directory, f'slot_{idx}.lock') for idx in range(slots)]
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self) -> Optional[int]:
+        """Returns the file descriptor holding a free slot, or None if all are taken."""
+        # start at a different slot every time so workers do not all contend for the first ones
+        start = int.from_bytes(os.urandom(2), 'little') % len(self.paths)
+        for path in self.paths[start:] + self.paths[:start]:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def release(fd: int) -> None:
+        # closing the descriptor drops the lock
+        os.close(fd)
+
+
+class AdmissionController:
+    """
+    Bounds the requests a worker process processes at once, so a slow backend makes excess requests fail fast
+    instead of piling up until every worker (and /health with it) is stuck.
+
+    Up to ``max_in_flight`` requests run at once. Up to ``max_queued`` more wait, each at most ``queue_timeout``
+    seconds, for one of them to finish. Anything beyond that is refused with ``Overloaded``. With ``global_slots``,
+    a request also needs one of the slots shared by all workers on the host, waiting for it within the same deadline.
+    Endpoints without the ``limit`` decorator, like /health and the Swagger UI, are never held up.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int = 0, queue_timeout: float = 1.0, retry_after: int = 1,
+                 global_slots: Optional[GlobalSlots] = None, poll_interval: float = 0.01):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.global_slots = global_slots
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> Optional[int]:
+        """
+        Waits for capacity and returns what ``release`` needs (the global slot's descriptor, if any), or raises
+        ``Overloaded``.
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.queued >= self.max_queued:
+                    self._reject('queue_full')
+                self.queued += 1
+                self._report()
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('queue_timeout')
+                        self._condition.wait(remaining)
+                finally:
+                    self.queued -= 1
+                    self._report()
+            self.in_flight += 1
+            self._report()
+
+        slot = None
+        if self.global_slots is not None:
+            slot = self.global_slots.try_acquire()
+            while slot is None and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                slot = self.global_slots.try_acquire()
+            if slot is None:
+                self.release(None)
+                self._reject('global_limit')
+        metrics.observe('valentine_admission_wait_seconds', time.monotonic() - started)
+        return slot
+
+    async def acquire_async(self) -> Optional[int]:
+        """
+        ``acquire`` for the event loop: a queued request polls for capacity every ``poll_interval`` seconds instead of
+        blocking the loop's thread. Sync and async requests share the same limits.
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._condition:
+            admitted = self._admit()
+            if not admitted:
+                if self.queued >= self.max_queued:
+                    self._reject('queue_full')
+                self.queued += 1
+                self._report()
+        if not admitted:
+            try:
+                while not admitted:
+                    if time.monotonic() >= deadline:
+                        self._reject('queue_timeout')
+                    await asyncio.sleep(self.poll_interval)
+                    with self._condition:
+                        admitted = self._admit()
+            finally:
+                with self._condition:
+                    self.queued -= 1
+                    self._report()
+
+        slot = None
+        try:
+            if self.global_slots is not None:
+                slot = self.global_slots.try_acquire()
+                while slot is None and time.monotonic() < deadline:
+                    await asyncio.sleep(self.poll_interval)
+                    slot = self.global_slots.try_acquire()
+                if slot is None:
+                    self._reject('global_limit')
+        except BaseException:
+            # refused or cancelled while waiting for a global slot
+            self.release(None)
+            raise
+        metrics.observe('valentine_admission_wait_seconds', time.monotonic() - started)
+        return slot
+
+    def _admit(self) -> bool:
+        # called holding the condition
+        if self.in_flight >= self.max_in_flight:
+            return False
+        self.in_flight += 1
+        self._report()
+        return True
+
+    def release(self, slot: Optional[int]) -> None:
+        if slot is not None:
+            GlobalSlots.release(slot)
+        with self._condition:
+            self.in_flight -= 1
+            self._report()
+            self._condition.notify()
+
+    def _reject(self, reason: str) -> None:
+        metrics.inc('valentine_admission_rejected_total', reason=reason)
+        raise Overloaded('The service is at capacity, please retry shortly.', self.retry_after)
+
+    def _report(self) -> None:
+        metrics.set('valentine_admission_in_flight', self.in_flight)
+        metrics.set('valentine_admission_queue_depth', self.queued)
+
+    def limit(self, view: Callable) -> Callable:
+        """Decorates a view so it only runs once admitted; the capacity is held until its response is sent."""
+
+        @functools.wraps(view)
+        def admitted_view(*args, **kwargs):
+            slot = self.acquire()
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                self.release(slot)
+                raise
+            # called once the response, streamed or not, has been sent
+            response.call_on_close(functools.partial(self.release, slot))
+            return response
+
+        return admitted_view
+
+
+def global_slots_from_config() -> Optional[GlobalSlots]:
+    slots = int(app.config.get(Constants.ADMISSION_GLOBAL_MAX_IN_FLIGHT))
+    if slots <= 0:
+        return None
+    directory = app.config.get(Constants.ADMISSION_LOCK_DIR) or os.path.join(tempfile.gettempdir(),
+                                                                           'valentine-admission')
+    return GlobalSlots(directory, slots)
+
+
+admission = AdmissionController(max_in_flight=int(app.config.get(Constants.ADMISSION_MAX_IN_FLIGHT)),
+                                max_queued=int(app.config.get(Constants.ADMISSION_MAX_QUEUED)),
+                                queue_timeout=float(app.config.get(Constants.ADMISSION_QUEUE_TIMEOUT)),
+                                retry_after=int(app.config.get(Constants.ADMISSION_RETRY_AFTER)),
+                                global_slots=global_slots_from_config())
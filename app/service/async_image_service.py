@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import app, Constants
+from app.model.image_context import ImageContext
+from app.model.prediction_model import PredictionModel
+from app.service.backends import Backends
+from app.service.image_service import ImageService, ManipulateImageService, result_cache, uploader
+from app.service.metrics import metrics
+from app.service.output import ImageOutput
+from app.service.uploader import Uploader
+from app.utils.utils import Utils
+
+
+class CpuPool:
+    """
+    The bounded pool the ASGI app runs CPU-bound stages on, so they never hold up the event loop: decoding, cropping,
+    encoding and compositing. Threads rather than processes: PIL, OpenCV and numpy release the GIL while they work,
+    and the stages change the request's decoded image in place, which a process would have to copy both ways.
+    """
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=int(app.config.get(Constants.ASGI_CPU_WORKERS)) or os.cpu_count() or 1,
+                        thread_name_prefix='cpu-stage')
+        return cls._executor
+
+    @classmethod
+    async def run(cls, fn: Callable[..., Any], *args) -> Any:
+        # in a copy of the caller's context, so the stage is traced as part of the request
+        future = asyncio.get_running_loop().run_in_executor(cls.executor(), contextvars.copy_context().run, fn, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # a thread cannot be stopped: let it finish before the request cleans up the state it works on
+            await asyncio.wait([future])
+            raise
+
+
+class AsyncManipulateImageService:
+    """
+    /process-image for the ASGI app: the same stages as ``ManipulateImageService``, but backend calls are awaited on
+    the event loop and CPU-bound stages run on the ``CpuPool``, so a worker holds no thread while a request waits on
+    the network. Returns the response body, status, ``Server-Timing`` header value and the rendered image, if any.
+    """
+
+    @staticmethod
+    async def manipulate_image(file_name: str, data: bytes, output: Optional[ImageOutput] = None) \
+            -> Tuple[Dict[str, Any], int, str, Optional[bytes]]:
+        output = output or ImageOutput()
+        with metrics.stage('save'):
+            context = await CpuPool.run(lambda: ImageContext(Utils.pre_append_date(file_name), data,
+                                                             on_disk=ImageService.pipeline_mode == ImageContext.DISK,
+                                                             directory=ImageService.pipeline_tmp_dir))
+        try:
+            metrics.inc('valentine_bytes_in_total', len(data))
+            # a photo we have already processed is answered without calling any backend
+            cache_keys, cached = await CpuPool.run(ManipulateImageService.lookup_cached, context)
+            if cached is not None:
+                body, status = await AsyncManipulateImageService.cached_result(context, cached, cache_keys, output)
+                return body, status, context.server_timing(), context.result
+
+            context.report_stage('detecting')
+            recognition_api_output, list_of_faces = await AsyncManipulateImageService.call_facial_detector_api(context)
+            if recognition_api_output is not None:
+                # archive the original image off the request path, unless the pre-filter already rejected it
+                await uploader.upload_later_async('original', context.data, Uploader.extension(context.file_name))
+            if not list_of_faces:
+                body, status = {'msg': 'No faces detected in the image'}, 400
+            else:
+                body, status = await AsyncManipulateImageService.process_image_with_faces(context, list_of_faces,
+                                                                                          output)
+            await CpuPool.run(result_cache.put, cache_keys,
+                              ManipulateImageService.cache_entry(status, body, list_of_faces, output))
+            return body, status, context.server_timing(), context.result
+        finally:
+            await CpuPool.run(context.cleanup)
+
+    @staticmethod
+    async def cached_result(context: ImageContext, cached: Dict[str, Any], cache_keys: List[str],
+                            output: ImageOutput) -> Tuple[Dict[str, Any], int]:
+        body, status = ManipulateImageService.cached_body(cached)
+        known_faces = ManipulateImageService.faces_to_render_again(cached, output)
+        if known_faces:
+            body['imageUrl'] = await AsyncManipulateImageService.render_and_upload(context, known_faces, output)
+            if output.delivery == ImageOutput.URL:
+                await CpuPool.run(result_cache.put, cache_keys,
+                                  {**cached, 'body': body, 'output': output.encoder.key})
+        return body, status
+
+    @staticmethod
+    async def call_facial_detector_api(context: ImageContext) -> Tuple[Any, List[Dict[str, Any]]]:
+        if not await CpuPool.run(ImageService.may_contain_faces, context):
+            metrics.observe('valentine_faces_per_image', 0)
+            return None, []
+        image_data = await CpuPool.run(ImageService.detection_payload, context)
+        with metrics.stage('detect', backend='face_detector'):
+            response = await Backends.call_async('face_detector', Backends.face_detector().detect_faces_async,
+                                                 image_data, idempotent=True)
+        return response, await CpuPool.run(ImageService.crop_faces, context, response)
+
+    @staticmethod
+    async def process_image_with_faces(context: ImageContext, list_of_faces: List[Dict],
+                                       output: ImageOutput) -> Tuple[Dict[str, Any], int]:
+        context.report_stage('classifying')
+        with metrics.stage('classify', backend='classifier'):
+            encoded_images = await CpuPool.run(
+                lambda: ImageService.classifier_payload([ImageContext.face_source(face) for face in list_of_faces]))
+            all_predictions = await Backends.call_async('classifier', Backends.classifier().classify_async,
+                                                        encoded_images, idempotent=True)
+        known_faces = ManipulateImageService.select_known_faces(list_of_faces, all_predictions)
+        if not known_faces:
+            return {'msg': 'No known face detected'}, 400
+        return await AsyncManipulateImageService.process_known_faces(context, known_faces, output), 200
+
+    @staticmethod
+    async def process_known_faces(context: ImageContext, known_faces: List[PredictionModel],
+                                  output: ImageOutput) -> Dict[str, Any]:
+        image_url = None
+        msg = 'NA'
+        if ManipulateImageService.has_decorations(known_faces):
+            image_url = await AsyncManipulateImageService.render_and_upload(context, known_faces, output)
+            msg = ManipulateImageService.message_for(known_faces[0].prediction_label)
+        return ManipulateImageService.result_body(known_faces, image_url, msg)
+
+    @staticmethod
+    async def render_and_upload(context: ImageContext, known_faces: List[PredictionModel],
+                                output: ImageOutput) -> Optional[str]:
+        # the result is kept on the context; it is only stored if the client wants its URL
+        context.report_stage('rendering')
+        context.result = await CpuPool.run(ManipulateImageService.render, context, known_faces, output.encoder)
+        if output.delivery != ImageOutput.URL:
+            return None
+        return await uploader.upload_async('modified', context.result, output.encoder.extension)
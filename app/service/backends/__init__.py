@@ -0,0 +1,159 @@
+import importlib
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+from app import app, Constants
+from app.service.backends.classifier import Classifier, FakeClassifier, VertexClassifier
+from app.service.backends.face_detector import FaceDetector, FakeFaceDetector, RekognitionFaceDetector
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.llm import CannedLLM, LLM, TogetherLLM
+from app.service.backends.object_store import LocalObjectStore, ObjectStore, S3ObjectStore
+from app.service.backends.outbound import Outbound, OutboundSettings
+from app.service.metrics import metrics
+
+CLOUD = 'cloud'
+LOCAL = 'local'
+
+
+class Backends:
+    """
+    The external services the pipeline talks to. Each one is either the real cloud service or an offline stand-in,
+    chosen per backend with ``<NAME>_BACKEND`` and defaulting to ``BACKEND_MODE``. Clients, and the cloud SDKs they
+    need, are created and imported on first use.
+    """
+    _instances: Dict[str, Any] = {}
+    # re-entrant: creating one backend may need another, e.g. the outbound settings
+    _lock = threading.RLock()
+
+    @staticmethod
+    def mode(setting: str) -> str:
+        return (app.config.get(setting) or app.config.get(Constants.BACKEND_MODE)).lower()
+
+    @staticmethod
+    def fault_injector(name: str) -> FaultInjector:
+        return FaultInjector.from_specs(name, app.config.get(Constants.LOCAL_BACKEND_LATENCY_MS),
+                                        app.config.get(Constants.LOCAL_BACKEND_ERROR_RATE))
+
+    @staticmethod
+    def _get(name: str, factory: Callable[[], Any]) -> Any:
+        instance = Backends._instances.get(name)
+        if instance is None:
+            with Backends._lock:
+                instance = Backends._instances.get(name)
+                if instance is None:
+                    instance = Backends._instances[name] = factory()
+        return instance
+
+    @staticmethod
+    def settings() -> OutboundSettings:
+        def create() -> OutboundSettings:
+            # by default one connection per thread of this worker that may call a backend at the same time
+            pool_size = app.config.get(Constants.OUTBOUND_POOL_SIZE) or (
+                    int(app.config.get(Constants.PIPELINE_MAX_WORKERS)) + int(app.config.get(Constants.JOB_WORKERS)))
+            return OutboundSettings(pool_size=int(pool_size),
+                                    connect_timeout_ms=app.config.get(Constants.OUTBOUND_CONNECT_TIMEOUT_MS),
+                                    read_timeout_ms=app.config.get(Constants.OUTBOUND_READ_TIMEOUT_MS),
+                                    max_retries=int(app.config.get(Constants.OUTBOUND_MAX_RETRIES)),
+                                    hedge_after_ms=app.config.get(Constants.HEDGE_AFTER_MS),
+                                    hedge_max_in_flight=int(app.config.get(Constants.HEDGE_MAX_IN_FLIGHT)))
+
+        return Backends._get('settings', create)
+
+    @staticmethod
+    def outbound() -> Outbound:
+        counters = {'retry': 'valentine_backend_retries_total', 'hedge': 'valentine_backend_hedges_total',
+                    'hedge_won': 'valentine_backend_hedge_wins_total'}
+
+        def count(event: str, backend: str) -> None:
+            metrics.inc(counters[event], backend=backend)
+
+        return Backends._get('outbound', lambda: Outbound(Backends.settings(), on_event=count))
+
+    @staticmethod
+    def call(name: str, method: Callable[..., Any], *args, idempotent: bool = False) -> Any:
+        """
+        Calls ``method``, bound to the backend called ``name``, through the outbound layer: retried on the errors the
+        backend reports as transient and, if ``idempotent``, hedged.
+        """
+        return Backends.outbound().call(name, method, *args, retryable=method.__self__.retryable,
+                                        idempotent=idempotent)
+
+    @staticmethod
+    async def call_async(name: str, method: Callable[..., Awaitable[Any]], *args, idempotent: bool = False) -> Any:
+        """``call`` for the coroutine methods of a backend, e.g. ``detect_faces_async``."""
+        return await Backends.outbound().call_async(name, method, *args, retryable=method.__self__.retryable,
+                                                    idempotent=idempotent)
+
+    @staticmethod
+    def preload() -> None:
+        """
+        Import the SDKs of the configured cloud backends without creating any client. Run in the gunicorn master
+        before forking, so the workers share the imported modules instead of each importing them on first use.
+        """
+        for setting, cloud_backend in ((Constants.OBJECT_STORE_BACKEND, S3ObjectStore),
+                                       (Constants.FACE_DETECTOR_BACKEND, RekognitionFaceDetector),
+                                       (Constants.CLASSIFIER_BACKEND, VertexClassifier),
+                                       (Constants.LLM_BACKEND, TogetherLLM)):
+            if Backends.mode(setting) == CLOUD:
+                for module in cloud_backend.sdk_modules:
+                    importlib.import_module(module)
+
+    @staticmethod
+    def reset() -> None:
+        """Forget the created clients, e.g. after changing the configuration."""
+        with Backends._lock:
+            Backends._instances.clear()
+
+    @staticmethod
+    def object_store() -> ObjectStore:
+        def create() -> ObjectStore:
+            if Backends.mode(Constants.OBJECT_STORE_BACKEND) == LOCAL:
+                return LocalObjectStore(app.config.get(Constants.LOCAL_OBJECT_STORE_PATH),
+                                        fault_injector=Backends.fault_injector('object_store'))
+            return S3ObjectStore(app.config.get(Constants.AWS_S3_BUCKET_NAME),
+                                 aws_access_key_id=app.config.get(Constants.AWS_ACCESS_KEY_ID),
+                                 aws_secret_access_key=app.config.get(Constants.AWS_SECRET_ACCESS_KEY),
+                                 settings=Backends.settings(),
+                                 multipart_threshold_mb=int(app.config.get(Constants.UPLOAD_MULTIPART_THRESHOLD_MB)),
+                                 multipart_chunksize_mb=int(app.config.get(Constants.UPLOAD_MULTIPART_CHUNKSIZE_MB)),
+                                 max_concurrency=int(app.config.get(Constants.UPLOAD_MAX_CONCURRENCY)))
+
+        return Backends._get('object_store', create)
+
+    @staticmethod
+    def face_detector() -> FaceDetector:
+        def create() -> FaceDetector:
+            if Backends.mode(Constants.FACE_DETECTOR_BACKEND) == LOCAL:
+                return FakeFaceDetector.from_spec(app.config.get(Constants.FAKE_FACES_PER_IMAGE),
+                                                  fault_injector=Backends.fault_injector('face_detector'))
+            return RekognitionFaceDetector(app.config.get(Constants.AWS_REGION),
+                                           aws_access_key_id=app.config.get(Constants.AWS_ACCESS_KEY_ID),
+                                           aws_secret_access_key=app.config.get(Constants.AWS_SECRET_ACCESS_KEY),
+                                           settings=Backends.settings())
+
+        return Backends._get('face_detector', create)
+
+    @staticmethod
+    def classifier() -> Classifier:
+        def create() -> Classifier:
+            if Backends.mode(Constants.CLASSIFIER_BACKEND) == LOCAL:
+                return FakeClassifier(app.config.get(Constants.FAKE_CLASSIFIER_LABEL),
+                                      fault_injector=Backends.fault_injector('classifier'),
+                                      top_k=int(app.config.get(Constants.CLASSIFIER_TOP_K)))
+            return VertexClassifier(app.config.get(Constants.GOOGLE_PROJECT_ID),
+                                    app.config.get(Constants.GOOGLE_REGION),
+                                    app.config.get(Constants.GOOGLE_ENDPOINT_ID),
+                                    max_batch_size=int(app.config.get(Constants.CLASSIFIER_MAX_BATCH_SIZE)),
+                                    settings=Backends.settings(),
+                                    top_k=int(app.config.get(Constants.CLASSIFIER_TOP_K)))
+
+        return Backends._get('classifier', create)
+
+    @staticmethod
+    def llm() -> LLM:
+        def create() -> LLM:
+            if Backends.mode(Constants.LLM_BACKEND) == LOCAL:
+                return CannedLLM(fault_injector=Backends.fault_injector('llm'))
+            return TogetherLLM(app.config.get(Constants.TOGETHER_AI_API_KEY), settings=Backends.settings())
+
+        return Backends._get('llm', create)
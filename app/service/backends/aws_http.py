@@ -0,0 +1,93 @@
+import asyncio
+from typing import Dict, Optional
+
+from app.service.backends.outbound import OutboundSettings
+
+
+class AwsHttpError(Exception):
+    """An AWS API call answered with an error, or that did not get an answer at all."""
+
+    # error codes AWS answers with when it is overloaded rather than when the request is wrong
+    throttling_codes = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+                        'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'SlowDown',
+                        'TooManyRequestsException', 'LimitExceededException'}
+
+    def __init__(self, message: str, status: Optional[int] = None, code: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status >= 500 or self.status == 429 or self.code in self.throttling_codes
+
+
+class AwsAsyncClient:
+    """
+    Sends AWS API requests with httpx's async client, signed with SigV4 by botocore. boto3 only has blocking clients,
+    and the ASGI app awaits its backend calls instead of holding a thread for each of them.
+
+    Every event loop gets an httpx client of its own, with the pool size and timeouts of ``backend`` in ``settings``.
+    Credentials are resolved like boto3 does, and refreshed if they expire.
+    """
+
+    def __init__(self, service: str, region_name: str, aws_access_key_id: str = None,
+                 aws_secret_access_key: str = None, settings: OutboundSettings = None, backend: str = None):
+        import boto3
+
+        self.service = service
+        self.region_name = region_name
+        self.backend = backend or service
+        self.settings = settings or OutboundSettings()
+        self.credentials = boto3.Session(aws_access_key_id=aws_access_key_id,
+                                         aws_secret_access_key=aws_secret_access_key,
+                                         region_name=region_name).get_credentials()
+        self._clients: Dict[asyncio.AbstractEventLoop, object] = {}
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            # clients of loops that were closed, e.g. by tests, are dropped
+            self._clients = {other: other_client for other, other_client in self._clients.items()
+                             if not other.is_closed()}
+            client = self._clients[loop] = self.settings.async_httpx_client(self.backend)
+        return client
+
+    def sign(self, method: str, url: str, headers: Dict[str, str], content: bytes) -> Dict[str, str]:
+        from botocore.auth import S3SigV4Auth, SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        if self.credentials is None:
+            raise AwsHttpError(f'No AWS credentials to call {self.service}', status=403)
+        request = AWSRequest(method=method, url=url, data=content, headers=headers)
+        # S3 signs the payload hash too
+        auth = S3SigV4Auth if self.service == 's3' else SigV4Auth
+        auth(self.credentials.get_frozen_credentials(), self.service, self.region_name).add_auth(request)
+        return dict(request.headers.items())
+
+    async def request(self, method: str, url: str, headers: Dict[str, str] = None, content: bytes = b''):
+        """Sends a signed request and returns the httpx response. Raises ``AwsHttpError`` for 5xx answers."""
+        import httpx
+
+        signed_headers = self.sign(method, url, dict(headers or {}), content)
+        try:
+            response = await self.client().request(method, url, headers=signed_headers, content=content)
+        except httpx.TransportError as e:
+            raise AwsHttpError(f'{self.service} {method} failed: {e!r}') from e
+        if response.status_code >= 500:
+            raise AwsHttpError(f'{self.service} answered {response.status_code}', status=response.status_code)
+        return response
+
+    async def json_request(self, target: str, payload: bytes) -> dict:
+        """Calls an operation of a JSON protocol API like Rekognition's, e.g. ``RekognitionService.DetectFaces``."""
+        response = await self.request('POST', f'https://{self.service}.{self.region_name}.amazonaws.com/',
+                                      headers={'Content-Type': 'application/x-amz-json-1.1', 'X-Amz-Target': target},
+                                      content=payload)
+        body = response.json() if response.content else {}
+        if response.status_code >= 400:
+            code = body.get('__type', '').rsplit('#', 1)[-1] or None
+            raise AwsHttpError(f"{target} failed with {response.status_code} {code}: "
+                               f"{body.get('message') or body.get('Message') or ''}",
+                               status=response.status_code, code=code)
+        return body
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.model.prediction_model import PredictionModel
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.outbound import OutboundSettings
+from app.utils.utils import Utils
+
+
+class Classifier:
+    """Identifies the person in each base64-encoded face crop; returns one prediction list per crop, in order."""
+
+    def classify(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        raise NotImplementedError
+
+    async def classify_async(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        """``classify`` for the event loop; classifiers without an async client run it on a thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.classify, encoded_images)
+
+    def retryable(self, error: Exception) -> bool:
+        """Whether ``error`` is transient and the call may be retried."""
+        return isinstance(error, BackendError)
+
+
+class VertexClassifier(Classifier):
+    """
+    The image classification model deployed on a Vertex AI endpoint. The Vertex AI SDK takes most of a second to
+    import, so it is only imported once the classifier is created.
+
+    The model answers with the ``top_k`` most confident labels of each crop, best first.
+    """
+    sdk_modules = ('google.cloud.aiplatform', 'google.cloud.aiplatform.gapic.schema')
+
+    def __init__(self, project_id: str, region: str, endpoint_id: str, max_batch_size: int = 16,
+                 settings: OutboundSettings = None, top_k: int = 1):
+        from google.cloud import aiplatform
+
+        self.max_batch_size = max(1, max_batch_size)
+        self.top_k = max(1, top_k)
+        settings = settings or OutboundSettings()
+        self.timeout = settings.read_timeout('classifier')
+        # Initialize PredictionServiceClient
+        self.client_options = {"api_endpoint": f"{region}-aiplatform.googleapis.com"}
+        self.prediction_client = aiplatform.gapic.PredictionServiceClient(client_options=self.client_options)
+        self._async_clients: Dict[asyncio.AbstractEventLoop, Any] = {}
+        # Prepare the endpoint name
+        self.endpoint = self.prediction_client.endpoint_path(project=project_id, location=region,
+                                                             endpoint=endpoint_id)
+
+    def classify(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        instances, parameters = VertexClassifier.request_payload(encoded_images, self.top_k)
+        predictions: List[List[PredictionModel]] = []
+        for start in range(0, len(instances), self.max_batch_size):
+            # Make the prediction request
+            response = self.prediction_client.predict(
+                instances=instances[start:start + self.max_batch_size],
+                parameters=parameters,
+                endpoint=self.endpoint,
+                # retried by the outbound layer, see retryable
+                retry=None,
+                timeout=self.timeout,
+            )
+            predictions.extend(VertexClassifier.parse_predictions(response, self.top_k))
+        return predictions
+
+    async def classify_async(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        instances, parameters = VertexClassifier.request_payload(encoded_images, self.top_k)
+        client = self.async_prediction_client()
+        # all batches are in flight at once
+        responses = await asyncio.gather(*(
+            client.predict(instances=instances[start:start + self.max_batch_size], parameters=parameters,
+                           endpoint=self.endpoint, retry=None, timeout=self.timeout)
+            for start in range(0, len(instances), self.max_batch_size)))
+        return [prediction for response in responses
+                for prediction in VertexClassifier.parse_predictions(response, self.top_k)]
+
+    def async_prediction_client(self):
+        # a gRPC asyncio channel belongs to the event loop it was created on
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            from google.cloud import aiplatform
+
+            self._async_clients = {other: other_client for other, other_client in self._async_clients.items()
+                                   if not other.is_closed()}
+            client = self._async_clients[loop] = aiplatform.gapic.PredictionServiceAsyncClient(
+                client_options=self.client_options)
+        return client
+
+    @staticmethod
+    def request_payload(encoded_images: List[str], top_k: int = 1) -> Tuple[List[Any], Any]:
+        from google.cloud.aiplatform.gapic.schema import predict
+
+        # Prepare the request payload. The format of each instance should conform to the deployed model's prediction
+        # input schema.
+        instances = [
+            predict.instance.ImageClassificationPredictionInstance(content=encoded_content).to_value()
+            for encoded_content in encoded_images
+        ]
+        parameters = predict.params.ImageClassificationPredictionParams(
+            confidence_threshold=0.5,
+            max_predictions=top_k,
+        ).to_value()
+        return instances, parameters
+
+    @staticmethod
+    def parse_predictions(response, top_k: Optional[int] = None) -> List[List[PredictionModel]]:
+        """
+        One prediction list per instance, in request order, of the ``top_k`` most confident labels (all if None).
+        The fields are read straight from the protocol buffer Struct of each prediction: converting the whole
+        response to dictionaries first copies every label, confidence and id only to keep a few of them.
+        """
+        return [VertexClassifier.parse_prediction(prediction.struct_value.fields, top_k)
+                for prediction in type(response).pb(response).predictions]
+
+    @staticmethod
+    def parse_prediction(fields, top_k: Optional[int] = None) -> List[PredictionModel]:
+        labels = fields['displayNames'].list_value.values
+        confidences = [value.number_value for value in fields['confidences'].list_value.values]
+        ids = fields['ids'].list_value.values
+        return [PredictionModel(labels[idx].string_value, confidences[idx], ids[idx].string_value)
+                for idx in Utils.top_indices(confidences, top_k)]
+
+    def retryable(self, error: Exception) -> bool:
+        from google.api_core.retry import if_transient_error
+
+        return if_transient_error(error)
+
+
+class FakeClassifier(Classifier):
+    """
+    Offline stand-in for the Vertex AI model. Every crop is labelled ``label`` with a confidence derived from the
+    crop's bytes, followed by 'Unknown' with the remaining confidence, cut to the ``top_k`` first like the model's.
+    """
+
+    def __init__(self, label: str = 'Mary', fault_injector: FaultInjector = None, top_k: Optional[int] = None):
+        self.label = label
+        self.top_k = top_k
+        self.fault_injector = fault_injector or FaultInjector('classifier')
+
+    def classify(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        self.fault_injector()
+        return self.answer(encoded_images)
+
+    async def classify_async(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        await self.fault_injector.call_async()
+        return self.answer(encoded_images)
+
+    def answer(self, encoded_images: List[str]) -> List[List[PredictionModel]]:
+        predictions = []
+        for encoded_content in encoded_images:
+            digest = hashlib.sha256(encoded_content.encode('utf-8')).digest()
+            confidence = 0.6 + digest[0] / 255.0 * 0.39
+            predictions.append(Utils.convert_dict_to_list_of_models({
+                'displayNames': [self.label, 'Unknown'],
+                'confidences': [confidence, 1 - confidence],
+                'ids': ['1', '2'],
+            }, self.top_k))
+        return predictions
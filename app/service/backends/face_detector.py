@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import hashlib
+import json
+from typing import Any, Dict
+
+from app.service.backends.aws_http import AwsAsyncClient, AwsHttpError
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.outbound import OutboundSettings
+
+
+class FaceDetector:
+    """Detects faces in encoded image bytes and answers in the shape of Rekognition's DetectFaces response."""
+
+    def detect_faces(self, image_data: bytes) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def detect_faces_async(self, image_data: bytes) -> Dict[str, Any]:
+        """``detect_faces`` for the event loop; detectors without an async client run it on a thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.detect_faces, image_data)
+
+    def retryable(self, error: Exception) -> bool:
+        """Whether ``error`` is transient and the call may be retried."""
+        return isinstance(error, BackendError)
+
+
+class RekognitionFaceDetector(FaceDetector):
+    sdk_modules = ('boto3',)
+
+    def __init__(self, region_name: str, aws_access_key_id: str = None, aws_secret_access_key: str = None,
+                 settings: OutboundSettings = None):
+        import boto3
+
+        self.rekognition = boto3.client('rekognition',
+                                        aws_access_key_id=aws_access_key_id,
+                                        aws_secret_access_key=aws_secret_access_key,
+                                        region_name=region_name,
+                                        config=(settings or OutboundSettings()).boto_config('face_detector'))
+        self.async_client = AwsAsyncClient('rekognition', region_name, aws_access_key_id=aws_access_key_id,
+                                           aws_secret_access_key=aws_secret_access_key, settings=settings,
+                                           backend='face_detector')
+
+    def detect_faces(self, image_data: bytes) -> Dict[str, Any]:
+        return self.rekognition.detect_faces(
+            Image={'Bytes': image_data},
+            Attributes=['GENDER']  # Change attributes as needed, 'ALL' will return all available attributes
+        )
+
+    async def detect_faces_async(self, image_data: bytes) -> Dict[str, Any]:
+        payload = json.dumps({'Image': {'Bytes': base64.b64encode(image_data).decode('ascii')},
+                              'Attributes': ['GENDER']}).encode('utf-8')
+        return await self.async_client.json_request('RekognitionService.DetectFaces', payload)
+
+    def retryable(self, error: Exception) -> bool:
+        # botocore already retried errors of the blocking client, the async one is retried by the outbound layer
+        return isinstance(error, AwsHttpError) and error.retryable
+
+
+class FakeFaceDetector(FaceDetector):
+    """
+    Offline stand-in for Rekognition. Returns between ``faces_per_image`` and ``max_faces_per_image`` faces laid out
+    side by side, with Rekognition-shaped ``FaceDetails``, ``BoundingBox``, ``Landmarks`` and ``Gender``. Faces
+    alternate between Female and Male. The face count and layout are derived from the image bytes, so the same upload
+    always gets the same answer.
+    """
+
+    def __init__(self, faces_per_image: int = 1, max_faces_per_image: int = None,
+                 fault_injector: FaultInjector = None):
+        self.faces_per_image = faces_per_image
+        self.max_faces_per_image = max(max_faces_per_image or faces_per_image, faces_per_image)
+        self.fault_injector = fault_injector or FaultInjector('face_detector')
+
+    @classmethod
+    def from_spec(cls, spec: str, fault_injector: FaultInjector = None) -> 'FakeFaceDetector':
+        """``spec`` is a face count like ``"1"`` or a range like ``"0-3"``."""
+        low, _, high = spec.partition('-')
+        return cls(int(low), int(high) if high else None, fault_injector=fault_injector)
+
+    def detect_faces(self, image_data: bytes) -> Dict[str, Any]:
+        self.fault_injector()
+        return self.answer(image_data)
+
+    async def detect_faces_async(self, image_data: bytes) -> Dict[str, Any]:
+        await self.fault_injector.call_async()
+        return self.answer(image_data)
+
+    def answer(self, image_data: bytes) -> Dict[str, Any]:
+        digest = hashlib.sha256(image_data).digest()
+        face_count = self.faces_per_image + digest[-1] % (self.max_faces_per_image - self.faces_per_image + 1)
+        face_details = []
+        slot_width = 1.0 / max(face_count, 1)
+        for idx in range(face_count):
+            # up to +-10% of the slot, derived from the image bytes
+            jitter = (digest[idx % len(digest)] / 255.0 - 0.5) * 0.2 * slot_width
+            width = slot_width * 0.6
+            left = idx * slot_width + slot_width * 0.2 + jitter
+            top, height = 0.2, 0.5
+            face_details.append({
+                'BoundingBox': {'Width': width, 'Height': height, 'Left': left, 'Top': top},
+                'Landmarks': [
+                    {'Type': 'eyeLeft', 'X': left + width * 0.3, 'Y': top + height * 0.35},
+                    {'Type': 'eyeRight', 'X': left + width * 0.7, 'Y': top + height * 0.35},
+                    {'Type': 'mouthLeft', 'X': left + width * 0.35, 'Y': top + height * 0.75},
+                    {'Type': 'mouthRight', 'X': left + width * 0.65, 'Y': top + height * 0.75},
+                    {'Type': 'nose', 'X': left + width * 0.5, 'Y': top + height * 0.55},
+                ],
+                'Gender': {'Value': 'Female' if idx % 2 == 0 else 'Male', 'Confidence': 99.0},
+                'Confidence': 99.9,
+            })
+        return {'FaceDetails': face_details, 'ResponseMetadata': {'HTTPStatusCode': 200}}
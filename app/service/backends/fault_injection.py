@@ -0,0 +1,75 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class BackendError(Exception):
+    """A failure injected into, or raised by, a backend stand-in."""
+
+
+class FaultInjector:
+    """
+    Adds latency and random failures to the local backend stand-ins so the pipeline can be load tested under
+    realistic backend behaviour without cloud credentials.
+
+    Each call sleeps ``latency_seconds`` scaled by a random factor in [1 - jitter, 1 + jitter], then raises
+    ``BackendError`` with probability ``error_rate``.
+    """
+
+    def __init__(self, name: str, latency_seconds: float = 0.0, error_rate: float = 0.0, jitter: float = 0.25,
+                 seed: int = None):
+        self.name = name
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self) -> None:
+        delay, fail = self._draw()
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise BackendError(f"Injected {self.name} failure")
+
+    async def call_async(self) -> None:
+        """The same as calling the injector, but waits without holding up the event loop."""
+        delay, fail = self._draw()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fail:
+            raise BackendError(f"Injected {self.name} failure")
+
+    def _draw(self) -> Tuple[float, bool]:
+        with self._lock:
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            fail = self._random.random() < self.error_rate
+        return self.latency_seconds * factor, fail
+
+    @staticmethod
+    def parse_spec(spec: str) -> Dict[str, float]:
+        """
+        Parses settings like ``"40"`` (every backend) or ``"20,face_detector=250,llm=1500"`` into a dict keyed by
+        backend name, with the bare value stored under ``"default"``.
+        """
+        values: Dict[str, float] = {}
+        for part in (spec or '').split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '=' in part:
+                name, value = part.split('=', 1)
+                values[name.strip()] = float(value)
+            else:
+                values['default'] = float(part)
+        return values
+
+    @classmethod
+    def from_specs(cls, name: str, latency_ms_spec: str, error_rate_spec: str) -> 'FaultInjector':
+        latency = cls.parse_spec(latency_ms_spec)
+        error_rate = cls.parse_spec(error_rate_spec)
+        return cls(name,
+                   latency_seconds=latency.get(name, latency.get('default', 0.0)) / 1000.0,
+                   error_rate=error_rate.get(name, error_rate.get('default', 0.0)))
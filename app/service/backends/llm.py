@@ -0,0 +1,69 @@
+import hashlib
+
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.outbound import OutboundSettings
+
+
+class LLM:
+    """Completes a single user prompt."""
+
+    def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def retryable(self, error: Exception) -> bool:
+        """Whether ``error`` is transient and the call may be retried."""
+        return isinstance(error, BackendError)
+
+
+class TogetherLLM(LLM):
+    sdk_modules = ('openai',)
+
+    def __init__(self, api_key: str, model: str = "mistralai/Mixtral-8x7B-Instruct-v0.1",
+                 settings: OutboundSettings = None):
+        from openai import OpenAI
+
+        settings = settings or OutboundSettings()
+        self.model = model
+        # the client retries with exponential backoff and jitter itself
+        self.client = OpenAI(api_key=api_key,
+                             base_url='https://api.together.xyz',
+                             max_retries=settings.max_retries,
+                             http_client=settings.httpx_client('llm'),
+                             )
+
+    def complete(self, prompt: str) -> str:
+        chat_completion = self.client.chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+
+                    "content": prompt
+                }
+            ],
+            model=self.model,
+            temperature=0.9,
+            top_p=0.9,
+            max_tokens=1024)
+
+        return chat_completion.choices[0].message.content
+
+    def retryable(self, error: Exception) -> bool:
+        # the OpenAI client already retried it
+        return False
+
+
+class CannedLLM(LLM):
+    """Offline stand-in for the LLM: answers with one of a few fixed sentences, picked by the prompt."""
+    responses = [
+        'You are the light of my life and the reason I smile every day.',
+        'Every moment with you is a gift I will always treasure.',
+        'My heart is yours today, tomorrow and always.',
+    ]
+
+    def __init__(self, fault_injector: FaultInjector = None):
+        self.fault_injector = fault_injector or FaultInjector('llm')
+
+    def complete(self, prompt: str) -> str:
+        self.fault_injector()
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return CannedLLM.responses[digest[0] % len(CannedLLM.responses)]
@@ -0,0 +1,165 @@
+import asyncio
+import io
+import mimetypes
+import os
+import threading
+from urllib.parse import quote
+
+from app.service.backends.aws_http import AwsAsyncClient, AwsHttpError
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.outbound import OutboundSettings
+
+# results may be WebP, which older Pythons do not know the type of
+mimetypes.add_type('image/webp', '.webp')
+
+
+class ObjectStore:
+    """Where original and modified images are stored. Returns the public URL of every stored object."""
+
+    base_url = ''
+
+    def put(self, key: str, data: bytes) -> str:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """Whether an object is stored under ``key``, so content-addressed objects are never uploaded twice."""
+        return False
+
+    def url(self, key: str) -> str:
+        return self.base_url + key
+
+    async def put_async(self, key: str, data: bytes) -> str:
+        """``put`` for the event loop; stores without an async client run it on a thread."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, key, data)
+
+    async def exists_async(self, key: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(None, self.exists, key)
+
+    def put_file(self, key: str, file_path: str) -> str:
+        with open(file_path, 'rb') as file:
+            return self.put(key, file.read())
+
+    def retryable(self, error: Exception) -> bool:
+        """Whether ``error`` is transient and the call may be retried."""
+        return isinstance(error, BackendError)
+
+
+class S3ObjectStore(ObjectStore):
+    sdk_modules = ('boto3',)
+
+    def __init__(self, bucket_name: str, aws_access_key_id: str = None, aws_secret_access_key: str = None,
+                 settings: OutboundSettings = None, multipart_threshold_mb: int = 8, multipart_chunksize_mb: int = 8,
+                 max_concurrency: int = 4):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket_name = bucket_name
+        self.multipart_threshold = multipart_threshold_mb * 1024 * 1024
+        # objects above the threshold are sent as parts of the chunk size, up to max_concurrency of them at once
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold_mb * 1024 * 1024,
+                                              multipart_chunksize=multipart_chunksize_mb * 1024 * 1024,
+                                              max_concurrency=max_concurrency,
+                                              use_threads=max_concurrency > 1)
+        self.base_url = f"https://{bucket_name}.s3.amazonaws.com/"
+        self.s3 = boto3.client('s3',
+                               aws_access_key_id=aws_access_key_id,
+                               aws_secret_access_key=aws_secret_access_key,
+                               config=(settings or OutboundSettings()).boto_config('object_store'))
+        self.async_client = AwsAsyncClient('s3', self.s3.meta.region_name or 'us-east-1',
+                                           aws_access_key_id=aws_access_key_id,
+                                           aws_secret_access_key=aws_secret_access_key, settings=settings,
+                                           backend='object_store')
+
+    @staticmethod
+    def extra_args(key: str):
+        content_type = mimetypes.guess_type(key)[0]
+        return {'ACL': 'public-read', **({'ContentType': content_type} if content_type else {})}
+
+    def put(self, key: str, data: bytes) -> str:
+        # streamed from memory, never written to disk first
+        self.s3.upload_fileobj(io.BytesIO(data), self.bucket_name, key, ExtraArgs=S3ObjectStore.extra_args(key),
+                               Config=self.transfer_config)
+        return self.base_url + key
+
+    def put_file(self, key: str, file_path: str) -> str:
+        self.s3.upload_file(file_path, self.bucket_name, key, ExtraArgs=S3ObjectStore.extra_args(key),
+                            Config=self.transfer_config)
+        return self.base_url + key
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            # 403 when the credentials may not list the bucket: upload rather than guess
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', '403'):
+                return False
+            raise
+
+    def object_url(self, key: str) -> str:
+        # the regional endpoint, the global one redirects requests for buckets outside us-east-1
+        return f"https://{self.bucket_name}.s3.{self.async_client.region_name}.amazonaws.com/{quote(key)}"
+
+    async def put_async(self, key: str, data: bytes) -> str:
+        if len(data) >= self.multipart_threshold:
+            # large objects are sent in parts, which only the transfer manager of the blocking client does
+            return await super().put_async(key, data)
+        extra_args = S3ObjectStore.extra_args(key)
+        headers = {'x-amz-acl': 'public-read'}
+        if 'ContentType' in extra_args:
+            headers['Content-Type'] = extra_args['ContentType']
+        response = await self.async_client.request('PUT', self.object_url(key), headers=headers, content=data)
+        if response.status_code >= 300:
+            raise AwsHttpError(f'Storing {key} failed with {response.status_code}', status=response.status_code)
+        return self.base_url + key
+
+    async def exists_async(self, key: str) -> bool:
+        response = await self.async_client.request('HEAD', self.object_url(key))
+        if response.status_code in (404, 403):
+            return False
+        if response.status_code >= 300:
+            raise AwsHttpError(f'Looking up {key} failed with {response.status_code}', status=response.status_code)
+        return True
+
+    def retryable(self, error: Exception) -> bool:
+        # botocore already retried errors of the blocking client, the async one is retried by the outbound layer
+        return isinstance(error, AwsHttpError) and error.retryable
+
+
+class LocalObjectStore(ObjectStore):
+    """Offline stand-in for S3 that writes objects below a local directory."""
+
+    def __init__(self, root: str, base_url: str = None, fault_injector: FaultInjector = None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url or f"file://{self.root}/"
+        self.fault_injector = fault_injector or FaultInjector('object_store')
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def put(self, key: str, data: bytes) -> str:
+        self.fault_injector()
+        return self.write(key, data)
+
+    async def put_async(self, key: str, data: bytes) -> str:
+        await self.fault_injector.call_async()
+        return await asyncio.get_running_loop().run_in_executor(None, self.write, key, data)
+
+    def write(self, key: str, data: bytes) -> str:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so readers never see a partial object
+        temp_path = f"{path}.{threading.get_ident()}.part"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        return self.base_url + key
+
+    def exists(self, key: str) -> bool:
+        self.fault_injector()
+        return os.path.exists(os.path.join(self.root, key))
+
+    async def exists_async(self, key: str) -> bool:
+        await self.fault_injector.call_async()
+        return os.path.exists(os.path.join(self.root, key))
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.service.backends.fault_injection import FaultInjector
+
+
+class OutboundSettings:
+    """
+    Connection pool size, timeouts, retries and hedging of the calls to every backend. Timeouts and hedge delays
+    are specs like ``LOCAL_BACKEND_LATENCY_MS``: one value for every backend or per backend, e.g.
+    ``"10000,llm=60000"``.
+    """
+
+    def __init__(self, pool_size: int = 16, connect_timeout_ms: str = '2000', read_timeout_ms: str = '10000',
+                 max_retries: int = 2, retry_base_delay: float = 0.1, retry_max_delay: float = 2.0,
+                 hedge_after_ms: str = '0', hedge_max_in_flight: int = 4):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_max_in_flight = hedge_max_in_flight
+        self._connect_timeout_ms = FaultInjector.parse_spec(connect_timeout_ms)
+        self._read_timeout_ms = FaultInjector.parse_spec(read_timeout_ms)
+        self._hedge_after_ms = FaultInjector.parse_spec(hedge_after_ms)
+
+    @staticmethod
+    def _seconds(spec: Dict[str, float], backend: str) -> float:
+        return spec.get(backend, spec.get('default', 0.0)) / 1000.0
+
+    def connect_timeout(self, backend: str) -> float:
+        return self._seconds(self._connect_timeout_ms, backend)
+
+    def read_timeout(self, backend: str) -> float:
+        return self._seconds(self._read_timeout_ms, backend)
+
+    def hedge_after(self, backend: str) -> float:
+        """Seconds to wait for a call before sending a second, identical one; 0 disables hedging."""
+        return self._seconds(self._hedge_after_ms, backend)
+
+    def boto_config(self, backend: str):
+        from botocore.config import Config
+
+        # 'standard' retries back off exponentially with jitter; max_attempts includes the first attempt
+        return Config(max_pool_connections=self.pool_size,
+                      connect_timeout=self.connect_timeout(backend),
+                      read_timeout=self.read_timeout(backend),
+                      retries={'mode': 'standard', 'max_attempts': self.max_retries + 1},
+                      tcp_keepalive=True)
+
+    def httpx_client(self, backend: str):
+        import httpx
+
+        return httpx.Client(timeout=httpx.Timeout(self.read_timeout(backend), connect=self.connect_timeout(backend)),
+                            limits=httpx.Limits(max_connections=self.pool_size,
+                                                max_keepalive_connections=self.pool_size))
+
+    def async_httpx_client(self, backend: str):
+        import httpx
+
+        return httpx.AsyncClient(timeout=httpx.Timeout(self.read_timeout(backend),
+                                                       connect=self.connect_timeout(backend)),
+                                 limits=httpx.Limits(max_connections=self.pool_size,
+                                                     max_keepalive_connections=self.pool_size))
+
+
+class Outbound:
+    """
+    Runs backend calls with bounded, jittered retries and, for idempotent calls, optional hedging.
+
+    Retries here only cover errors the backend itself reports as transient through its ``retryable`` method. The
+    AWS and OpenAI clients already retry inside their SDKs, configured from the same settings, so they report
+    nothing as retryable and are not retried twice.
+
+    A hedged call that has not returned after ``hedge_after`` seconds is sent a second time and the first answer
+    wins, so one slow backend call does not set the request's latency. At most ``hedge_max_in_flight`` hedges run
+    at once, so a backend that is slow for everyone does not get twice the load.
+
+    ``call_async`` does the same for coroutine functions, on the event loop instead of the hedge threads; the call
+    that loses a hedge is cancelled.
+    """
+
+    def __init__(self, settings: OutboundSettings, on_event: Optional[Callable[[str, str], None]] = None):
+        self.settings = settings
+        # told about 'retry', 'hedge' and 'hedge_won' events per backend, e.g. to count them
+        self.on_event = on_event
+        self._hedges = threading.BoundedSemaphore(max(settings.hedge_max_in_flight, 1))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _report(self, event: str, backend: str) -> None:
+        if self.on_event is not None:
+            self.on_event(event, backend)
+
+    def executor(self) -> ThreadPoolExecutor:
+        # separate from the stage pool: a stage waiting on its hedge must not wait on its own pool
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.settings.pool_size,
+                                                        thread_name_prefix='outbound-hedge')
+        return self._executor
+
+    def call(self, backend: str, fn: Callable[..., Any], *args, retryable: Callable[[Exception], bool] = None,
+             idempotent: bool = False, **kwargs) -> Any:
+        hedge_after = self.settings.hedge_after(backend) if idempotent else 0.0
+        attempt = 0
+        while True:
+            try:
+                if hedge_after > 0:
+                    return self._hedged(backend, hedge_after, fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.settings.max_retries or retryable is None or not retryable(e):
+                    raise
+            attempt += 1
+            self._report('retry', backend)
+            # full jitter: a random delay up to the exponential backoff, so retries of many requests spread out
+            time.sleep(random.uniform(0, min(self.settings.retry_max_delay,
+                                             self.settings.retry_base_delay * 2 ** attempt)))
+
+    def _hedged(self, backend: str, hedge_after: float, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        primary = self.executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done or not self._hedges.acquire(blocking=False):
+            return primary.result()
+        self._report('hedge', backend)
+        try:
+            hedge = self.executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except Exception:
+            self._hedges.release()
+            raise
+        hedge.add_done_callback(lambda _: self._hedges.release())
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._report('hedge_won', backend)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def call_async(self, backend: str, fn: Callable[..., Awaitable[Any]], *args,
+                         retryable: Callable[[Exception], bool] = None, idempotent: bool = False, **kwargs) -> Any:
+        hedge_after = self.settings.hedge_after(backend) if idempotent else 0.0
+        attempt = 0
+        while True:
+            try:
+                if hedge_after > 0:
+                    return await self._hedged_async(backend, hedge_after, fn, *args, **kwargs)
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.settings.max_retries or retryable is None or not retryable(e):
+                    raise
+            attempt += 1
+            self._report('retry', backend)
+            await asyncio.sleep(random.uniform(0, min(self.settings.retry_max_delay,
+                                                      self.settings.retry_base_delay * 2 ** attempt)))
+
+    async def _hedged_async(self, backend: str, hedge_after: float, fn: Callable[..., Awaitable[Any]], *args,
+                            **kwargs) -> Any:
+        primary = asyncio.ensure_future(fn(*args, **kwargs))
+        try:
+            done, _ = await asyncio.wait([primary], timeout=hedge_after)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done or not self._hedges.acquire(blocking=False):
+            return await primary
+        self._report('hedge', backend)
+        pending = {primary}
+        try:
+            hedge = asyncio.ensure_future(fn(*args, **kwargs))
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._report('hedge_won', backend)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # unlike a thread, the slower call can be stopped
+            for task in pending:
+                task.cancel()
+            self._hedges.release()
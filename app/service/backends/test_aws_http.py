@@ -0,0 +1,55 @@
+import asyncio
+import base64
+import json
+from unittest import TestCase
+
+import httpx
+
+from app.service.backends.aws_http import AwsAsyncClient, AwsHttpError
+from app.service.backends.face_detector import RekognitionFaceDetector
+from app.service.backends.outbound import OutboundSettings
+
+
+class MockSettings(OutboundSettings):
+    """Answers every request with ``handler`` instead of sending it."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def async_httpx_client(self, backend: str):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+
+class TestAwsAsyncClient(TestCase):
+
+    def test_rekognition_request_is_signed(self):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, json={'FaceDetails': [{'Gender': {'Value': 'Female'}}]})
+
+        detector = RekognitionFaceDetector('eu-west-1', aws_access_key_id='AKID', aws_secret_access_key='secret',
+                                           settings=MockSettings(handler))
+        response = asyncio.run(detector.detect_faces_async(b'photo'))
+        self.assertEqual(response['FaceDetails'][0]['Gender']['Value'], 'Female')
+        request = requests[0]
+        self.assertEqual(str(request.url), 'https://rekognition.eu-west-1.amazonaws.com/')
+        self.assertEqual(request.headers['X-Amz-Target'], 'RekognitionService.DetectFaces')
+        self.assertTrue(request.headers['Authorization'].startswith(
+            'AWS4-HMAC-SHA256 Credential=AKID/'))
+        self.assertIn('/eu-west-1/rekognition/aws4_request', request.headers['Authorization'])
+        self.assertEqual(base64.b64decode(json.loads(request.content)['Image']['Bytes']), b'photo')
+
+    def test_errors_say_whether_they_are_retryable(self):
+        answers = {'throttled': httpx.Response(400, json={'__type': 'com.amazon#ThrottlingException'}),
+                   'invalid': httpx.Response(400, json={'__type': 'InvalidImageFormatException'}),
+                   'down': httpx.Response(503)}
+        client = AwsAsyncClient('rekognition', 'us-east-1', aws_access_key_id='AKID', aws_secret_access_key='secret',
+                                settings=MockSettings(lambda request: answers[request.headers['X-Amz-Target']]))
+        for target, retryable in (('throttled', True), ('invalid', False), ('down', True)):
+            with self.assertRaises(AwsHttpError) as raised:
+                asyncio.run(client.json_request(target, b'{}'))
+            self.assertEqual(raised.exception.retryable, retryable, target)
+        self.assertEqual(raised.exception.status, 503)
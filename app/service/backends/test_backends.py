@@ -0,0 +1,73 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from app.service.backends.classifier import FakeClassifier, VertexClassifier
+from app.service.backends.face_detector import FakeFaceDetector
+from app.service.backends.fault_injection import BackendError, FaultInjector
+from app.service.backends.llm import CannedLLM
+from app.service.backends.object_store import LocalObjectStore
+
+
+class TestLocalBackends(TestCase):
+
+    def test_fake_face_detector_is_deterministic(self):
+        detector = FakeFaceDetector(faces_per_image=2)
+        response = detector.detect_faces(b'photo')
+        self.assertEqual(response, detector.detect_faces(b'photo'))
+        self.assertEqual([face['Gender']['Value'] for face in response['FaceDetails']], ['Female', 'Male'])
+        for face in response['FaceDetails']:
+            self.assertEqual({landmark['Type'] for landmark in face['Landmarks']},
+                             {'eyeLeft', 'eyeRight', 'mouthLeft', 'mouthRight', 'nose'})
+            box = face['BoundingBox']
+            self.assertTrue(0 <= box['Left'] and box['Left'] + box['Width'] <= 1)
+
+    def test_fake_face_detector_face_count_range(self):
+        detector = FakeFaceDetector.from_spec('0-3')
+        counts = {len(detector.detect_faces(bytes([idx]))['FaceDetails']) for idx in range(64)}
+        self.assertEqual(counts, {0, 1, 2, 3})
+
+    def test_fake_classifier_labels_every_crop(self):
+        predictions = FakeClassifier('Mohammed').classify(['Zmlyc3Q=', 'c2Vjb25k'])
+        self.assertEqual(len(predictions), 2)
+        for prediction in predictions:
+            self.assertEqual(prediction[0].prediction_label, 'Mohammed')
+            self.assertGreater(prediction[0].prediction_confidence, 0.5)
+
+    def test_fake_classifier_top_k(self):
+        predictions = FakeClassifier('Mohammed', top_k=1).classify(['Zmlyc3Q='])
+        self.assertEqual([prediction.prediction_label for prediction in predictions[0]], ['Mohammed'])
+
+    def test_vertex_predictions_are_read_from_the_struct(self):
+        from google.cloud.aiplatform_v1.types import PredictResponse
+        from google.protobuf import json_format, struct_pb2
+
+        response = PredictResponse()
+        for prediction in ({'displayNames': ['Mary', 'Unknown', 'Mohammed'], 'confidences': [0.3, 0.6, 0.1],
+                            'ids': ['1', '2', '3']},
+                           {'displayNames': ['Mary'], 'confidences': [0.9], 'ids': ['1']}):
+            response.predictions.append(json_format.ParseDict(prediction, struct_pb2.Value()))
+
+        parsed = VertexClassifier.parse_predictions(response, top_k=1)
+        self.assertEqual([[(p.prediction_label, p.prediction_confidence, p.prediction_id) for p in predictions]
+                          for predictions in parsed], [[('Unknown', 0.6, '2')], [('Mary', 0.9, '1')]])
+        self.assertEqual([p.prediction_label for p in VertexClassifier.parse_predictions(response)[0]],
+                         ['Unknown', 'Mary', 'Mohammed'])
+
+    def test_canned_llm(self):
+        self.assertIn(CannedLLM().complete('prompt'), CannedLLM.responses)
+
+    def test_local_object_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = LocalObjectStore(directory)
+            url = store.put('modified_photo.jpg', b'bytes')
+            self.assertTrue(url.endswith('modified_photo.jpg'))
+            with open(os.path.join(directory, 'modified_photo.jpg'), 'rb') as file:
+                self.assertEqual(file.read(), b'bytes')
+
+    def test_fault_injection(self):
+        self.assertEqual(FaultInjector.parse_spec('20, llm=1500'), {'default': 20.0, 'llm': 1500.0})
+        injector = FaultInjector.from_specs('llm', '20,llm=0', '0,llm=1')
+        self.assertEqual(injector.latency_seconds, 0)
+        with self.assertRaises(BackendError):
+            CannedLLM(fault_injector=injector).complete('prompt')
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from app.service.backends.fault_injection import BackendError
+from app.service.backends.outbound import Outbound, OutboundSettings
+
+
+class TestOutbound(TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def make_outbound(self, **settings) -> Outbound:
+        return Outbound(OutboundSettings(retry_base_delay=0.001, **settings),
+                        on_event=lambda event, backend: self.events.append((event, backend)))
+
+    def test_transient_errors_are_retried_a_bounded_number_of_times(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            raise BackendError('down')
+
+        with self.assertRaises(BackendError):
+            self.make_outbound(max_retries=2).call('llm', flaky, retryable=lambda e: isinstance(e, BackendError))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.events, [('retry', 'llm'), ('retry', 'llm')])
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise ValueError('bad request')
+
+        with self.assertRaises(ValueError):
+            self.make_outbound().call('llm', broken, retryable=lambda e: isinstance(e, BackendError))
+        self.assertEqual(len(calls), 1)
+
+    def test_slow_idempotent_call_is_hedged(self):
+        calls = []
+
+        def first_call_is_slow():
+            with self.lock:
+                calls.append(1)
+                slow = len(calls) == 1
+            time.sleep(1.0 if slow else 0)
+            return 'slow' if slow else 'fast'
+
+        outbound = self.make_outbound(hedge_after_ms='face_detector=20')
+        started = time.perf_counter()
+        self.assertEqual(outbound.call('face_detector', first_call_is_slow, idempotent=True), 'fast')
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(self.events, [('hedge', 'face_detector'), ('hedge_won', 'face_detector')])
+
+    def test_calls_are_not_hedged_unless_idempotent(self):
+        outbound = self.make_outbound(hedge_after_ms='20')
+        self.assertEqual(outbound.call('object_store', lambda: time.sleep(0.05) or 'stored'), 'stored')
+        self.assertEqual(self.events, [])
+
+    def test_async_calls_are_retried(self):
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise BackendError('down')
+            return 'up'
+
+        result = asyncio.run(self.make_outbound(max_retries=2).call_async(
+            'llm', flaky, retryable=lambda e: isinstance(e, BackendError)))
+        self.assertEqual((result, len(calls)), ('up', 3))
+
+    def test_losing_async_hedge_is_cancelled(self):
+        calls = []
+        cancelled = []
+
+        async def first_call_is_slow():
+            calls.append(1)
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(1)
+                    raise
+            return 'fast'
+
+        outbound = self.make_outbound(hedge_after_ms='20')
+        started = time.perf_counter()
+        self.assertEqual(asyncio.run(outbound.call_async('classifier', first_call_is_slow, idempotent=True)), 'fast')
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(cancelled, [1])
+        self.assertEqual(self.events, [('hedge', 'classifier'), ('hedge_won', 'classifier')])
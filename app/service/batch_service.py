@@ -0,0 +1,213 @@
+import io
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from werkzeug.datastructures import FileStorage
+
+from app import app, Constants
+from app.model.image_context import ImageContext
+from app.model.prediction_model import PredictionModel
+from app.service.image_service import ImageService, ManipulateImageService, result_cache
+from app.service.ingestion import UploadRejected, ingestion_policy
+from app.service.metrics import metrics
+from app.service.output import ImageOutput
+from app.service.stage_scheduler import StageScheduler
+from app.utils.utils import Utils
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+
+class BatchImageService:
+    """
+    Runs many uploads through the /process-image pipeline at once.
+
+    Every image moves through detection, classification and render + upload independently on the shared stage pool,
+    so different images occupy different stages at the same time. Faces of all images that finished detection are
+    classified together in as few Vertex AI calls as possible. Rekognition's DetectFaces only takes one image per
+    call, so detection runs concurrently rather than batched. Results are yielded per image as soon as they are known.
+    """
+    max_images = int(app.config.get(Constants.BATCH_MAX_IMAGES))
+    max_bytes = int(app.config.get(Constants.BATCH_MAX_BYTES))
+
+    @staticmethod
+    def is_allowed(filename: str) -> bool:
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+    @staticmethod
+    def read_uploads(files: List[FileStorage]) -> List[Tuple[str, bytes]]:
+        """
+        Returns (filename, bytes) for every image in the request; zip archives are expanded. The image count and
+        total bytes are checked before every member is extracted, so an archive over either limit is refused without
+        decompressing the rest of it.
+        """
+        uploads: List[Tuple[str, bytes]] = []
+        total_bytes = 0
+        for file in files:
+            if file.filename.lower().endswith('.zip'):
+                with zipfile.ZipFile(io.BytesIO(file.read())) as archive:
+                    for member in archive.infolist():
+                        name = os.path.basename(member.filename)
+                        if member.is_dir() or not BatchImageService.is_allowed(name):
+                            continue
+                        BatchImageService.check_count(len(uploads) + 1)
+                        # the declared size is checked before anything is extracted
+                        if member.file_size > ingestion_policy.max_bytes:
+                            raise ValueError(f'{name} is larger than {ingestion_policy.max_bytes} bytes')
+                        BatchImageService.check_total(total_bytes + member.file_size)
+                        data = BatchImageService.read_member(archive, member)
+                        total_bytes += len(data)
+                        BatchImageService.check_total(total_bytes)
+                        uploads.append((name, data))
+            else:
+                BatchImageService.check_count(len(uploads) + 1)
+                data = file.read()
+                total_bytes += len(data)
+                BatchImageService.check_total(total_bytes)
+                uploads.append((file.filename, data))
+        return uploads
+
+    @staticmethod
+    def read_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> bytes:
+        # the declared size may lie, so at most one byte more than an image may have is decompressed
+        with archive.open(member) as stream:
+            data = stream.read(ingestion_policy.max_bytes + 1)
+        if len(data) > ingestion_policy.max_bytes:
+            raise ValueError(f'{os.path.basename(member.filename)} is larger than {ingestion_policy.max_bytes} bytes')
+        return data
+
+    @staticmethod
+    def check_count(count: int):
+        if count > BatchImageService.max_images:
+            raise ValueError(f'At most {BatchImageService.max_images} images can be processed in one batch')
+
+    @staticmethod
+    def check_total(total_bytes: int):
+        if total_bytes > BatchImageService.max_bytes:
+            raise ValueError(f'At most {BatchImageService.max_bytes} bytes of images can be processed in one batch')
+
+    @staticmethod
+    def process_batch(uploads: List[Tuple[str, bytes]]) -> Iterator[Dict[str, Any]]:
+        executor = StageScheduler.executor()
+        # future -> (stage, payload) for everything in flight
+        in_flight: Dict[Future, Tuple[str, Any]] = {}
+        awaiting_classification: List[Tuple[str, ImageContext, List[Dict], List[str]]] = []
+        contexts: List[ImageContext] = []
+        classifier_batch_size = max(1, ImageService.classifier_max_batch_size)
+
+        try:
+            for name, data in uploads:
+                if not BatchImageService.is_allowed(name):
+                    yield BatchImageService.result(name, 400, {
+                        'msg': 'Unsupported image format. Please provide a PNG, JPEG, or JPG file.'})
+                    continue
+                # images out of archives were not checked while the request was read
+                try:
+                    ingestion_policy.validate(data)
+                except UploadRejected as e:
+                    yield BatchImageService.result(name, e.code, {'msg': e.description})
+                    continue
+                context = ImageContext(Utils.pre_append_date(name), data,
+                                       on_disk=ImageService.pipeline_mode == ImageContext.DISK,
+                                       directory=ImageService.pipeline_tmp_dir)
+                contexts.append(context)
+                in_flight[executor.submit(BatchImageService.detect, context)] = ('detect', (name, context))
+
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, payload = in_flight.pop(future)
+                    if stage == 'detect':
+                        name, context = payload
+                        try:
+                            cache_keys, cached_answer, list_of_faces = future.result()
+                        except Exception:
+                            yield BatchImageService.failed(name, context, stage)
+                            continue
+                        if cached_answer is not None:
+                            body, status = cached_answer
+                            yield BatchImageService.finished(name, context, status, body)
+                            continue
+                        if not list_of_faces:
+                            body = {'msg': 'No faces detected in the image'}
+                            result_cache.put(cache_keys, ManipulateImageService.cache_entry(400, body, []))
+                            yield BatchImageService.finished(name, context, 400, body)
+                        else:
+                            awaiting_classification.append((name, context, list_of_faces, cache_keys))
+                    elif stage == 'classify':
+                        try:
+                            classified = future.result()
+                        except Exception:
+                            for name, context, _, _ in payload:
+                                yield BatchImageService.failed(name, context, stage)
+                            continue
+                        for (name, context, list_of_faces, cache_keys), predictions in zip(payload, classified):
+                            known_faces = ManipulateImageService.select_known_faces(list_of_faces, predictions)
+                            if not ManipulateImageService.has_decorations(known_faces):
+                                body = {'msg': 'No known face detected'}
+                                result_cache.put(cache_keys,
+                                                 ManipulateImageService.cache_entry(400, body, list_of_faces))
+                                yield BatchImageService.finished(name, context, 400, body)
+                                continue
+                            render = executor.submit(ManipulateImageService.render_and_upload, context, known_faces)
+                            in_flight[render] = ('render', (name, context, known_faces, list_of_faces, cache_keys))
+                    elif stage == 'render':
+                        name, context, known_faces, list_of_faces, cache_keys = payload
+                        try:
+                            image_url = future.result()
+                        except Exception:
+                            yield BatchImageService.failed(name, context, stage)
+                            continue
+                        body = ManipulateImageService.result_body(
+                            known_faces, image_url, ManipulateImageService.message_for(known_faces[0].prediction_label))
+                        result_cache.put(cache_keys, ManipulateImageService.cache_entry(200, body, list_of_faces))
+                        yield BatchImageService.finished(name, context, 200, body)
+
+                # classify once detection has drained or enough faces are waiting to fill a request
+                detecting = any(stage == 'detect' for stage, _ in in_flight.values())
+                waiting_faces = sum(len(faces) for _, _, faces, _ in awaiting_classification)
+                if awaiting_classification and (not detecting or waiting_faces >= classifier_batch_size):
+                    batch, awaiting_classification = awaiting_classification, []
+                    in_flight[executor.submit(BatchImageService.classify, batch)] = ('classify', batch)
+        finally:
+            wait(list(in_flight))
+            for context in contexts:
+                context.cleanup()
+
+    @staticmethod
+    def detect(context: ImageContext) -> Tuple[List[str], Optional[Tuple[Dict[str, Any], int]], List[Dict]]:
+        cache_keys, cached = ManipulateImageService.lookup_cached(context)
+        if cached is not None:
+            # like /process-image, a cached result without a stored image in the batch encoding is rendered again
+            return cache_keys, ManipulateImageService.cached_result(context, cached, cache_keys, ImageOutput()), []
+        recognition_api_output, list_of_faces = ImageService.call_facial_detector_api(context)
+        if recognition_api_output is not None:
+            ImageService.archive_original(context)
+        return cache_keys, None, list_of_faces
+
+    @staticmethod
+    def classify(batch: List[Tuple[str, ImageContext, List[Dict], List[str]]]) -> List[List[List[PredictionModel]]]:
+        # one batched classifier call for the faces of every image, split back per image
+        all_faces = [face for _, _, list_of_faces, _ in batch for face in list_of_faces]
+        all_predictions = ImageService.call_classifier_api_batch([ImageContext.face_source(face)
+                                                                  for face in all_faces])
+        per_image, start = [], 0
+        for _, _, list_of_faces, _ in batch:
+            per_image.append(all_predictions[start:start + len(list_of_faces)])
+            start += len(list_of_faces)
+        return per_image
+
+    @staticmethod
+    def result(name: str, status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {'file': name, 'status': status, **body}
+
+    @staticmethod
+    def finished(name: str, context: ImageContext, status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+        context.cleanup()
+        return BatchImageService.result(name, status, body)
+
+    @staticmethod
+    def failed(name: str, context: ImageContext, stage: str) -> Dict[str, Any]:
+        metrics.inc('valentine_batch_failures_total', stage=stage)
+        return BatchImageService.finished(name, context, 500, {'msg': 'Failed to process image'})
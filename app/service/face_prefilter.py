@@ -0,0 +1,69 @@
+import os
+import threading
+from typing import List, Sequence
+
+import cv2
+import numpy as np
+
+from app.model.decoded_image import DecodedImage
+
+
+class FacePrefilter:
+    """
+    Cheap local check that rejects uploads without any face before the face detector is called.
+
+    Runs OpenCV's cascade detectors on a grayscale copy downscaled to ``max_dimension`` and passes the image on as soon
+    as one of them finds something. It is meant to skip obviously faceless images, not to find every face, so it is
+    tuned towards passing images: ``min_neighbors`` is the number of overlapping detections a face needs, lower values
+    pass more images and skip fewer faceless ones. Cascades are file names from ``cv2.data.haarcascades`` or paths.
+    """
+
+    def __init__(self, cascades: Sequence[str] = ('haarcascade_frontalface_default.xml', 'haarcascade_profileface.xml'),
+                 min_neighbors: int = 3, max_dimension: int = 480, min_face: float = 0.06):
+        self.cascade_paths = [FacePrefilter.cascade_path(cascade) for cascade in cascades]
+        self.min_neighbors = min_neighbors
+        self.max_dimension = max_dimension
+        # smallest face looked for, as a share of the shorter side
+        self.min_face = min_face
+        # CascadeClassifier keeps scratch buffers and is not safe to share between threads
+        self._local = threading.local()
+
+    @staticmethod
+    def cascade_path(cascade: str) -> str:
+        path = cascade if os.path.isabs(cascade) else os.path.join(cv2.data.haarcascades, cascade)
+        if not os.path.exists(path):
+            raise ValueError(f"Unknown face cascade '{cascade}'")
+        return path
+
+    def cascades(self) -> List[cv2.CascadeClassifier]:
+        cascades = getattr(self._local, 'cascades', None)
+        if cascades is None:
+            cascades = self._local.cascades = [cv2.CascadeClassifier(path) for path in self.cascade_paths]
+        return cascades
+
+    def grayscale(self, image: DecodedImage) -> np.ndarray:
+        """The image as an equalized grayscale array no larger than ``max_dimension``."""
+        pixels = image.pixels
+        scale = min(1.0, self.max_dimension / max(image.width, image.height))
+        if scale < 1.0:
+            pixels = cv2.resize(pixels, (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                interpolation=cv2.INTER_AREA)
+        # the RGBX buffer converts like RGBA, the X channel is ignored
+        return cv2.equalizeHist(cv2.cvtColor(pixels, cv2.COLOR_RGBA2GRAY))
+
+    def may_contain_faces(self, image: DecodedImage) -> bool:
+        gray = self.grayscale(image)
+        mirrored = None
+        min_side = max(1, int(min(gray.shape) * self.min_face))
+        for path, cascade in zip(self.cascade_paths, self.cascades()):
+            candidates = [gray]
+            # the profile cascade only finds faces turned one way, so it also searches the mirrored image
+            if 'profile' in os.path.basename(path):
+                mirrored = cv2.flip(gray, 1) if mirrored is None else mirrored
+                candidates.append(mirrored)
+            for candidate in candidates:
+                faces = cascade.detectMultiScale(candidate, scaleFactor=1.1, minNeighbors=self.min_neighbors,
+                                                 minSize=(min_side, min_side))
+                if len(faces):
+                    return True
+        return False
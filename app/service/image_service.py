@@ -1,277 +1,445 @@
-from typing import Tuple, Dict, List, Any, MutableSequence, Optional
+import atexit
+from types import MappingProxyType
+from typing import Tuple, Dict, List, Any, Callable, MutableSequence, Optional, Union
 
-import boto3
 from flask import jsonify, Response
-from google.cloud.aiplatform_v1 import PredictResponse
 from werkzeug.datastructures import FileStorage
 
 from app import Constants, app
+from app.model.image_context import ImageContext
 from app.model.prediction_model import PredictionModel
+from app.utils.compositor import Compositor
+from app.utils.face_geometry import Decorations, FaceGeometry
+from app.utils.image_encoder import OutputEncoder
 from app.utils.utils import Utils
+from app.service.backends import Backends
+from app.service.face_prefilter import FacePrefilter
 from app.service.llm_service import LLMService
+from app.service.message_pool import MessagePool
+from app.service.metrics import metrics
+from app.service.output import ImageOutput
+from app.service.result_cache import ResultCache, SQLiteCacheTier
+from app.service.uploader import Uploader
 
-from google.cloud import aiplatform
-from google.cloud.aiplatform.gapic.schema import predict
-from google.protobuf.json_format import MessageToDict
-import os
 from PIL import Image
 
-# Initialize S3 client
-s3 = boto3.client('s3',
-                  aws_access_key_id=app.config.get(Constants.AWS_ACCESS_KEY_ID),
-                  aws_secret_access_key=app.config.get(Constants.AWS_SECRET_ACCESS_KEY))
-# Initialize Rekognition client
-rekognition = boto3.client('rekognition',
-                           aws_access_key_id=app.config.get(Constants.AWS_ACCESS_KEY_ID),
-                           aws_secret_access_key=app.config.get(Constants.AWS_SECRET_ACCESS_KEY),
-                           region_name=app.config.get(Constants.AWS_REGION))
+
+# The message for every person, read-only since all requests of a worker share it
+PROMPTS = MappingProxyType({
+    'Mary': ('My dear princess your eyes hold a universe of love, kindness, and compassion. I am grateful every '
+             'day to be able to look into them'),
+    'Mohammed': ('I promise to be your protector and provider, supporting you through every moment. You mean the '
+                 'world to me.'),
+})
 
 
 class ImageService:
-    # AWS
-    aws_s3_bucket_name = app.config.get(Constants.AWS_S3_BUCKET_NAME)
-    aws_s3_base_url = f"https://{aws_s3_bucket_name}.s3.amazonaws.com/"
+    # 'memory' keeps every stage of a request in memory, 'disk' spills the upload and face crops to a workspace
+    # directory of the request's own inside pipeline_tmp_dir
+    pipeline_mode = app.config.get(Constants.PIPELINE_MODE)
+    pipeline_tmp_dir = app.config.get(Constants.PIPELINE_TMP_DIR)
 
-    # Google Cloud
-    google_project_id = app.config.get(Constants.GOOGLE_PROJECT_ID)
-    google_endpoint_id = app.config.get(Constants.GOOGLE_ENDPOINT_ID)
-    google_region = app.config.get(Constants.GOOGLE_REGION)
+    # 'best' decorates the most confidently recognized face of a photo, 'all' every recognized one
+    BEST_FACE = 'best'
+    ALL_FACES = 'all'
+    render_faces = app.config.get(Constants.RENDER_FACES)
 
-    mary_prompt = (
-        'My dear princess your eyes hold a universe of love, kindness, and compassion. I am grateful every '
-        'day to be able to look into them')
-    mohammed_prompt = (
-        'I promise to be your protector and provider, supporting you through every moment. You mean the '
-        'world to me.')
+    # Upper bound on the number of face crops sent in one Vertex AI predict call
+    classifier_max_batch_size = int(app.config.get(Constants.CLASSIFIER_MAX_BATCH_SIZE))
 
-    # Initialize the prediction client as a class-level variable
-    prediction_client = None
+    # Longest side of the face detection payload, and the byte budget of every face crop sent to the classifier
+    encoder_max_dimension = int(app.config.get(Constants.ENCODER_MAX_DIMENSION))
+    encoder_classifier_max_bytes = int(app.config.get(Constants.ENCODER_CLASSIFIER_MAX_BYTES))
 
     @staticmethod
-    def upload_image_to_s3(file_name, file_path) -> Tuple[str, str, str]:
-        # Upload the image to S3
-        s3.upload_file(file_path, ImageService.aws_s3_bucket_name, file_name, ExtraArgs={'ACL': 'public-read'})
+    def store_result(data: bytes, extension: str = '.jpg') -> str:
+        # The client fetches the result as soon as it has the URL, so it is stored before answering
+        return uploader.upload('modified', data, extension)
 
-        # Generate the full URL for the uploaded image
-        image_url = ImageService.aws_s3_base_url + file_name
+    @staticmethod
+    def archive_original(context: ImageContext) -> str:
+        # Nobody waits for the original, it is stored in the background after the request
+        return uploader.upload_later('original', context.data, Uploader.extension(context.file_name))
 
-        return image_url
+    @staticmethod
+    def may_contain_faces(context: ImageContext) -> bool:
+        # Without the pre-filter every image goes to the face detector
+        if face_prefilter is None:
+            return True
+        with metrics.stage('prefilter'):
+            passed = face_prefilter.may_contain_faces(context.image)
+        metrics.inc('valentine_prefilter_total', outcome='passed' if passed else 'skipped')
+        return passed
 
     @staticmethod
-    def call_facial_detector_api(file_path: str) -> Tuple[Any, List[Dict[str, Any]]]:
-        # Compress the image to reduce the file size if needed
-        Utils.compress_image(file_path)
-
-        # Load the image data
-        image_data = Utils.read_binary_file(file_path)
-        # Call Rekognition API to detect faces
-        response = rekognition.detect_faces(
-            Image={'Bytes': image_data},
-            Attributes=['GENDER']  # Change attributes as needed, 'ALL' will return all available attributes
-        )
-        print(response)
-        list_of_faces = ImageService.extract_faces_and_save(file_path, response)
+    def call_facial_detector_api(context: ImageContext) -> Tuple[Any, List[Dict[str, Any]]]:
+        # Obviously faceless images are answered without any network call; there is no API response then
+        if not ImageService.may_contain_faces(context):
+            metrics.observe('valentine_faces_per_image', 0)
+            return None, []
+
+        image_data = ImageService.detection_payload(context)
+
+        # Call Rekognition API (or its local stand-in) to detect faces
+        with metrics.stage('detect', backend='face_detector'):
+            response = Backends.call('face_detector', Backends.face_detector().detect_faces, image_data,
+                                     idempotent=True)
+        list_of_faces = ImageService.crop_faces(context, response)
         # Return the response from the API
         return response, list_of_faces
 
     @staticmethod
-    def extract_faces_and_save(original_image_path: str, recognition_api_output: dict, output_folder: str = "tmp/faces",
-                               scale_factor: float = 1.2) -> List[Dict[str, Any]]:
+    def detection_payload(context: ImageContext) -> bytes:
+        # Fit the image into Rekognition's limits if needed, downscaling from the already decoded pixels
+        with metrics.stage('compress'):
+            max_dimension = ImageService.encoder_max_dimension
+            return Utils.compress_image_data(context.data, image=context.image.pil(),
+                                             max_size=(max_dimension, max_dimension))
+
+    @staticmethod
+    def crop_faces(context: ImageContext, recognition_api_output: dict) -> List[Dict[str, Any]]:
+        with metrics.stage('crop'):
+            list_of_faces = ImageService.extract_faces(context, recognition_api_output)
+        metrics.observe('valentine_faces_per_image', len(list_of_faces))
+        return list_of_faces
+
+    @staticmethod
+    def extract_faces(context: ImageContext, recognition_api_output: dict,
+                      scale_factor: float = 1.2) -> List[Dict[str, Any]]:
         """
-        Extracts faces from the original image based on the bounding box coordinates provided
-        in the recognition API output, scales them, and saves each face as a separate image
-        in the specified output folder.
+        Extracts faces from the request image based on the bounding box coordinates provided
+        in the recognition API output and scales them. The crops are kept on the context, in memory
+        unless the context spills to disk.
 
         Parameters:
-            original_image_path (str): Path to the original image file.
+            context (ImageContext): The request-scoped image.
             recognition_api_output (dict): Recognition API output containing face details.
-            output_folder (str, optional): Path to the folder where the extracted faces will be saved. Default is "faces".
             scale_factor (float, optional): Scale factor by which to resize the extracted face. Default is 1.2.
 
         Returns:
-            List[str]: List of file paths where the extracted faces are saved.
+            List[Dict[str, Any]]: One dict per face with the crop, bounding box, gender and landmarks.
         """
         list_of_faces = []
-        # Create the output folder if it doesn't exist
-        os.makedirs(output_folder, exist_ok=True)
 
-        # Load the original image
-        original_image = Image.open(original_image_path)
+        # The decoded upload, shared with the renderer. Crops are views into it, nothing is re-decoded.
+        original_image = context.image
+
+        # The scaled boxes of all faces at once
+        face_details = recognition_api_output["FaceDetails"]
+        crop_boxes = FaceGeometry.crop_boxes(FaceGeometry.bounding_boxes(face_details, key='BoundingBox'),
+                                             original_image.width, original_image.height, scale_factor)
 
         # Loop through each face detail in the response
-        for idx, face_detail in enumerate(recognition_api_output["FaceDetails"]):
-            # Get the bounding box coordinates
+        for idx, (face_detail, crop_box) in enumerate(zip(face_details, crop_boxes.tolist())):
             bounding_box = face_detail["BoundingBox"]
-            left = int(bounding_box["Left"] * original_image.width)
-            top = int(bounding_box["Top"] * original_image.height)
-            width = int(bounding_box["Width"] * original_image.width)
-            height = int(bounding_box["Height"] * original_image.height)
-
-            # Scale the bounding box dimensions
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            new_left = max(left - (new_width - width) // 2, 0)
-            new_top = max(top - (new_height - height) // 2, 0)
-
-            # Crop the scaled face from the original image
-            face_image = original_image.crop((new_left, new_top, new_left + new_width, new_top + new_height))
-
-            # Save the cropped face as a new image
-            original_image_name = os.path.splitext(os.path.basename(original_image_path))[0]
-            face_image_path = os.path.join(output_folder, f"{original_image_name}_{idx}.jpg")
-            if face_image.mode == 'RGBA':
-                face_image = face_image.convert('RGB')
-
-            face_image.save(face_image_path)
+
+            # Slice the scaled face out of the original image
+            face_image = original_image.crop(*crop_box)
+
             face_info_dict: Dict[str, Any] = {
-                "face_image_path": face_image_path,
+                **context.store_face(idx, face_image),
                 "bounding_box": bounding_box,
                 "gender": face_detail['Gender']['Value'],
                 "landmarks": face_detail['Landmarks']
             }
             list_of_faces.append(face_info_dict)
-            print(f"Face {idx + 1} saved as {face_image_path}")
+        context.faces = list_of_faces
         return list_of_faces
 
     @staticmethod
-    def initialize_prediction_client() -> None:
-        if not ImageService.prediction_client:
-            # Initialize PredictionServiceClient
-            client_options = {"api_endpoint": f"{ImageService.google_region}-aiplatform.googleapis.com"}
-            ImageService.prediction_client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+    def call_classifier_api(face_image: Union[str, Image.Image]) -> List[PredictionModel]:
+        return ImageService.call_classifier_api_batch([face_image])[0]
+
+    @staticmethod
+    def call_classifier_api_batch(face_images: List[Union[str, Image.Image]]) -> List[List[PredictionModel]]:
+        """
+        Classifies every face with as few predict calls as possible: the faces are sent as multi-instance
+        requests of at most ``classifier_max_batch_size`` instances each.
+
+        Returns one prediction list per face, in the same order as ``face_images``.
+        """
+        with metrics.stage('classify', backend='classifier'):
+            encoded_images = ImageService.classifier_payload(face_images)
+            return Backends.call('classifier', Backends.classifier().classify, encoded_images, idempotent=True)
 
     @staticmethod
-    def call_classifier_api(file_path) -> List[PredictionModel]:
-        # Initialize the prediction client if not already initialized
-        ImageService.initialize_prediction_client()
-        print(f"file_path: {file_path}")
-        # file must be encoded to base64
-        encoded_content = Utils.prepare_image(file_path)
-
-        # Prepare the request payload. The format of each instance should conform to the deployed model's prediction
-        # input schema.
-        instance = predict.instance.ImageClassificationPredictionInstance(
-            content=encoded_content,
-        ).to_value()
-
-        instances = [instance]
-        parameters = predict.params.ImageClassificationPredictionParams(
-            confidence_threshold=0.5,
-            max_predictions=1,
-        ).to_value()
-
-        # Prepare the endpoint name
-        endpoint = ImageService.prediction_client.endpoint_path(project=ImageService.google_project_id,
-                                                                location=ImageService.google_region,
-                                                                endpoint=ImageService.google_endpoint_id)
-
-        # Make the prediction request
-        response: PredictResponse = ImageService.prediction_client.predict(
-            instances=instances,
-            parameters=parameters,
-            endpoint=endpoint,
-
-        )
-        # the api will return a Google protocol buffer which we need to convert to a dictionary
-        proto_buf = response.predictions.__dict__['_pb'][0]
-        protobuf_dict = MessageToDict(proto_buf)
-
-        return Utils.convert_dict_to_list_of_models(protobuf_dict)
+    def classifier_payload(face_images: List[Union[str, Image.Image]]) -> List[str]:
+        # the crops are sent base64 encoded
+        return [Utils.prepare_image(face_image, max_size_bytes=ImageService.encoder_classifier_max_bytes)
+                for face_image in face_images]
+
+
+# Rewordings of the prompts are generated in the background so requests never wait on the LLM
+message_pool = MessagePool(PROMPTS, LLMService.get_response,
+                           target_depth=int(app.config.get(Constants.MESSAGE_POOL_DEPTH)))
+
+# Originals and results in the object store, keyed by content
+uploader = Uploader(Backends.object_store, call=Backends.call, call_async=Backends.call_async,
+                    queue_size=int(app.config.get(Constants.UPLOAD_QUEUE_SIZE)),
+                    workers=int(app.config.get(Constants.UPLOAD_WORKERS)))
+# a stopping worker finishes archiving what its requests queued
+atexit.register(uploader.flush, float(app.config.get(Constants.UPLOAD_FLUSH_TIMEOUT)))
+
+# Rejects uploads without faces before the face detector is called, if enabled
+face_prefilter = FacePrefilter(
+    cascades=[cascade.strip() for cascade in app.config.get(Constants.FACE_PREFILTER_CASCADES).split(',')],
+    min_neighbors=int(app.config.get(Constants.FACE_PREFILTER_MIN_NEIGHBORS)),
+    max_dimension=int(app.config.get(Constants.FACE_PREFILTER_MAX_DIMENSION)),
+    min_face=float(app.config.get(Constants.FACE_PREFILTER_MIN_FACE))) \
+    if app.config.get(Constants.FACE_PREFILTER).lower() == 'true' else None
+
+# Outcomes of processed uploads, keyed by content (and optionally perceptual) hash
+result_cache = ResultCache(
+    max_size=int(app.config.get(Constants.RESULT_CACHE_SIZE)),
+    ttl=float(app.config.get(Constants.RESULT_CACHE_TTL)),
+    perceptual=app.config.get(Constants.RESULT_CACHE_PERCEPTUAL).lower() == 'true',
+    shared=SQLiteCacheTier(app.config.get(Constants.RESULT_CACHE_SHARED_PATH))
+    if app.config.get(Constants.RESULT_CACHE_SHARED_PATH) else None)
 
 
 class ManipulateImageService:
     @staticmethod
-    def manipulate_image(file: FileStorage) -> Tuple[Response, int]:
-        file_name, file_path = Utils.save_file_locally(file)
-        # save the original image to s3
-        ImageService.upload_image_to_s3(f'original_{file_name}', file_path)
-        # get face details
-        recognition_api_output, list_of_faces = ImageService.call_facial_detector_api(file_path)
-        # check if there are faces in the image
-        if not list_of_faces:
-            return jsonify({'msg': 'No faces detected in the image'}), 400
-        else:
-            return ManipulateImageService.process_image_with_faces(file_name, file_path, list_of_faces)
+    def manipulate_image(file: FileStorage, on_stage: Optional[Callable[[str], None]] = None,
+                         output: Optional[ImageOutput] = None) -> Tuple[Response, int]:
+        output = output or ImageOutput()
+        with metrics.stage('save'):
+            context = ImageContext.from_upload(file, ImageService.pipeline_mode, ImageService.pipeline_tmp_dir)
+        context.on_stage = on_stage
+        try:
+            metrics.inc('valentine_bytes_in_total', len(context.data))
+            # a photo we have already processed is answered without calling any backend
+            cache_keys, cached = ManipulateImageService.lookup_cached(context)
+            if cached is not None:
+                body, status = ManipulateImageService.cached_result(context, cached, cache_keys, output)
+                return ManipulateImageService.with_server_timing(
+                    ManipulateImageService.respond(body, status, context, output), context)
+
+            # get face details
+            context.report_stage('detecting')
+            recognition_api_output, list_of_faces = ImageService.call_facial_detector_api(context)
+            if recognition_api_output is not None:
+                # archive the original image off the request path, unless the pre-filter already rejected it
+                ImageService.archive_original(context)
+            # check if there are faces in the image
+            if not list_of_faces:
+                body, status = {'msg': 'No faces detected in the image'}, 400
+            else:
+                body, status = ManipulateImageService.process_image_with_faces(context, list_of_faces, output)
+            result_cache.put(cache_keys, ManipulateImageService.cache_entry(status, body, list_of_faces, output))
+            return ManipulateImageService.with_server_timing(
+                ManipulateImageService.respond(body, status, context, output), context)
+        finally:
+            context.cleanup()
+
+    @staticmethod
+    def lookup_cached(context: ImageContext) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        cache_keys, cached = result_cache.lookup(context.data, lambda: context.image)
+        metrics.inc('valentine_result_cache_total', result='miss' if cached is None else 'hit')
+        return cache_keys, cached
+
+    @staticmethod
+    def with_server_timing(response: Tuple[Response, int], context: ImageContext) -> Tuple[Response, int]:
+        # lets clients and load tests see where the time of a request went
+        response[0].headers['Server-Timing'] = context.server_timing()
+        return response
+
+    @staticmethod
+    def respond(body: Dict[str, Any], status: int, context: ImageContext, output: ImageOutput) -> Tuple[Response, int]:
+        status, json_body, headers = output.answer(body, status, context.result)
+        if json_body is not None:
+            return jsonify(json_body), status
+        # the image itself, or nothing if the client already has it
+        return Response(ImageOutput.chunks(context.result) if status == 200 else b'', status=status,
+                        headers=headers), status
+
+    @staticmethod
+    def cache_entry(status: int, body: Dict[str, Any], list_of_faces: List[Dict],
+                    output: Optional[ImageOutput] = None) -> Dict[str, Any]:
+        # everything needed to answer a re-upload, without the face crops, and how the stored result was encoded
+        return {'status': status,
+                'body': body,
+                'faces': [{key: face.get(key) for key in ('bounding_box', 'gender', 'landmarks', 'predictions')}
+                          for face in list_of_faces],
+                'output': (output or ImageOutput()).encoder.key}
+
+    @staticmethod
+    def cached_result(context: ImageContext, cached: Dict[str, Any], cache_keys: List[str],
+                      output: ImageOutput) -> Tuple[Dict[str, Any], int]:
+        body, status = ManipulateImageService.cached_body(cached)
+        known_faces = ManipulateImageService.faces_to_render_again(cached, output)
+        if known_faces:
+            context.report_stage('rendering')
+            body['imageUrl'] = ManipulateImageService.render_and_upload(context, known_faces, output)
+            if output.delivery == ImageOutput.URL:
+                result_cache.put(cache_keys, {**cached, 'body': body, 'output': output.encoder.key})
+        return body, status
+
+    @staticmethod
+    def faces_to_render_again(cached: Dict[str, Any], output: ImageOutput) -> List[PredictionModel]:
+        """
+        The faces to decorate when a cached result has no stored image the request can be answered with: it wants
+        the image itself or another encoding. The faces and predictions are cached, so no backend is called again.
+        """
+        if cached['status'] != 200 or (output.delivery == ImageOutput.URL and cached['body'].get('imageUrl')
+                                       and cached.get('output') == output.encoder.key):
+            return []
+        faces = [dict(face, face_image_path='') for face in cached['faces']]
+        all_predictions = [[PredictionModel(prediction['label'], prediction['confidence'], prediction['id'])
+                            for prediction in face.get('predictions') or []] for face in faces]
+        known_faces = ManipulateImageService.select_known_faces(faces, all_predictions)
+        return known_faces if ManipulateImageService.has_decorations(known_faces) else []
+
+    @staticmethod
+    def cached_body(cached: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        body = dict(cached['body'])
+        if cached['status'] == 200 and body.get('predictionLabel') in message_pool.base_prompts:
+            # still hand out a fresh message
+            body['msg'] = ManipulateImageService.message_for(body['predictionLabel'])
+        return body, cached['status']
 
     @staticmethod
-    def process_image_with_faces(file_name: str, file_path: str, list_of_faces: List[Dict]):
+    def process_image_with_faces(context: ImageContext, list_of_faces: List[Dict],
+                                 output: ImageOutput) -> Tuple[Dict[str, Any], int]:
         # if there are faces, call the classifier api for each face
-        face_with_highest_confidence_that_is_not_unknown: Optional[
-            PredictionModel] = ManipulateImageService.get_face_with_highest_confidence(list_of_faces)
+        context.report_stage('classifying')
+        known_faces = ManipulateImageService.get_known_faces(list_of_faces)
+        if not known_faces:
+            return {'msg': 'No known face detected'}, 400
+        else:
+            return ManipulateImageService.process_known_faces(context, known_faces, output)
+
+    @staticmethod
+    def is_known_face(face_with_highest_confidence_that_is_not_unknown: Optional[PredictionModel]) -> bool:
+        # a prediction only counts if the gender Rekognition detected agrees with it
         if face_with_highest_confidence_that_is_not_unknown is None:
-            os.remove(file_path)
-            return jsonify({'msg': 'No known face detected'}), 400
+            return False
         elif (face_with_highest_confidence_that_is_not_unknown.prediction_label == 'Mary' and
               face_with_highest_confidence_that_is_not_unknown.face_details["gender"] != 'Female') \
                 or (face_with_highest_confidence_that_is_not_unknown.prediction_label == 'Mohammed' and
                     face_with_highest_confidence_that_is_not_unknown.face_details["gender"] != 'Male'):
-            os.remove(file_path)
-            os.remove(face_with_highest_confidence_that_is_not_unknown.face_image_path)
-            return jsonify({'msg': 'No known face detected'}), 400
-        else:
-            return ManipulateImageService.process_known_face(file_name, file_path,
-                                                             face_with_highest_confidence_that_is_not_unknown)
+            return False
+        return True
 
     @staticmethod
-    def process_known_face(file_name: str, file_path: str,
-                           face_with_highest_confidence_that_is_not_unknown: PredictionModel):
-        print(f'face_with_highest_confidence_that_is_not_unknown: {face_with_highest_confidence_that_is_not_unknown}')
+    def process_known_faces(context: ImageContext, known_faces: List[PredictionModel],
+                            output: ImageOutput) -> Tuple[Dict[str, Any], int]:
         image_url = None
         msg = 'NA'
-        llm_prompt = 'Reword the following sentence: {}'
 
-        modified_file_name = f'modified_{file_name}'
-        modified_file_path = ''
-        if face_with_highest_confidence_that_is_not_unknown.prediction_label == 'Mary':
-            modified_file_path = Utils.add_hearts_on_eyes(file_path,
-                                                          face_with_highest_confidence_that_is_not_unknown.face_details)
+        if ManipulateImageService.has_decorations(known_faces):
+            # the message is popped from the pool and the original is archived in the background, so nothing is left
+            # to overlap with rendering and it runs on the request thread
+            context.report_stage('rendering')
+            image_url = ManipulateImageService.render_and_upload(context, known_faces, output)
+            msg = ManipulateImageService.message_for(known_faces[0].prediction_label)
+
+        # Return the image URL, or nothing if the image itself is answered with
+        return ManipulateImageService.result_body(known_faces, image_url, msg), 200
+
+    @staticmethod
+    def message_for(prediction_label: str) -> str:
+        # the rewording was generated ahead of time, popping it never waits on the LLM; only some labels have messages
+        if prediction_label not in message_pool.base_prompts:
+            return 'NA'
+        return message_pool.pop(prediction_label)
 
-            ImageService.mary_prompt = LLMService.get_response(llm_prompt.format(ImageService.mary_prompt))
+    @staticmethod
+    def result_body(known_faces: List[PredictionModel], image_url: Optional[str], msg: str) -> Dict[str, Any]:
+        # the message is about the most confidently recognized face
+        body = {'imageUrl': image_url, 'predictionLabel': known_faces[0].prediction_label, 'msg': msg}
+        if ImageService.render_faces == ImageService.ALL_FACES:
+            body['predictionLabels'] = [face.prediction_label for face in known_faces]
+        return body
 
-            msg = ImageService.mary_prompt
+    @staticmethod
+    def decoration_for(prediction_label: str) -> Optional[str]:
+        if prediction_label == 'Mary':
+            return Decorations.HEARTS
+        elif prediction_label == 'Mohammed':
+            return Decorations.SUNGLASSES_AND_CIGAR
+        return None
 
-            # Use the service class to upload the image
-            image_url = ImageService.upload_image_to_s3(modified_file_name,
-                                                        modified_file_path)
-        elif face_with_highest_confidence_that_is_not_unknown.prediction_label == 'Mohammed':
-            modified_file_path = Utils.add_cigar_and_sunglasses(file_path,
-                                                                face_with_highest_confidence_that_is_not_unknown.face_details)
+    @staticmethod
+    def has_decorations(known_faces: List[PredictionModel]) -> bool:
+        return any(ManipulateImageService.decoration_for(face.prediction_label) is not None for face in known_faces)
 
-            ImageService.mohammed_prompt = LLMService.get_response(llm_prompt.format(ImageService.mohammed_prompt))
-            msg = ImageService.mohammed_prompt
+    @staticmethod
+    def render_and_upload(context: ImageContext, known_faces: List[PredictionModel],
+                          output: Optional[ImageOutput] = None) -> Optional[str]:
+        # the result is kept on the context; it is only stored if the client wants its URL
+        output = output or ImageOutput()
+        context.result = ManipulateImageService.render(context, known_faces, output.encoder)
+        if output.delivery != ImageOutput.URL:
+            return None
+        return ImageService.store_result(context.result, output.encoder.extension)
 
-            # Use the service class to upload the image
-            image_url = ImageService.upload_image_to_s3(modified_file_name,
-                                                        modified_file_path)
+    @staticmethod
+    def render(context: ImageContext, known_faces: List[PredictionModel], encoder: Optional[OutputEncoder] = None) \
+            -> bytes:
+        """
+        Decorates every face of ``known_faces`` in one pass: the accessories of all of them are placed at once and
+        composited straight onto the shared decoded image through its BGR view, which is then encoded once, as
+        ``encoder`` says.
+        """
+        encoder = encoder or ImageOutput().encoder
+        with metrics.stage('render'):
+            image = context.image
+            overlays = FaceGeometry.overlays(
+                [face.face_details for face in known_faces],
+                [ManipulateImageService.decoration_for(face.prediction_label) for face in known_faces],
+                image.width, image.height)
+            Compositor.composite(image.bgr, overlays)
+            data = encoder.encode(image.pil())
+        metrics.inc('valentine_results_total', format=encoder.image_format)
+        return data
+
+    @staticmethod
+    def get_known_faces(list_of_faces: List[dict]) -> List[PredictionModel]:
+        # classify every face in one batched call; predictions come back in the same order as the faces
+        all_predictions: List[List[PredictionModel]] = ImageService.call_classifier_api_batch(
+            [ImageContext.face_source(face) for face in list_of_faces])
+        return ManipulateImageService.select_known_faces(list_of_faces, all_predictions)
 
-        os.remove(file_path)
-        os.remove(face_with_highest_confidence_that_is_not_unknown.face_image_path)
-        os.remove(modified_file_path)
-        # Return the image URL as JSON
-        return jsonify({'imageUrl': image_url,
-                        'predictionLabel': face_with_highest_confidence_that_is_not_unknown.prediction_label,
-                        'msg': msg}), 200
+    @staticmethod
+    def select_known_faces(list_of_faces: List[dict], all_predictions: List[List[PredictionModel]]) \
+            -> List[PredictionModel]:
+        """
+        The recognized faces to decorate, most confident first, each with its face details. With
+        ``RENDER_FACES=all`` that is every face whose best prediction is a known person, otherwise only the face
+        with the highest confidence that is not unknown, if it is recognized.
+        """
+        best = ManipulateImageService.select_face_with_highest_confidence(list_of_faces, all_predictions)
+        if ImageService.render_faces != ImageService.ALL_FACES:
+            return [best] if ManipulateImageService.is_known_face(best) else []
+
+        known_faces = []
+        for face, predictions in zip(list_of_faces, all_predictions):
+            if predictions and predictions[0].prediction_label != 'Unknown':
+                predictions[0].face_details = face
+                predictions[0].face_image_path = face["face_image_path"]
+                if ManipulateImageService.is_known_face(predictions[0]):
+                    known_faces.append(predictions[0])
+        # a stable sort, so of equally confident faces the first one leads like with a single face
+        known_faces.sort(key=lambda prediction: prediction.prediction_confidence, reverse=True)
+        return known_faces
 
     # this method will return the face with the highest confidence that is not unknown. it will also return the face
     # details along with the prediction
     @staticmethod
-    def get_face_with_highest_confidence(list_of_faces: List[dict]) -> Optional[PredictionModel]:
+    def select_face_with_highest_confidence(list_of_faces: List[dict], all_predictions: List[List[PredictionModel]]) \
+            -> Optional[PredictionModel]:
         face_with_highest_confidence_that_is_not_unknown = None
         highest_confidence = -1
 
-        for face in list_of_faces:
-            face_image_path = face["face_image_path"]
-            google_classifier_api_output: List[PredictionModel] = ImageService.call_classifier_api(face_image_path)
-            for e in google_classifier_api_output:
-                print(e)
+        for face, google_classifier_api_output in zip(list_of_faces, all_predictions):
+            face["predictions"] = [{'label': e.prediction_label, 'confidence': e.prediction_confidence,
+                                    'id': e.prediction_id} for e in google_classifier_api_output]
 
             if google_classifier_api_output and google_classifier_api_output[0].prediction_label != 'Unknown':
                 if google_classifier_api_output[0].prediction_confidence > highest_confidence:
                     highest_confidence = google_classifier_api_output[0].prediction_confidence
                     face_with_highest_confidence_that_is_not_unknown = google_classifier_api_output[0]
                     face_with_highest_confidence_that_is_not_unknown.face_details = face
-                    face_with_highest_confidence_that_is_not_unknown.face_image_path = face_image_path
-                else:
-                    os.remove(face_image_path)
+                    face_with_highest_confidence_that_is_not_unknown.face_image_path = face["face_image_path"]
 
         return face_with_highest_confidence_that_is_not_unknown
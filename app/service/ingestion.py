@@ -0,0 +1,195 @@
+import io
+import struct
+from typing import Optional
+
+from flask import Request
+from PIL import Image
+from werkzeug.exceptions import HTTPException
+
+from app import app, Constants
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# JPEG start-of-frame markers, the segment holding the dimensions; C4, C8 and CC are other segments
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class UploadRejected(HTTPException):
+    """
+    An upload that is refused before it is fully read or decoded. Raised while werkzeug parses the request body, so it
+    is an ``HTTPException`` and not a ``ValueError``, which the form parser would silently swallow.
+    """
+
+    def __init__(self, description: str, code: int = 400):
+        super().__init__(description)
+        self.code = code
+
+
+class ImageHeader:
+    """What the first few KB of an image say about it."""
+
+    def __init__(self, image_format: str, width: int, height: int, frames: int = 1):
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.frames = frames
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+class ImageSniffer:
+    """
+    Reads the format, dimensions and frame count of a PNG or JPEG from its leading bytes, without decoding it.
+    ``sniff`` returns None while it needs more bytes, and raises ``UploadRejected`` for anything else.
+    """
+
+    @staticmethod
+    def sniff(data: bytes, complete: bool = False) -> Optional[ImageHeader]:
+        """``complete`` says ``data`` is the whole file, so missing bytes are an error instead of a wait."""
+        if data.startswith(PNG_SIGNATURE):
+            header = ImageSniffer._png(data, complete)
+        elif data.startswith(JPEG_SIGNATURE):
+            header = ImageSniffer._jpeg(data)
+        elif len(data) < len(PNG_SIGNATURE) and not complete and (PNG_SIGNATURE.startswith(data)
+                                                                  or JPEG_SIGNATURE.startswith(data[:3])):
+            return None
+        else:
+            raise UploadRejected('The file is not a PNG or JPEG image.', 415)
+        if header is None and complete:
+            raise UploadRejected('The image header is truncated.', 400)
+        return header
+
+    @staticmethod
+    def _png(data: bytes, complete: bool) -> Optional[ImageHeader]:
+        # the IHDR chunk always comes first
+        if len(data) < 33:
+            return None
+        if data[12:16] != b'IHDR':
+            raise UploadRejected('The PNG image has no header.', 400)
+        width, height = struct.unpack('>II', data[16:24])
+        # an animated PNG announces its frame count in an acTL chunk before the image data
+        offset = 33
+        while offset + 8 <= len(data):
+            length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+            if chunk_type == b'IDAT':
+                return ImageHeader('PNG', width, height)
+            if chunk_type == b'acTL':
+                if offset + 12 > len(data):
+                    return None
+                return ImageHeader('PNG', width, height, struct.unpack('>I', data[offset + 8:offset + 12])[0])
+            offset += 12 + length
+        return ImageHeader('PNG', width, height) if complete else None
+
+    @staticmethod
+    def _jpeg(data: bytes) -> Optional[ImageHeader]:
+        offset = 2
+        while True:
+            # markers may be padded with any number of 0xFF bytes
+            while offset < len(data) and data[offset] == 0xFF:
+                offset += 1
+            if offset >= len(data):
+                return None
+            marker = data[offset]
+            offset += 1
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # standalone markers have no length
+                continue
+            if marker in (0xD9, 0xDA):
+                raise UploadRejected('The JPEG image has no frame header.', 400)
+            if offset + 2 > len(data):
+                return None
+            length = struct.unpack('>H', data[offset:offset + 2])[0]
+            if marker in JPEG_SOF_MARKERS:
+                if offset + 7 > len(data):
+                    return None
+                height, width = struct.unpack('>HH', data[offset + 3:offset + 7])
+                return ImageHeader('JPEG', width, height)
+            offset += length
+
+
+class IngestionPolicy:
+    """Limits every uploaded image has to meet before it is buffered in full or decoded."""
+
+    def __init__(self, max_bytes: int, max_pixels: int, max_frames: int = 1, sniff_limit: int = 262144):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_frames = max_frames
+        # bytes read looking for the header; metadata can push the dimensions past the first few KB
+        self.sniff_limit = sniff_limit
+
+    def check_size(self, size: int) -> None:
+        if size > self.max_bytes:
+            raise UploadRejected(f'The image is larger than {self.max_bytes} bytes.', 413)
+
+    def check_header(self, header: ImageHeader) -> None:
+        if header.width == 0 or header.height == 0:
+            raise UploadRejected('The image has no pixels.', 400)
+        if header.pixels > self.max_pixels:
+            raise UploadRejected(f'The image has {header.width}x{header.height} pixels, at most {self.max_pixels} '
+                                 f'are accepted.', 413)
+        if header.frames > self.max_frames:
+            raise UploadRejected(f'Animated images with {header.frames} frames are not accepted.', 400)
+
+    def validate(self, data: bytes) -> ImageHeader:
+        """Checks a fully read image, e.g. one taken out of a zip archive."""
+        self.check_size(len(data))
+        header = ImageSniffer.sniff(data, complete=True)
+        self.check_header(header)
+        return header
+
+
+class IngestionStream(io.BytesIO):
+    """
+    In-memory file the request parser writes an uploaded image into. Every chunk is checked as it arrives: the upload
+    is rejected as soon as it is over the size limit or its first bytes show it is not an acceptable image, so the
+    rest of the body is never buffered.
+    """
+
+    def __init__(self, policy: IngestionPolicy):
+        super().__init__()
+        self.policy = policy
+        self.header: Optional[ImageHeader] = None
+        self.size = 0
+
+    def write(self, chunk) -> int:
+        self.policy.check_size(self.size + len(chunk))
+        written = super().write(chunk)
+        self.size += written
+        if self.header is None:
+            data = self.getvalue()[:self.policy.sniff_limit]
+            self.header = ImageSniffer.sniff(data)
+            if self.header is not None:
+                self.policy.check_header(self.header)
+            elif len(data) >= self.policy.sniff_limit:
+                raise UploadRejected(f'No image header in the first {self.policy.sniff_limit} bytes.', 400)
+        return written
+
+    def seek(self, *args) -> int:
+        # the parser rewinds the file once it is complete; an image too short to show its header is rejected then.
+        # An empty file is left to the route, it means no file was selected.
+        if self.header is None and self.size:
+            self.header = ImageSniffer.sniff(self.getvalue(), complete=True)
+            self.policy.check_header(self.header)
+        return super().seek(*args)
+
+
+class IngestionRequest(Request):
+    """Request whose uploaded images are validated while the body is parsed, see ``IngestionStream``."""
+    policy: Optional[IngestionPolicy] = None
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None):
+        if self.policy is None or (filename or '').lower().endswith('.zip'):
+            # archives are only bounded by MAX_CONTENT_LENGTH, their images are checked once extracted
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return IngestionStream(self.policy)
+
+
+ingestion_policy = IngestionPolicy(max_bytes=int(app.config.get(Constants.IMAGE_MAX_BYTES)),
+                                   max_pixels=int(app.config.get(Constants.IMAGE_MAX_PIXELS)),
+                                   max_frames=int(app.config.get(Constants.IMAGE_MAX_FRAMES)))
+IngestionRequest.policy = ingestion_policy
+# the same pixel limit for every image PIL opens; beyond it PIL warns, beyond twice of it it refuses to decode
+Image.MAX_IMAGE_PIXELS = ingestion_policy.max_pixels
@@ -0,0 +1,204 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+
+
+class JobStatus:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+
+# what a failed job reports, the same as /process-image answers when the pipeline fails
+FAILED_RESULT = {'status': 500, 'body': {'msg': 'Failed to process image'}}
+
+
+class JobQueue:
+    """
+    Holds image processing jobs and their progress. ``dequeue`` hands each job to exactly one worker.
+
+    Records returned by ``get`` are plain dicts with ``jobId``, ``status``, ``stage``, ``fileName``, ``createdAt``,
+    ``updatedAt`` and, once finished, ``result``.
+    """
+
+    def enqueue(self, job_id: str, file_name: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    def dequeue(self, timeout: float) -> Optional[Tuple[str, str, bytes]]:
+        """Claims the oldest queued job and returns (job_id, file_name, data), or None after ``timeout`` seconds."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, status: Optional[str] = None, stage: Optional[str] = None,
+               result: Optional[Dict[str, Any]] = None) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Jobs live in this process only. Fast, but lost on restart, and a status request must reach the worker process
+    that accepted the job, so prefer ``SQLiteJobQueue`` when running several gunicorn workers.
+    """
+
+    def __init__(self, result_ttl: float = 3600):
+        self.result_ttl = result_ttl
+        self._queue: 'queue.Queue[str]' = queue.Queue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._data: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_id: str, file_name: str, data: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._jobs[job_id] = {'jobId': job_id, 'status': JobStatus.QUEUED, 'stage': JobStatus.QUEUED,
+                                  'fileName': file_name, 'createdAt': now, 'updatedAt': now, 'result': None}
+            self._data[job_id] = data
+        self._queue.put(job_id)
+
+    def dequeue(self, timeout: float) -> Optional[Tuple[str, str, bytes]]:
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = JobStatus.RUNNING
+            job['updatedAt'] = time.time()
+            return job_id, job['fileName'], self._data.pop(job_id)
+
+    def update(self, job_id: str, status: Optional[str] = None, stage: Optional[str] = None,
+               result: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            if status is not None:
+                job['status'] = status
+            if stage is not None:
+                job['stage'] = stage
+            if result is not None:
+                job['result'] = result
+            job['updatedAt'] = time.time()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _prune(self, now: float) -> None:
+        finished = (JobStatus.SUCCEEDED, JobStatus.FAILED)
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in finished and now - job['updatedAt'] > self.result_ttl]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Jobs are kept in a SQLite file, so they survive restarts and every worker process on the host can claim jobs and
+    answer status requests. A stand-in for a real durable queue.
+
+    A claim is a lease: the upload stays in the row until the job finishes, and every stage update renews it. A job
+    whose lease ran out for ``lease_seconds``, because its worker was killed mid-job, is queued again, and failed once
+    it was claimed ``max_attempts`` times, so a poll never waits on it forever.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.2, result_ttl: float = 3600, lease_seconds: float = 300,
+                 max_attempts: int = 3):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._enqueued = threading.Event()
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, '
+                               'stage TEXT NOT NULL, file_name TEXT NOT NULL, data BLOB, result TEXT, '
+                               'created_at REAL NOT NULL, updated_at REAL NOT NULL, '
+                               'attempts INTEGER NOT NULL DEFAULT 0)')
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(jobs)')]
+            if 'attempts' not in columns:
+                # a queue file from before leases
+                connection.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode so claims can use an explicit BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def enqueue(self, job_id: str, file_name: str, data: bytes) -> None:
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute('INSERT INTO jobs (job_id, status, stage, file_name, data, created_at, updated_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (job_id, JobStatus.QUEUED, JobStatus.QUEUED, file_name, data, now, now))
+            connection.execute('DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+                               (JobStatus.SUCCEEDED, JobStatus.FAILED, now - self.result_ttl))
+        self._enqueued.set()
+
+    def dequeue(self, timeout: float) -> Optional[Tuple[str, str, bytes]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = self._claim()
+            if claimed is not None or time.monotonic() >= deadline:
+                return claimed
+            # woken early by jobs enqueued in this process, otherwise poll for jobs from other processes
+            self._enqueued.wait(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+            self._enqueued.clear()
+
+    def _claim(self) -> Optional[Tuple[str, str, bytes]]:
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            self._expire_leases(connection, now)
+            row = connection.execute('SELECT job_id, file_name, data FROM jobs WHERE status = ? '
+                                     'ORDER BY created_at LIMIT 1', (JobStatus.QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? '
+                                   'WHERE job_id = ?', (JobStatus.RUNNING, now, row[0]))
+            connection.execute('COMMIT')
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed, e.g. on a locked database, leaving nothing to roll back
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+        return (row[0], row[1], bytes(row[2])) if row is not None else None
+
+    def _expire_leases(self, connection: sqlite3.Connection, now: float) -> None:
+        expired = now - self.lease_seconds
+        connection.execute('UPDATE jobs SET status = ?, stage = ?, data = NULL, result = ?, updated_at = ? '
+                           'WHERE status = ? AND updated_at < ? AND attempts >= ?',
+                           (JobStatus.FAILED, 'done', json.dumps(FAILED_RESULT), now, JobStatus.RUNNING, expired,
+                            self.max_attempts))
+        # back in the queue in its original place
+        connection.execute('UPDATE jobs SET status = ?, stage = ?, updated_at = ? WHERE status = ? AND updated_at < ?',
+                           (JobStatus.QUEUED, JobStatus.QUEUED, now, JobStatus.RUNNING, expired))
+
+    def update(self, job_id: str, status: Optional[str] = None, stage: Optional[str] = None,
+               result: Optional[Dict[str, Any]] = None) -> None:
+        with closing(self._connect()) as connection, connection:
+            # the upload is only dropped once the job finished, so a job of a killed worker can run again
+            connection.execute('UPDATE jobs SET status = COALESCE(?, status), stage = COALESCE(?, stage), '
+                               'result = COALESCE(?, result), '
+                               'data = CASE WHEN ? IN (?, ?) THEN NULL ELSE data END, updated_at = ? '
+                               'WHERE job_id = ?',
+                               (status, stage, json.dumps(result) if result is not None else None, status,
+                                JobStatus.SUCCEEDED, JobStatus.FAILED, time.time(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute('SELECT job_id, status, stage, file_name, created_at, updated_at, result '
+                                     'FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {'jobId': row[0], 'status': row[1], 'stage': row[2], 'fileName': row[3], 'createdAt': row[4],
+                'updatedAt': row[5], 'result': json.loads(row[6]) if row[6] else None}
@@ -0,0 +1,80 @@
+import io
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from werkzeug.datastructures import FileStorage
+
+from app import app, Constants
+from app.service.image_service import ManipulateImageService
+from app.service.job_queue import FAILED_RESULT, InMemoryJobQueue, JobQueue, JobStatus, SQLiteJobQueue
+from app.service.metrics import metrics
+
+
+class JobService:
+    """
+    Accepts /process-image uploads as jobs and processes them on a pool of background threads, so the request that
+    submitted them returns right away instead of holding a gunicorn worker for the whole pipeline.
+    """
+
+    def __init__(self, job_queue: JobQueue, workers: int = 2, retry_delay_seconds: float = 1.0):
+        self.job_queue = job_queue
+        self.workers = workers
+        self.retry_delay_seconds = retry_delay_seconds
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the worker threads. Done lazily so they are created in the serving process, not before a fork."""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for idx in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{idx}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, file: FileStorage) -> str:
+        job_id = uuid.uuid4().hex
+        self.job_queue.enqueue(job_id, file.filename, file.read())
+        self.start()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self.start()
+        return self.job_queue.get(job_id)
+
+    def _work(self) -> None:
+        while True:
+            try:
+                job = self.job_queue.dequeue(timeout=1.0)
+                if job is not None:
+                    self.process(*job)
+            except Exception:
+                # the queue itself failed, e.g. a locked SQLite file; the worker stays up for the jobs still queued
+                metrics.inc('valentine_job_queue_errors_total')
+                time.sleep(self.retry_delay_seconds)
+
+    def process(self, job_id: str, file_name: str, data: bytes) -> None:
+        def on_stage(stage: str) -> None:
+            self.job_queue.update(job_id, stage=stage)
+
+        try:
+            with app.app_context():
+                response, status = ManipulateImageService.manipulate_image(
+                    FileStorage(io.BytesIO(data), filename=file_name), on_stage=on_stage)
+                result = {'status': status, 'body': response.get_json()}
+            self.job_queue.update(job_id, status=JobStatus.SUCCEEDED, stage='done', result=result)
+            metrics.inc('valentine_jobs_total', status=JobStatus.SUCCEEDED)
+        except Exception:
+            # the failed stage was already counted by the pipeline
+            metrics.inc('valentine_jobs_total', status=JobStatus.FAILED)
+            self.job_queue.update(job_id, status=JobStatus.FAILED, stage='done', result=FAILED_RESULT)
+
+
+job_service = JobService(
+    SQLiteJobQueue(app.config.get(Constants.JOB_QUEUE_PATH),
+                   lease_seconds=float(app.config.get(Constants.JOB_LEASE_SECONDS)),
+                   max_attempts=int(app.config.get(Constants.JOB_MAX_ATTEMPTS)))
+    if app.config.get(Constants.JOB_QUEUE) == 'sqlite' else InMemoryJobQueue(),
+    workers=int(app.config.get(Constants.JOB_WORKERS)))
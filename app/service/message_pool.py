@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from app.service.metrics import metrics
+
+
+class MessagePool:
+    """
+    Per-label pools of pre-generated rewordings of a base prompt.
+
+    A background thread keeps every pool topped up to ``target_depth`` by calling ``generator``; the request path only
+    pops a ready message and falls back to the base prompt straight away when a pool is empty. Every rewording is
+    generated from the base prompt, so messages never drift away from it. Pool depths, refill latency and fallbacks
+    are published to ``metrics`` as well as kept for ``stats``.
+    """
+    llm_prompt = 'Reword the following sentence: {}'
+
+    def __init__(self, base_prompts: Dict[str, str], generator: Callable[[str], str], target_depth: int = 5,
+                 retry_delay_seconds: float = 5.0):
+        self.base_prompts = dict(base_prompts)
+        self.generator = generator
+        self.target_depth = target_depth
+        self.retry_delay_seconds = retry_delay_seconds
+        self._pools: Dict[str, Deque[str]] = {label: deque() for label in self.base_prompts}
+        self._stats: Dict[str, Dict[str, float]] = {
+            label: {'served': 0, 'fallbacks': 0, 'refills': 0, 'refill_errors': 0,
+                    'last_refill_seconds': 0.0, 'total_refill_seconds': 0.0}
+            for label in self.base_prompts}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the refill thread. Called lazily so it is created in the worker process, not before a fork."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._refill_forever, name='message-pool-refill', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake_up.set()
+
+    def pop(self, label: str) -> str:
+        """Returns a pre-generated message for ``label``, or its base prompt if none is ready. Never blocks."""
+        if self.target_depth > 0:
+            self.start()
+        with self._lock:
+            stats = self._stats[label]
+            stats['served'] += 1
+            pool = self._pools[label]
+            if pool:
+                message, source = pool.popleft(), 'pool'
+            else:
+                stats['fallbacks'] += 1
+                message, source = self.base_prompts[label], 'base_prompt'
+            depth = len(pool)
+        metrics.inc('valentine_messages_served_total', label=label, source=source)
+        metrics.set('valentine_message_pool_depth', depth, label=label)
+        self._wake_up.set()
+        return message
+
+    def refill_once(self) -> bool:
+        """Generate one message for the emptiest pool below target depth. Returns False if all pools are full."""
+        with self._lock:
+            label = min(self._pools, key=lambda name: len(self._pools[name]), default=None)
+            if label is None or len(self._pools[label]) >= self.target_depth:
+                return False
+
+        started = time.perf_counter()
+        try:
+            message = self.generator(MessagePool.llm_prompt.format(self.base_prompts[label]))
+        except Exception:
+            with self._lock:
+                self._stats[label]['refill_errors'] += 1
+            metrics.inc('valentine_message_pool_refill_errors_total', label=label)
+            raise
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            if message:
+                self._pools[label].append(message)
+            stats = self._stats[label]
+            stats['refills'] += 1
+            stats['last_refill_seconds'] = elapsed
+            stats['total_refill_seconds'] += elapsed
+            depth = len(self._pools[label])
+        metrics.observe('valentine_message_pool_refill_seconds', elapsed, label=label)
+        metrics.set('valentine_message_pool_depth', depth, label=label)
+        return True
+
+    def _refill_forever(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                if self.refill_once():
+                    continue
+            except Exception:
+                # back off so a failing LLM backend is not hammered
+                self._stopped.wait(self.retry_delay_seconds)
+                continue
+            self._wake_up.wait()
+            self._wake_up.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {label: {'depth': len(self._pools[label]),
+                            'target_depth': self.target_depth,
+                            **stats,
+                            'avg_refill_seconds': stats['total_refill_seconds'] / stats['refills']
+                            if stats['refills'] else 0.0}
+                    for label, stats in self._stats.items()}
@@ -0,0 +1,307 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app import app, Constants
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FACE_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Trace:
+    """Stage timings of one request, logged as a single JSON line when the request was sampled."""
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, started: float, seconds: float, error: Optional[str]) -> None:
+        span = {'stage': stage, 'startMs': round((started - self.started) * 1000, 1),
+                'durationMs': round(seconds * 1000, 1)}
+        if error is not None:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+
+# the trace of the request being handled; stages submitted through StageScheduler inherit it
+current_trace: 'contextvars.ContextVar[Optional[Trace]]' = contextvars.ContextVar('current_trace', default=None)
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of the pipeline, exported in the Prometheus text format.
+
+    Values are kept in memory per worker process. With a ``directory``, every worker also writes its values to its
+    own file there every ``flush_interval`` seconds and ``render`` sums the files of all workers, so a scrape that
+    lands on any gunicorn worker sees the totals of the whole server. Gauges are summed over the workers that are still
+    running, so a gone worker's queue depth does not linger.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 5.0, trace_sample_rate: float = 0.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.trace_sample_rate = trace_sample_rate
+        self._descriptions: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._gauges: Dict[str, Dict[LabelSet, float]] = {}
+        # per label set: one count per bucket, then sum and count
+        self._histograms: Dict[str, Dict[LabelSet, List[float]]] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._flusher: Optional[threading.Thread] = None
+        self._flush_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def describe(self, name: str, metric_type: str, help_text: str, buckets: Tuple[float, ...] = ()) -> None:
+        self._descriptions[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._check_fork()
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        self._start_flusher()
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Sets gauge ``name`` of this worker."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._check_fork()
+            self._gauges.setdefault(name, {})[key] = value
+        self._start_flusher()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = self._descriptions[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._check_fork()
+            values = self._histograms.setdefault(name, {}).setdefault(key, [0.0] * (len(buckets) + 2))
+            for idx, bound in enumerate(buckets):
+                if value <= bound:
+                    values[idx] += 1
+            values[-2] += value
+            values[-1] += 1
+        self._start_flusher()
+
+    @contextmanager
+    def stage(self, stage: str, backend: Optional[str] = None) -> Iterator[None]:
+        """Times a pipeline stage; failures are counted, and also count as an error of ``backend`` if given."""
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            self.inc('valentine_stage_errors_total', stage=stage)
+            if backend is not None:
+                self.inc('valentine_backend_errors_total', backend=backend)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe('valentine_stage_seconds', seconds, stage=stage)
+            trace = current_trace.get()
+            if trace is not None and trace.sampled:
+                trace.add_span(stage, started, seconds, error)
+
+    def start_trace(self, request_id: Optional[str] = None) -> Tuple[Trace, contextvars.Token]:
+        trace = Trace(request_id or uuid.uuid4().hex, random.random() < self.trace_sample_rate)
+        return trace, current_trace.set(trace)
+
+    def finish_trace(self, trace: Trace, token: contextvars.Token, endpoint: str, method: str, status: int) -> None:
+        current_trace.reset(token)
+        seconds = time.perf_counter() - trace.started
+        self.inc('valentine_requests_total', endpoint=endpoint, method=method, status=str(status))
+        self.observe('valentine_request_seconds', seconds, endpoint=endpoint)
+        if trace.sampled:
+            print(json.dumps({'trace': trace.request_id, 'endpoint': endpoint, 'method': method, 'status': status,
+                              'durationMs': round(seconds * 1000, 1), 'stages': trace.spans}))
+
+    def _check_fork(self) -> None:
+        # values recorded before a fork belong to the parent, a worker starts from zero
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._flusher = None
+
+    def _start_flusher(self) -> None:
+        if not self.directory or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Writing metrics to {self.directory} failed: {e}")
+
+    def _snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._check_fork()
+            return {'pid': self._pid,
+                    'counters': {name: [[list(key), value] for key, value in series.items()]
+                                 for name, series in self._counters.items()},
+                    'gauges': {name: [[list(key), value] for key, value in series.items()]
+                               for name, series in self._gauges.items()},
+                    'histograms': {name: [[list(key), list(values)] for key, values in series.items()]
+                                   for name, series in self._histograms.items()}}
+
+    def flush(self) -> None:
+        """Writes this worker's values to its file in ``directory``."""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f'metrics_{os.getpid()}.json')
+        snapshot = self._snapshot()
+        with self._flush_lock:
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(f'{path}.tmp', path)
+
+    def _snapshots(self) -> List[Dict[str, Any]]:
+        if not self.directory:
+            return [self._snapshot()]
+        self.flush()
+        snapshots = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith('metrics_') and file_name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, file_name)) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    # being replaced by its worker right now
+                    continue
+        return snapshots
+
+    def collect(self) -> Tuple[Dict[str, Dict[LabelSet, float]], Dict[str, Dict[LabelSet, List[float]]]]:
+        """Counters and gauges, and histograms, summed over every worker."""
+        counters: Dict[str, Dict[LabelSet, float]] = {}
+        histograms: Dict[str, Dict[LabelSet, List[float]]] = {}
+        for snapshot in self._snapshots():
+            series_by_name = dict(snapshot['counters'])
+            if Metrics._is_running(snapshot.get('pid')):
+                series_by_name.update(snapshot.get('gauges', {}))
+            for name, series in series_by_name.items():
+                for key, value in series:
+                    key = tuple(tuple(label) for label in key)
+                    counters.setdefault(name, {})[key] = counters.get(name, {}).get(key, 0) + value
+            for name, series in snapshot['histograms'].items():
+                for key, values in series:
+                    key = tuple(tuple(label) for label in key)
+                    total = histograms.setdefault(name, {}).setdefault(key, [0.0] * len(values))
+                    for idx, value in enumerate(values):
+                        total[idx] += value
+        return counters, histograms
+
+    def render(self) -> str:
+        counters, histograms = self.collect()
+        lines: List[str] = []
+        for name, (metric_type, help_text, buckets) in self._descriptions.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for key, value in sorted(counters.get(name, {}).items()):
+                lines.append(f'{name}{Metrics._labels(key)} {Metrics._number(value)}')
+            for key, values in sorted(histograms.get(name, {}).items()):
+                for bound, count in zip(buckets, values):
+                    lines.append(f'{name}_bucket{Metrics._labels(key, le=Metrics._number(bound))} '
+                                 f'{Metrics._number(count)}')
+                lines.append(f'{name}_bucket{Metrics._labels(key, le="+Inf")} {Metrics._number(values[-1])}')
+                lines.append(f'{name}_sum{Metrics._labels(key)} {values[-2]}')
+                lines.append(f'{name}_count{Metrics._labels(key)} {Metrics._number(values[-1])}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _is_running(pid: Optional[int]) -> bool:
+        if pid is None or pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _labels(key: LabelSet, **extra: str) -> str:
+        labels = list(key) + list(extra.items())
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    @staticmethod
+    def _number(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else str(value)
+
+
+metrics = Metrics(directory=app.config.get(Constants.METRICS_DIR),
+                  flush_interval=float(app.config.get(Constants.METRICS_FLUSH_INTERVAL)),
+                  trace_sample_rate=float(app.config.get(Constants.TRACE_SAMPLE_RATE)))
+metrics.describe('valentine_requests_total', 'counter', 'HTTP requests by endpoint, method and status.')
+metrics.describe('valentine_request_seconds', 'histogram', 'HTTP request duration by endpoint.', LATENCY_BUCKETS)
+metrics.describe('valentine_stage_seconds', 'histogram',
+                 'Time spent in each pipeline stage: save, prefilter, compress, detect, crop, classify, llm, render, '
+                 'upload.',
+                 LATENCY_BUCKETS)
+metrics.describe('valentine_stage_errors_total', 'counter', 'Pipeline stages that raised, by stage.')
+metrics.describe('valentine_backend_errors_total', 'counter',
+                 'Failed calls to object_store, face_detector, classifier and llm.')
+metrics.describe('valentine_backend_retries_total', 'counter', 'Backend calls retried after a transient error.')
+metrics.describe('valentine_backend_hedges_total', 'counter',
+                 'Idempotent backend calls sent a second time because the first was slow.')
+metrics.describe('valentine_backend_hedge_wins_total', 'counter', 'Hedged calls answered first by the second call.')
+metrics.describe('valentine_faces_per_image', 'histogram', 'Faces detected per processed image.',
+                 FACE_COUNT_BUCKETS)
+metrics.describe('valentine_bytes_in_total', 'counter', 'Bytes of uploaded images.')
+metrics.describe('valentine_bytes_out_total', 'counter', 'Bytes written to the object store.')
+metrics.describe('valentine_results_total', 'counter', 'Rendered results by output format (jpeg, webp or png).')
+metrics.describe('valentine_admission_in_flight', 'gauge', 'Image processing requests running.')
+metrics.describe('valentine_admission_queue_depth', 'gauge', 'Image processing requests waiting to be admitted.')
+metrics.describe('valentine_admission_rejected_total', 'counter',
+                 'Requests refused with 503, by reason: queue_full, queue_timeout or global_limit.')
+metrics.describe('valentine_admission_wait_seconds', 'histogram', 'Time admitted requests waited for capacity.',
+                 LATENCY_BUCKETS)
+metrics.describe('valentine_prefilter_total', 'counter',
+                 'Uploads checked by the face pre-filter: passed on to the face detector, or skipped without faces.')
+metrics.describe('valentine_uploads_total', 'counter',
+                 'Object store uploads by outcome: uploaded, skipped (already stored), queued for write-behind, '
+                 'queue_full (uploaded by the request itself), or failed (a write-behind upload given up on).')
+metrics.describe('valentine_batch_failures_total', 'counter',
+                 'Images of /process-images answered with 500, by the stage that failed: detect, classify or render.')
+metrics.describe('valentine_jobs_total', 'counter', 'Background jobs of /process-image?async=true by final status.')
+metrics.describe('valentine_job_queue_errors_total', 'counter',
+                 'Job queue operations that failed in a background job worker, which then retried.')
+metrics.describe('valentine_result_cache_total', 'counter', 'Result cache lookups by outcome (hit or miss).')
+metrics.describe('valentine_result_cache_hits_total', 'counter',
+                 'Result cache hits by tier: local, shared, or perceptual (a re-encoded copy of a cached photo).')
+metrics.describe('valentine_result_cache_size', 'gauge', 'Results held in the in-process result cache.')
+metrics.describe('valentine_asset_cache_total', 'counter', 'Resized accessory lookups by outcome (hit or miss).')
+metrics.describe('valentine_asset_cache_evictions_total', 'counter', 'Resized accessories evicted from the cache.')
+metrics.describe('valentine_asset_cache_size', 'gauge', 'Resized accessories held in the cache.')
+metrics.describe('valentine_message_pool_depth', 'gauge', 'Pre-generated messages ready, by label.')
+metrics.describe('valentine_message_pool_refill_seconds', 'histogram',
+                 'Time the LLM took to generate one pooled message, by label.', LATENCY_BUCKETS)
+metrics.describe('valentine_message_pool_refill_errors_total', 'counter', 'Failed message generations, by label.')
+metrics.describe('valentine_messages_served_total', 'counter',
+                 'Messages handed out by label and source: pool, or base_prompt when the pool was empty.')
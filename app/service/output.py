@@ -0,0 +1,93 @@
+import base64
+import hashlib
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from werkzeug.http import parse_etags
+
+from app import app, Constants
+from app.utils.image_encoder import OutputEncoder
+
+
+class ImageOutput:
+    """
+    How a client wants the result of /process-image, from the query string and headers of its request.
+
+    ``output`` picks the delivery: ``url`` (default) stores the image and answers with its URL, ``inline`` answers
+    with the image as a data URI in the JSON body and ``image`` answers with the image itself, streamed, with a strong
+    ETag of its content hash. The last two store nothing, so a client that does not need a persistent URL saves the
+    second round trip. ``format`` (webp, jpeg or png, otherwise negotiated from ``Accept``), ``quality`` and ``size``
+    (longest side in pixels) pick the encoding.
+    """
+    URL = 'url'
+    INLINE = 'inline'
+    IMAGE = 'image'
+
+    # default encoding of results, and how long clients may cache an image response
+    default_format = app.config.get(Constants.OUTPUT_FORMAT)
+    default_quality = int(app.config.get(Constants.OUTPUT_QUALITY))
+    cache_control = app.config.get(Constants.OUTPUT_CACHE_CONTROL)
+
+    # streamed image responses are sent in pieces of this many bytes
+    chunk_size = 64 * 1024
+
+    def __init__(self, encoder: OutputEncoder = None, delivery: str = URL, if_none_match: Optional[str] = None):
+        self.encoder = encoder or OutputEncoder(ImageOutput.default_format, ImageOutput.default_quality)
+        self.delivery = delivery
+        self.if_none_match = if_none_match
+
+    @classmethod
+    def from_request(cls, args: Mapping[str, str], headers: Mapping[str, str]) -> 'ImageOutput':
+        """Raises ``ValueError`` with a message for the client when a parameter is invalid."""
+        delivery = (args.get('output') or cls.URL).lower()
+        if delivery not in (cls.URL, cls.INLINE, cls.IMAGE):
+            raise ValueError(f"Unsupported output '{delivery}'. Use one of: url, inline, image.")
+        image_format = (args.get('format') or '').lower() \
+            or OutputEncoder.negotiate(headers.get('Accept'), cls.default_format)
+        try:
+            quality = int(args.get('quality') or cls.default_quality)
+            max_dimension = int(args['size']) if args.get('size') else None
+        except ValueError:
+            raise ValueError('The quality and size must be whole numbers.')
+        return cls(OutputEncoder(image_format, quality, max_dimension), delivery, headers.get('If-None-Match'))
+
+    def answer(self, body: Dict[str, Any], status: int,
+               data: Optional[bytes]) -> Tuple[int, Optional[Dict[str, Any]], List[Tuple[str, str]]]:
+        """
+        The status, JSON body and headers to answer a request with, given its result ``body`` and rendered image
+        ``data``. Without a JSON body the answer is the image itself, or empty for a 304.
+        """
+        if status != 200 or data is None or self.delivery == ImageOutput.URL:
+            return status, body, []
+        if self.delivery == ImageOutput.INLINE:
+            return status, self.inline_body(body, data), []
+        headers = self.image_headers(body, data)
+        if self.not_modified(data):
+            return 304, None, headers
+        return 200, None, headers + [('Content-Type', self.encoder.mimetype), ('Content-Length', str(len(data)))]
+
+    @staticmethod
+    def etag(data: bytes) -> str:
+        # the hash the uploader names stored images by
+        return hashlib.sha256(data).hexdigest()
+
+    def not_modified(self, data: bytes) -> bool:
+        """Whether the client already has this exact image, going by its If-None-Match header."""
+        return self.if_none_match is not None and parse_etags(self.if_none_match).contains(ImageOutput.etag(data))
+
+    def inline_body(self, body: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+        return {**body, 'image': f"data:{self.encoder.mimetype};base64,{base64.b64encode(data).decode('ascii')}"}
+
+    def image_headers(self, body: Dict[str, Any], data: bytes) -> List[Tuple[str, str]]:
+        # the rest of the JSON body travels in headers, the message percent-encoded as it may not be latin-1
+        headers = [('ETag', f'"{ImageOutput.etag(data)}"'), ('Cache-Control', ImageOutput.cache_control),
+                   ('X-Prediction-Label', body['predictionLabel']), ('X-Message', quote(body['msg']))]
+        if 'predictionLabels' in body:
+            headers.append(('X-Prediction-Labels', ','.join(body['predictionLabels'])))
+        return headers
+
+    @staticmethod
+    def chunks(data: bytes) -> Iterator[bytes]:
+        view = memoryview(data)
+        for start in range(0, len(data), ImageOutput.chunk_size):
+            yield bytes(view[start:start + ImageOutput.chunk_size])
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from cachetools import TTLCache
+
+from app.model.decoded_image import DecodedImage
+from app.service.metrics import metrics
+
+
+class SharedCacheTier:
+    """A cache tier shared by every worker process. Values are JSON-serializable dicts."""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        raise NotImplementedError
+
+
+class SQLiteCacheTier(SharedCacheTier):
+    """Shared tier backed by a SQLite file, visible to all gunicorn workers on the same host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS result_cache '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call keeps this safe across threads and forked workers; callers close it, as the
+        # connection's own context manager only commits
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute('SELECT value FROM result_cache WHERE key = ? AND expires_at > ?',
+                                     (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute('INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), time.time() + ttl))
+            # opportunistically drop expired rows
+            connection.execute('DELETE FROM result_cache WHERE expires_at <= ?', (time.time(),))
+
+
+class ResultCache:
+    """
+    Caches the outcome of /process-image by the content hash of the upload, so re-uploads of the same photo skip
+    detection, classification, rendering and both uploads.
+
+    Lookups go through a bounded in-process LRU/TTL tier first, then the optional shared tier. With
+    ``perceptual=True`` entries are also stored under a 64-bit difference hash of the pixels, which catches
+    re-encoded or re-saved copies of the same picture.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, perceptual: bool = False,
+                 shared: Optional[SharedCacheTier] = None):
+        self.enabled = max_size > 0
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.shared = shared
+        self._local = TTLCache(maxsize=max(max_size, 1), ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'local_hits': 0, 'shared_hits': 0, 'perceptual_hits': 0, 'misses': 0, 'puts': 0}
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        return 'content:' + hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def perceptual_key(image: DecodedImage) -> str:
+        """dHash: compares neighbouring pixels of a 9x8 grayscale thumbnail."""
+        gray = cv2.cvtColor(np.ascontiguousarray(image.rgb), cv2.COLOR_RGB2GRAY)
+        thumbnail = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+        return 'phash:' + format(int(np.packbits(bits).view('>u8')[0]), '016x')
+
+    def lookup(self, data: bytes, image: Callable[[], DecodedImage]) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        """
+        Looks the upload up by content hash, then by perceptual hash if enabled. ``image`` is only called when the
+        perceptual hash is needed. Returns the keys to ``put`` the result under, and the cached value or None.
+        """
+        keys = [ResultCache.content_key(data)]
+        if not self.enabled:
+            return keys, None
+        value = self._get(keys[0])
+        if value is None and self.perceptual:
+            keys.append(ResultCache.perceptual_key(image()))
+            value = self._get(keys[1])
+            if value is not None:
+                with self._lock:
+                    self._stats['perceptual_hits'] += 1
+                metrics.inc('valentine_result_cache_hits_total', tier='perceptual')
+                # remember this exact encoding too
+                self.put(keys[:1], value)
+        with self._lock:
+            self._stats['hits' if value is not None else 'misses'] += 1
+        return keys, value
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._local.get(key)
+            if value is not None:
+                self._stats['local_hits'] += 1
+        if value is not None:
+            metrics.inc('valentine_result_cache_hits_total', tier='local')
+            return value
+        if self.shared is None:
+            return None
+        value = self.shared.get(key)
+        if value is not None:
+            with self._lock:
+                self._stats['shared_hits'] += 1
+                self._local[key] = value
+            metrics.inc('valentine_result_cache_hits_total', tier='shared')
+        return value
+
+    def put(self, keys: List[str], value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stats['puts'] += 1
+            for key in keys:
+                self._local[key] = value
+            size = len(self._local)
+        metrics.set('valentine_result_cache_size', size)
+        if self.shared is not None:
+            for key in keys:
+                self.shared.set(key, value, self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, 'size': len(self._local), 'max_size': int(self._local.maxsize)}
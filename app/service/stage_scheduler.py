@@ -0,0 +1,51 @@
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from app import app, Constants
+
+
+class StageScheduler:
+    """
+    Runs the independent stages of one request concurrently and joins their results.
+
+    All schedulers share one bounded thread pool per worker process, sized by ``PIPELINE_MAX_WORKERS``. Only the
+    request thread waits on stages; a stage must never wait on another stage, or a saturated pool could deadlock.
+    Chain dependent steps inside a single stage instead.
+    """
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=int(app.config.get(Constants.PIPELINE_MAX_WORKERS)),
+                        thread_name_prefix='pipeline-stage')
+        return cls._executor
+
+    def submit(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        if name in self._futures:
+            raise ValueError(f"Stage '{name}' was already scheduled for this request")
+        # run in a copy of the caller's context, so the stage is traced as part of the request that scheduled it
+        future = StageScheduler.executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        self._futures[name] = future
+        return future
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        """Blocks until stage ``name`` is done and returns its result, re-raising its exception if it failed."""
+        return self._futures[name].result(timeout)
+
+    def join(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Waits for every stage and returns their results by name. The first failed stage's exception is raised."""
+        return {name: future.result(timeout) for name, future in self._futures.items()}
+
+    def wait(self) -> None:
+        """Waits for every stage without raising, e.g. before cleaning up state the stages still use."""
+        wait(list(self._futures.values()))
@@ -0,0 +1,27 @@
+import gc
+
+from PIL import Image
+
+from app.service.backends import Backends
+from app.utils.asset_registry import asset_registry
+
+
+def warm_up() -> None:
+    """
+    Load the read-only state every worker needs before gunicorn forks its workers (``PRELOAD_APP=true``), so they
+    share it copy-on-write instead of each building its own copy on their first request.
+
+    Only imports modules and decodes data. Clients, connections and threads are never created here: they are not
+    safe to share across a fork and are created lazily in each worker.
+    """
+    # the cloud SDKs of the configured backends
+    Backends.preload()
+    # PIL registers its image plugins on first use
+    Image.init()
+    # the accessory overlays are decoded when the registry is imported, check they all are
+    for name in asset_registry.names():
+        asset_registry.original(name)
+    # move everything loaded so far out of the garbage collector's reach, otherwise its bookkeeping writes to every
+    # object's header and un-shares the pages in the workers
+    gc.collect()
+    gc.freeze()
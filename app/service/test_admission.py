@@ -0,0 +1,99 @@
+import asyncio
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from flask import Flask
+
+from app.service.admission import AdmissionController, GlobalSlots, Overloaded
+
+
+class TestAdmissionController(TestCase):
+
+    def test_refuses_beyond_the_queue(self):
+        controller = AdmissionController(max_in_flight=1, max_queued=0, retry_after=3)
+        slot = controller.acquire()
+        with self.assertRaises(Overloaded) as raised:
+            controller.acquire()
+        self.assertEqual((raised.exception.code, raised.exception.retry_after), (503, 3))
+        controller.release(slot)
+        controller.release(controller.acquire())
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_queued_request_is_admitted_when_one_finishes(self):
+        controller = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=5)
+        slot = controller.acquire()
+        admitted = threading.Event()
+
+        def queued():
+            controller.acquire()
+            admitted.set()
+
+        thread = threading.Thread(target=queued)
+        thread.start()
+        while controller.queued == 0:
+            time.sleep(0.001)
+        self.assertFalse(admitted.is_set())
+        # the queue is full now
+        with self.assertRaises(Overloaded):
+            controller.acquire()
+        controller.release(slot)
+        thread.join(5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual((controller.in_flight, controller.queued), (1, 0))
+
+    def test_queue_time_deadline(self):
+        controller = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=0.05)
+        controller.acquire()
+        started = time.monotonic()
+        with self.assertRaises(Overloaded):
+            controller.acquire()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(controller.queued, 0)
+
+    def test_async_requests_share_the_limits(self):
+        controller = AdmissionController(max_in_flight=1, max_queued=1, queue_timeout=5, poll_interval=0.001)
+
+        async def requests():
+            slot = controller.acquire()
+            queued = asyncio.ensure_future(controller.acquire_async())
+            while controller.queued == 0:
+                await asyncio.sleep(0.001)
+            with self.assertRaises(Overloaded):
+                await controller.acquire_async()
+            controller.release(slot)
+            controller.release(await queued)
+
+        asyncio.run(requests())
+        self.assertEqual((controller.in_flight, controller.queued), (0, 0))
+
+    def test_global_slots_are_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # two workers on the same host, each allowed two requests but only two in total
+            worker_1 = AdmissionController(2, queue_timeout=0.05, global_slots=GlobalSlots(directory, 2))
+            worker_2 = AdmissionController(2, queue_timeout=0.05, global_slots=GlobalSlots(directory, 2))
+            slots = [worker_1.acquire(), worker_2.acquire()]
+            with self.assertRaises(Overloaded):
+                worker_1.acquire()
+            # the refused request gave its local capacity back
+            self.assertEqual(worker_1.in_flight, 1)
+            worker_2.release(slots.pop())
+            worker_1.release(worker_1.acquire())
+
+    def test_limit_holds_capacity_until_the_response_is_sent(self):
+        app = Flask(__name__)
+        controller = AdmissionController(max_in_flight=1)
+
+        @app.route('/work')
+        @controller.limit
+        def work():
+            def generate():
+                yield str(controller.in_flight)
+
+            return app.response_class(generate())
+
+        with app.test_client().get('/work') as response:
+            self.assertEqual(response.get_data(as_text=True), '1')
+            self.assertEqual(controller.in_flight, 1)
+        self.assertEqual(controller.in_flight, 0)
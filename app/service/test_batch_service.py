@@ -0,0 +1,52 @@
+import io
+import zipfile
+from unittest import TestCase, mock
+
+from werkzeug.datastructures import FileStorage
+
+from app.service.batch_service import BatchImageService
+from app.service.metrics import metrics
+
+
+def archive(members: int, size: int) -> FileStorage:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for idx in range(members):
+            zip_file.writestr(f'photos/{idx}.jpg', bytes(size))
+    return FileStorage(io.BytesIO(buffer.getvalue()), filename='photos.zip')
+
+
+class TestReadUploads(TestCase):
+
+    def test_archive_is_expanded(self):
+        uploads = BatchImageService.read_uploads([archive(3, 10), FileStorage(io.BytesIO(b'abc'), filename='a.png')])
+        self.assertEqual([name for name, _ in uploads], ['0.jpg', '1.jpg', '2.jpg', 'a.png'])
+        self.assertEqual(uploads[0][1], bytes(10))
+
+    def test_too_many_members_are_refused_before_they_are_extracted(self):
+        with mock.patch.object(BatchImageService, 'max_images', 2), \
+                mock.patch.object(BatchImageService, 'read_member', wraps=BatchImageService.read_member) as read:
+            with self.assertRaises(ValueError):
+                BatchImageService.read_uploads([archive(1000, 10)])
+        self.assertEqual(read.call_count, 2)
+
+    def test_batch_byte_budget(self):
+        with mock.patch.object(BatchImageService, 'max_bytes', 250), \
+                mock.patch.object(BatchImageService, 'read_member', wraps=BatchImageService.read_member) as read:
+            with self.assertRaises(ValueError):
+                BatchImageService.read_uploads([archive(1000, 100)])
+        self.assertEqual(read.call_count, 2)
+
+
+class TestProcessBatch(TestCase):
+
+    def test_failed_stage_is_counted(self):
+        def failures() -> float:
+            return metrics.collect()[0].get('valentine_batch_failures_total', {}).get((('stage', 'detect'),), 0)
+
+        before = failures()
+        with mock.patch.object(BatchImageService, 'detect', side_effect=RuntimeError('face detector down')), \
+                mock.patch('app.service.batch_service.ingestion_policy'):
+            [result] = BatchImageService.process_batch([('photo.jpg', b'image')])
+        self.assertEqual((result['file'], result['status']), ('photo.jpg', 500))
+        self.assertEqual(failures(), before + 1)
@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+from app.model.decoded_image import DecodedImage
+from app.service.face_prefilter import FacePrefilter
+
+
+class TestFacePrefilter(TestCase):
+
+    def setUp(self):
+        # smooth random texture, with plenty of face-like candidate windows for a cascade with no neighbours required
+        small = np.random.default_rng(0).integers(0, 256, (54, 96, 3), dtype=np.uint8)
+        self.texture = DecodedImage.from_pil(Image.fromarray(small).resize((1920, 1080), Image.Resampling.BICUBIC))
+
+    def test_skips_images_without_any_face(self):
+        flat = DecodedImage.from_pil(Image.new('RGB', (1920, 1080), (120, 130, 140)))
+        self.assertFalse(FacePrefilter().may_contain_faces(flat))
+
+    def test_lower_sensitivity_passes_more_images(self):
+        self.assertTrue(FacePrefilter(min_neighbors=0, min_face=0.01).may_contain_faces(self.texture))
+
+    def test_searches_a_downscaled_copy(self):
+        gray = FacePrefilter(max_dimension=480).grayscale(self.texture)
+        self.assertEqual(gray.shape, (270, 480))
+        self.assertEqual(gray.dtype, np.uint8)
+
+    def test_unknown_cascade(self):
+        with self.assertRaises(ValueError):
+            FacePrefilter(cascades=['haarcascade_nothing.xml'])
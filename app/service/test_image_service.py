@@ -0,0 +1,165 @@
+import base64
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from unittest import TestCase, mock
+
+import numpy as np
+from PIL import Image
+from flask import Response
+from werkzeug.datastructures import FileStorage
+
+from app import app, Constants
+from app.model.image_context import ImageContext
+from app.model.prediction_model import PredictionModel
+from app.service import batch_service, image_service
+from app.service.backends import Backends
+from app.service.batch_service import BatchImageService
+from app.service.image_service import ImageService, ManipulateImageService, result_cache, uploader
+from app.service.output import ImageOutput
+from app.service.result_cache import ResultCache
+from app.utils.image_encoder import OutputEncoder
+
+
+def photo(seed: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(seed).integers(0, 256, (240, 320, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class TestConcurrentRequests(TestCase):
+    """Many requests with the same file name at once must each get the result of their own image."""
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.workspaces = tempfile.TemporaryDirectory()
+        settings = {Constants.BACKEND_MODE: 'local', Constants.LOCAL_OBJECT_STORE_PATH: self.store.name,
+                    Constants.FAKE_FACES_PER_IMAGE: '1-3', Constants.LOCAL_BACKEND_LATENCY_MS: '1'}
+        self.config = mock.patch.dict(app.config, settings)
+        self.config.start()
+        Backends.reset()
+        self.images = [photo(seed) for seed in range(12)]
+
+    def tearDown(self):
+        uploader.flush(5)
+        self.config.stop()
+        Backends.reset()
+        self.store.cleanup()
+        self.workspaces.cleanup()
+
+    def process(self, data: bytes) -> Tuple[int, Dict]:
+        with app.test_request_context():
+            response, status = ManipulateImageService.manipulate_image(
+                FileStorage(io.BytesIO(data), filename='photo.jpg'))
+            body = response.get_json()
+        return status, {key: body.get(key) for key in ('imageUrl', 'predictionLabel')}
+
+    def process_all(self, mode: str, threads: int) -> List[Tuple[int, Dict]]:
+        # every run starts without cached results, so each request goes through the whole pipeline
+        with mock.patch.object(result_cache, 'lookup', return_value=([], None)), \
+                mock.patch.object(ImageService, 'pipeline_mode', mode), \
+                mock.patch.object(ImageService, 'pipeline_tmp_dir', self.workspaces.name):
+            with ThreadPoolExecutor(threads) as executor:
+                return list(executor.map(self.process, self.images * 3))
+
+    def test_requests_are_isolated(self):
+        for mode in (ImageContext.MEMORY, ImageContext.DISK):
+            with self.subTest(mode=mode):
+                expected = self.process_all(mode, threads=1)
+                self.assertTrue(any(status == 200 for status, _ in expected))
+                self.assertEqual(self.process_all(mode, threads=12), expected)
+                # every request removed its workspace
+                self.assertEqual(os.listdir(self.workspaces.name), [])
+
+    def test_workspace_is_removed_when_a_stage_fails(self):
+        with mock.patch.object(ImageService, 'pipeline_mode', ImageContext.DISK), \
+                mock.patch.object(ImageService, 'pipeline_tmp_dir', self.workspaces.name), \
+                mock.patch.object(ImageService, 'call_facial_detector_api', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.process(self.images[0])
+        self.assertEqual(os.listdir(self.workspaces.name), [])
+
+
+class TestKnownFaces(TestCase):
+
+    def setUp(self):
+        self.faces = [{'gender': gender, 'face_image_path': ''} for gender in ('Female', 'Male', 'Male', 'Female')]
+
+    def predictions(self) -> List[List[PredictionModel]]:
+        return [[PredictionModel('Mary', 0.7, '1')], [PredictionModel('Mohammed', 0.9, '2')],
+                [PredictionModel('Unknown', 0.95, '3')], [PredictionModel('Mary', 0.8, '1')]]
+
+    def test_best_face_only(self):
+        with mock.patch.object(ImageService, 'render_faces', ImageService.BEST_FACE):
+            known_faces = ManipulateImageService.select_known_faces(self.faces, self.predictions())
+        self.assertEqual([(face.prediction_label, face.face_details) for face in known_faces],
+                         [('Mohammed', self.faces[1])])
+
+    def test_every_recognized_face(self):
+        with mock.patch.object(ImageService, 'render_faces', ImageService.ALL_FACES):
+            known_faces = ManipulateImageService.select_known_faces(self.faces, self.predictions())
+            body = ManipulateImageService.result_body(known_faces, 'url', 'msg')
+        self.assertEqual([face.face_details for face in known_faces], [self.faces[1], self.faces[3], self.faces[0]])
+        self.assertEqual(body['predictionLabel'], 'Mohammed')
+        self.assertEqual(body['predictionLabels'], ['Mohammed', 'Mary', 'Mary'])
+
+    def test_label_without_messages(self):
+        # with RENDER_FACES=all the most confident face may be someone the message pool has no prompt for
+        self.assertEqual(ManipulateImageService.message_for('Someone else'), 'NA')
+
+
+class TestImageOutput(TestCase):
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        settings = {Constants.BACKEND_MODE: 'local', Constants.LOCAL_OBJECT_STORE_PATH: self.store.name,
+                    Constants.FAKE_FACES_PER_IMAGE: '1', Constants.LOCAL_BACKEND_LATENCY_MS: '0'}
+        self.config = mock.patch.dict(app.config, settings)
+        self.config.start()
+        Backends.reset()
+        # a photo the fake backends find Mary in
+        self.image = next(data for data in map(photo, range(20)) if self.process(data)[0].status_code == 200)
+
+    def tearDown(self):
+        uploader.flush(5)
+        self.config.stop()
+        Backends.reset()
+        self.store.cleanup()
+
+    def process(self, data: bytes, output: ImageOutput = None) -> Tuple[Response, int]:
+        with app.test_request_context():
+            return ManipulateImageService.manipulate_image(FileStorage(io.BytesIO(data), filename='photo.jpg'),
+                                                           output=output)
+
+    def test_inline_result(self):
+        output = ImageOutput(OutputEncoder('png'), ImageOutput.INLINE)
+        response, status = self.process(self.image, output)
+        body = response.get_json()
+        self.assertEqual((status, body['imageUrl']), (200, None))
+        self.assertTrue(body['image'].startswith('data:image/png;base64,'))
+        with Image.open(io.BytesIO(base64.b64decode(body['image'].split(',', 1)[1]))) as img:
+            self.assertEqual(img.format, 'PNG')
+
+    def test_cached_result_is_rendered_again_in_another_encoding(self):
+        with mock.patch.object(ImageService, 'call_facial_detector_api') as detect:
+            response, status = self.process(self.image, ImageOutput(OutputEncoder('webp'), ImageOutput.IMAGE))
+            self.assertEqual((status, response.mimetype), (200, 'image/webp'))
+            self.assertEqual(response.headers['ETag'], f'"{ImageOutput.etag(response.get_data())}"')
+
+            response, status = self.process(self.image, ImageOutput(OutputEncoder('png')))
+            self.assertTrue(response.get_json()['imageUrl'].endswith('.png'))
+        # answered from the cached faces
+        detect.assert_not_called()
+
+    def test_batch_renders_a_cached_result_without_url(self):
+        with mock.patch.object(image_service, 'result_cache', ResultCache()), \
+                mock.patch.object(batch_service, 'result_cache', image_service.result_cache):
+            # an inline answer caches a result without a stored image
+            self.process(self.image, ImageOutput(OutputEncoder('png'), ImageOutput.INLINE))
+            with mock.patch.object(ImageService, 'call_facial_detector_api') as detect:
+                [result] = BatchImageService.process_batch([('photo.jpg', self.image)])
+        detect.assert_not_called()
+        self.assertEqual(result['status'], 200)
+        self.assertTrue(result['imageUrl'].endswith('.jpg'))
@@ -0,0 +1,108 @@
+import io
+import struct
+import zlib
+from unittest import TestCase
+
+from PIL import Image
+
+from app import app
+from app.service.ingestion import IngestionPolicy, IngestionStream, ImageSniffer, UploadRejected
+
+
+def encode(image: Image.Image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+class TestImageSniffer(TestCase):
+
+    def test_reads_jpeg_dimensions_past_the_metadata(self):
+        exif = Image.Exif()
+        exif[0x010E] = 'x' * 30000  # a large image description ahead of the frame header
+        data = encode(Image.new('RGB', (640, 480)), 'JPEG', exif=exif)
+        self.assertIsNone(ImageSniffer.sniff(data[:1000]))
+        header = ImageSniffer.sniff(data[:40000])
+        self.assertEqual((header.format, header.width, header.height, header.frames), ('JPEG', 640, 480, 1))
+
+    def test_reads_png_dimensions_and_frames(self):
+        data = encode(Image.new('RGB', (300, 200)), 'PNG')
+        header = ImageSniffer.sniff(data)
+        self.assertEqual((header.format, header.width, header.height, header.frames), ('PNG', 300, 200, 1))
+        # an animated PNG with 12 frames
+        animated = data[:33] + png_chunk(b'acTL', struct.pack('>II', 12, 0)) + data[33:]
+        self.assertEqual(ImageSniffer.sniff(animated).frames, 12)
+
+    def test_waits_for_more_bytes(self):
+        data = encode(Image.new('RGB', (300, 200)), 'PNG')
+        for size in (1, 5, 20):
+            self.assertIsNone(ImageSniffer.sniff(data[:size]))
+        with self.assertRaises(UploadRejected):
+            ImageSniffer.sniff(data[:20], complete=True)
+
+    def test_rejects_other_files(self):
+        for data in (b'GIF89a', b'%PDF-1.7', b'<svg xmlns=', b'PK\x03\x04'):
+            with self.assertRaises(UploadRejected) as raised:
+                ImageSniffer.sniff(data)
+            self.assertEqual(raised.exception.code, 415)
+
+
+class TestIngestionStream(TestCase):
+
+    def setUp(self):
+        self.policy = IngestionPolicy(max_bytes=100_000, max_pixels=1_000_000)
+
+    def write_in_chunks(self, data: bytes, chunk_size: int = 4096) -> IngestionStream:
+        stream = IngestionStream(self.policy)
+        for start in range(0, len(data), chunk_size):
+            stream.write(data[start:start + chunk_size])
+        stream.seek(0)
+        return stream
+
+    def test_accepts_an_image(self):
+        data = encode(Image.new('RGB', (640, 480)), 'JPEG')
+        stream = self.write_in_chunks(data)
+        self.assertEqual(stream.read(), data)
+        self.assertEqual(stream.header.width, 640)
+
+    def test_rejects_a_decompression_bomb_from_its_first_chunk(self):
+        # small on the wire, 100 megapixels once decoded
+        header = (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', 10000, 10000, 8, 2, 0, 0, 0))
+                  + png_chunk(b'IDAT', b''))
+        stream = IngestionStream(self.policy)
+        with self.assertRaises(UploadRejected) as raised:
+            stream.write(header)
+        self.assertEqual(raised.exception.code, 413)
+
+    def test_stops_buffering_at_the_size_limit(self):
+        data = encode(Image.new('RGB', (640, 480)), 'JPEG') + b'\0' * 200_000
+        with self.assertRaises(UploadRejected) as raised:
+            self.write_in_chunks(data)
+        self.assertEqual(raised.exception.code, 413)
+
+    def test_rejects_misnamed_files(self):
+        with self.assertRaises(UploadRejected):
+            self.write_in_chunks(b'just some text, not an image')
+
+
+class TestUploadRoutes(TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_misnamed_file_is_refused(self):
+        response = self.client.post('/process-image',
+                                    data={'image': (io.BytesIO(b'<html></html>'), 'photo.jpg')})
+        self.assertEqual(response.status_code, 415)
+        self.assertIn('not a PNG or JPEG', response.get_json()['msg'])
+
+    def test_too_many_pixels_is_refused(self):
+        data = encode(Image.new('RGB', (2, 2)), 'PNG')
+        # patch the declared dimensions to 20000x20000
+        data = data[:16] + struct.pack('>II', 20000, 20000) + data[24:]
+        response = self.client.post('/process-image', data={'image': (io.BytesIO(data), 'photo.png')})
+        self.assertEqual(response.status_code, 413)
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from unittest import TestCase, mock
+
+from app.service.job_queue import FAILED_RESULT, InMemoryJobQueue, JobStatus, SQLiteJobQueue
+
+
+class JobQueueTests:
+
+    def make_queue(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.job_queue = self.make_queue()
+
+    def test_job_lifecycle(self):
+        self.job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+        self.assertEqual(self.job_queue.get('job-1')['status'], JobStatus.QUEUED)
+
+        self.assertEqual(self.job_queue.dequeue(timeout=0.1), ('job-1', 'photo.jpg', b'bytes'))
+        self.assertEqual(self.job_queue.get('job-1')['status'], JobStatus.RUNNING)
+
+        self.job_queue.update('job-1', stage='detecting')
+        self.assertEqual(self.job_queue.get('job-1')['stage'], 'detecting')
+
+        result = {'status': 400, 'body': {'msg': 'No faces detected in the image'}}
+        self.job_queue.update('job-1', status=JobStatus.SUCCEEDED, stage='done', result=result)
+        job = self.job_queue.get('job-1')
+        self.assertEqual((job['status'], job['stage'], job['result']), (JobStatus.SUCCEEDED, 'done', result))
+
+    def test_each_job_is_handed_out_once_in_order(self):
+        self.job_queue.enqueue('first', 'a.jpg', b'a')
+        self.job_queue.enqueue('second', 'b.jpg', b'b')
+        self.assertEqual(self.job_queue.dequeue(timeout=0.1)[0], 'first')
+        self.assertEqual(self.job_queue.dequeue(timeout=0.1)[0], 'second')
+        self.assertIsNone(self.job_queue.dequeue(timeout=0.1))
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.job_queue.get('missing'))
+
+
+class TestInMemoryJobQueue(JobQueueTests, TestCase):
+
+    def make_queue(self):
+        return InMemoryJobQueue()
+
+
+class TestSQLiteJobQueue(JobQueueTests, TestCase):
+
+    def make_queue(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        return SQLiteJobQueue(os.path.join(self.directory.name, 'jobs.sqlite3'), poll_interval=0.01)
+
+    def test_jobs_survive_a_new_queue_instance(self):
+        self.job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+        restarted = SQLiteJobQueue(self.job_queue.path, poll_interval=0.01)
+        self.assertEqual(restarted.dequeue(timeout=0.1), ('job-1', 'photo.jpg', b'bytes'))
+
+    def test_job_of_a_killed_worker_runs_again_then_fails(self):
+        job_queue = SQLiteJobQueue(self.job_queue.path, poll_interval=0.01, lease_seconds=0.01, max_attempts=2)
+        job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+        self.assertEqual(job_queue.dequeue(timeout=0.1), ('job-1', 'photo.jpg', b'bytes'))
+        # the worker is killed before it reports anything
+        time.sleep(0.02)
+        self.assertEqual(job_queue.dequeue(timeout=0.1), ('job-1', 'photo.jpg', b'bytes'))
+        time.sleep(0.02)
+        self.assertIsNone(job_queue.dequeue(timeout=0))
+        job = job_queue.get('job-1')
+        self.assertEqual((job['status'], job['result']), (JobStatus.FAILED, FAILED_RESULT))
+
+    def test_upload_is_dropped_once_the_job_finished(self):
+        self.job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+        self.job_queue.dequeue(timeout=0.1)
+        with closing(sqlite3.connect(self.job_queue.path)) as connection:
+            self.assertIsNotNone(connection.execute("SELECT data FROM jobs WHERE job_id = 'job-1'").fetchone()[0])
+        self.job_queue.update('job-1', status=JobStatus.SUCCEEDED, stage='done', result={})
+        with closing(sqlite3.connect(self.job_queue.path)) as connection:
+            self.assertIsNone(connection.execute("SELECT data FROM jobs WHERE job_id = 'job-1'").fetchone()[0])
+
+    def test_connections_are_closed(self):
+        connections = []
+        connect = self.job_queue._connect
+
+        def connect_and_record():
+            connections.append(connect())
+            return connections[-1]
+
+        with mock.patch.object(self.job_queue, '_connect', connect_and_record):
+            self.job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+            self.job_queue.dequeue(timeout=0.1)
+            self.job_queue.update('job-1', status=JobStatus.SUCCEEDED, result={})
+            self.job_queue.get('job-1')
+        self.assertEqual(len(connections), 4)
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute('SELECT 1')
+
+    def test_failed_claim_raises_its_own_error(self):
+        # another process holds the write lock, so BEGIN IMMEDIATE gives up
+        blocker = sqlite3.connect(self.job_queue.path, isolation_level=None)
+        blocker.execute('BEGIN IMMEDIATE')
+        try:
+            with mock.patch.object(self.job_queue, '_connect',
+                                   lambda: sqlite3.connect(self.job_queue.path, timeout=0, isolation_level=None)):
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    self.job_queue.dequeue(timeout=0)
+        finally:
+            blocker.execute('ROLLBACK')
+            blocker.close()
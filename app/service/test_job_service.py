@@ -0,0 +1,30 @@
+import threading
+from unittest import TestCase, mock
+
+from app.service.job_queue import InMemoryJobQueue
+from app.service.job_service import JobService
+
+
+class FlakyJobQueue(InMemoryJobQueue):
+    """Fails its first ``failures`` dequeues, like a locked SQLite file would."""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def dequeue(self, timeout: float):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('database is locked')
+        return super().dequeue(timeout)
+
+
+class TestJobService(TestCase):
+
+    def test_worker_survives_queue_errors(self):
+        service = JobService(FlakyJobQueue(failures=2), workers=1, retry_delay_seconds=0)
+        processed = threading.Event()
+        with mock.patch.object(service, 'process', lambda *job: processed.set()):
+            service.job_queue.enqueue('job-1', 'photo.jpg', b'bytes')
+            service.start()
+            self.assertTrue(processed.wait(5))
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from app.service.message_pool import MessagePool
+from app.service.metrics import metrics
+
+
+class TestMessagePool(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def generator(prompt: str) -> str:
+            self.calls.append(prompt)
+            return f'reworded {len(self.calls)}'
+
+        self.pool = MessagePool({'Mary': 'base mary', 'Mohammed': 'base mohammed'}, generator, target_depth=2)
+
+    def test_empty_pool_falls_back_to_base_prompt(self):
+        self.pool.target_depth = 0  # no background thread
+        self.assertEqual(self.pool.pop('Mary'), 'base mary')
+        self.assertEqual(self.pool.stats()['Mary']['fallbacks'], 1)
+
+    def test_refill_to_target_depth_from_base_prompt(self):
+        while self.pool.refill_once():
+            pass
+        stats = self.pool.stats()
+        self.assertEqual(stats['Mary']['depth'], 2)
+        self.assertEqual(stats['Mohammed']['depth'], 2)
+        self.assertEqual(len(self.calls), 4)
+        # always reworded from the base prompt, never from a previous rewording
+        self.assertEqual(set(self.calls), {MessagePool.llm_prompt.format('base mary'),
+                                           MessagePool.llm_prompt.format('base mohammed')})
+
+    def test_pop_serves_pre_generated_messages(self):
+        while self.pool.refill_once():
+            pass
+        self.pool.target_depth = 0  # keep the background thread out of the way
+        message = self.pool.pop('Mohammed')
+        self.assertTrue(message.startswith('reworded'))
+        self.assertEqual(self.pool.stats()['Mohammed']['depth'], 1)
+        self.assertEqual(self.pool.stats()['Mohammed']['fallbacks'], 0)
+
+    def test_failed_refill_is_counted(self):
+        def failing(prompt: str) -> str:
+            raise RuntimeError('LLM down')
+
+        self.pool.generator = failing
+        with self.assertRaises(RuntimeError):
+            self.pool.refill_once()
+        self.assertEqual(sum(stats['refill_errors'] for stats in self.pool.stats().values()), 1)
+        self.assertGreaterEqual(sum(metrics.collect()[0]['valentine_message_pool_refill_errors_total'].values()), 1)
+
+    def test_depth_and_refill_latency_are_published(self):
+        refills_before = metrics.collect()[1].get('valentine_message_pool_refill_seconds', {}) \
+            .get((('label', 'Mary'),), [0.0])[-1]
+        while self.pool.refill_once():
+            pass
+        self.pool.target_depth = 0
+        self.pool.pop('Mary')
+        gauges, histograms = metrics.collect()
+        self.assertEqual(gauges['valentine_message_pool_depth'][(('label', 'Mary'),)], 1)
+        self.assertEqual(histograms['valentine_message_pool_refill_seconds'][(('label', 'Mary'),)][-1],
+                         refills_before + 2)
@@ -0,0 +1,80 @@
+import tempfile
+from unittest import TestCase
+
+from app.service.metrics import Metrics, current_trace
+
+
+class TestMetrics(TestCase):
+
+    def make_metrics(self, **kwargs) -> Metrics:
+        metrics = Metrics(**kwargs)
+        metrics.describe('images_total', 'counter', 'Images.')
+        metrics.describe('valentine_stage_seconds', 'histogram', 'Stages.', (0.1, 1.0))
+        metrics.describe('valentine_stage_errors_total', 'counter', 'Stage errors.')
+        metrics.describe('valentine_backend_errors_total', 'counter', 'Backend errors.')
+        return metrics
+
+    def test_counters_and_histograms_render_in_prometheus_format(self):
+        metrics = self.make_metrics()
+        metrics.inc('images_total', format='jpeg')
+        metrics.inc('images_total', 2, format='jpeg')
+        metrics.observe('valentine_stage_seconds', 0.05, stage='detect')
+        metrics.observe('valentine_stage_seconds', 0.5, stage='detect')
+
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE images_total counter', lines)
+        self.assertIn('images_total{format="jpeg"} 3', lines)
+        self.assertIn('valentine_stage_seconds_bucket{stage="detect",le="0.1"} 1', lines)
+        self.assertIn('valentine_stage_seconds_bucket{stage="detect",le="1"} 2', lines)
+        self.assertIn('valentine_stage_seconds_bucket{stage="detect",le="+Inf"} 2', lines)
+        self.assertIn('valentine_stage_seconds_count{stage="detect"} 2', lines)
+
+    def test_failed_stage_counts_as_backend_error(self):
+        metrics = self.make_metrics()
+        with self.assertRaises(RuntimeError):
+            with metrics.stage('detect', backend='face_detector'):
+                raise RuntimeError('down')
+        rendered = metrics.render()
+        self.assertIn('valentine_stage_errors_total{stage="detect"} 1', rendered)
+        self.assertIn('valentine_backend_errors_total{backend="face_detector"} 1', rendered)
+
+    def test_workers_sharing_a_directory_report_totals(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker_1 = self.make_metrics(directory=directory)
+            worker_2 = self.make_metrics(directory=directory)
+            # both live in this process, give the second one its own file
+            worker_2.flush = lambda: None
+            worker_1.inc('images_total')
+            worker_1.flush()
+            worker_1.inc('images_total')
+            with open(f'{directory}/metrics_1.json', 'w') as file:
+                file.write('{"counters": {"images_total": [[[], 5]]}, "histograms": {}}')
+
+            self.assertIn('images_total 7', worker_1.render())
+            self.assertIn('images_total 7', worker_2.render())
+
+    def test_gauges_of_stopped_workers_are_left_out(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics = self.make_metrics(directory=directory)
+            metrics.describe('queue_depth', 'gauge', 'Queue depth.')
+            metrics.set('queue_depth', 2)
+            metrics.set('queue_depth', 3)
+            # a worker that is gone: its counters still count, its gauges no longer do
+            with open(f'{directory}/metrics_0.json', 'w') as file:
+                file.write('{"pid": 999999999, "counters": {"images_total": [[[], 5]]}, '
+                           '"gauges": {"queue_depth": [[[], 7]]}, "histograms": {}}')
+
+            rendered = metrics.render()
+            self.assertIn('# TYPE queue_depth gauge', rendered)
+            self.assertIn('queue_depth 3', rendered)
+            self.assertIn('images_total 5', rendered)
+
+    def test_sampled_trace_records_stages(self):
+        metrics = self.make_metrics(trace_sample_rate=1.0)
+        trace, token = metrics.start_trace('request-1')
+        with metrics.stage('detect'):
+            pass
+        self.assertIs(current_trace.get(), trace)
+        current_trace.reset(token)
+        self.assertEqual(trace.request_id, 'request-1')
+        self.assertEqual([span['stage'] for span in trace.spans], ['detect'])
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+
+from app.model.decoded_image import DecodedImage
+from app.service.metrics import metrics
+from app.service.result_cache import ResultCache, SQLiteCacheTier
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        y, x = np.mgrid[0:64, 0:96]
+        pixels = np.zeros((64, 96, 4), dtype=np.uint8)
+        pixels[..., 0] = x * 2
+        pixels[..., 1] = y * 3
+        self.image = DecodedImage(pixels)
+        self.value = {'status': 200, 'body': {'imageUrl': 'https://bucket/modified.jpg'}, 'faces': []}
+
+    def test_content_hash_hit_and_miss(self):
+        cache = ResultCache(max_size=8)
+        keys, value = cache.lookup(b'photo', lambda: self.image)
+        self.assertIsNone(value)
+        cache.put(keys, self.value)
+        _, value = cache.lookup(b'photo', lambda: self.image)
+        self.assertEqual(value, self.value)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_hits_and_size_are_published(self):
+        def local_hits() -> float:
+            return metrics.collect()[0].get('valentine_result_cache_hits_total', {}).get((('tier', 'local'),), 0)
+
+        cache = ResultCache(max_size=8)
+        hits = local_hits()
+        keys, _ = cache.lookup(b'photo', lambda: self.image)
+        cache.put(keys, self.value)
+        cache.lookup(b'photo', lambda: self.image)
+        self.assertEqual(local_hits() - hits, 1)
+        self.assertEqual(metrics.collect()[0]['valentine_result_cache_size'][()], 1)
+
+    def test_perceptual_hash_matches_re_encoded_copy(self):
+        cache = ResultCache(max_size=8, perceptual=True)
+        keys, _ = cache.lookup(b'original encoding', lambda: self.image)
+        cache.put(keys, self.value)
+
+        slightly_different = DecodedImage(self.image.pixels.copy())
+        slightly_different.pixels[0, 0, 0] ^= 1
+        _, value = cache.lookup(b'another encoding', lambda: slightly_different)
+        self.assertEqual(value, self.value)
+        self.assertEqual(cache.stats()['perceptual_hits'], 1)
+
+    def test_perceptual_hash_is_not_computed_without_need(self):
+        cache = ResultCache(max_size=8, perceptual=False)
+
+        def fail():
+            raise AssertionError('image should not be decoded')
+
+        keys, _ = cache.lookup(b'photo', fail)
+        self.assertEqual(len(keys), 1)
+
+    def test_disabled_cache(self):
+        cache = ResultCache(max_size=0)
+        keys, _ = cache.lookup(b'photo', lambda: self.image)
+        cache.put(keys, self.value)
+        self.assertIsNone(cache.lookup(b'photo', lambda: self.image)[1])
+
+    def test_shared_tier_is_visible_to_other_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite3')
+            worker_1 = ResultCache(max_size=8, shared=SQLiteCacheTier(path))
+            worker_2 = ResultCache(max_size=8, shared=SQLiteCacheTier(path))
+
+            keys, _ = worker_1.lookup(b'photo', lambda: self.image)
+            worker_1.put(keys, self.value)
+            _, value = worker_2.lookup(b'photo', lambda: self.image)
+            self.assertEqual(value, self.value)
+            self.assertEqual(worker_2.stats()['shared_hits'], 1)
+
+    def test_shared_tier_closes_its_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tier = SQLiteCacheTier(os.path.join(directory, 'cache.sqlite3'))
+            connections = []
+            connect = tier._connect
+
+            def connect_and_record():
+                connections.append(connect())
+                return connections[-1]
+
+            with mock.patch.object(tier, '_connect', connect_and_record):
+                tier.set('key', self.value, 60)
+                self.assertEqual(tier.get('key'), self.value)
+            for connection in connections:
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    connection.execute('SELECT 1')
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from app.service.backends.object_store import LocalObjectStore
+from app.service.metrics import metrics
+from app.service.uploader import Uploader
+
+
+class CountingStore(LocalObjectStore):
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.puts = []
+        self.lookups = []
+        self.threads = {}
+        self.release = threading.Event()
+        self.release.set()
+
+    def put(self, key: str, data: bytes) -> str:
+        self.release.wait(5)
+        self.puts.append(key)
+        self.threads[key] = threading.current_thread().name
+        return super().put(key, data)
+
+    def exists(self, key: str) -> bool:
+        self.lookups.append(key)
+        return super().exists(key)
+
+
+class TestUploader(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CountingStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_content_addressed_keys(self):
+        uploader = Uploader(lambda: self.store, workers=0)
+        url = uploader.upload('modified', b'image', '.JPG')
+        key = f"modified/{hashlib.sha256(b'image').hexdigest()}.jpg"
+        self.assertEqual(url, self.store.url(key))
+        with open(os.path.join(self.directory.name, key), 'rb') as file:
+            self.assertEqual(file.read(), b'image')
+
+    def test_skips_stored_objects(self):
+        uploader = Uploader(lambda: self.store, workers=0)
+        uploader.upload('modified', b'image')
+        uploader.upload('modified', b'image')
+        # results are not looked up in the store, only skipped once this worker stored them
+        self.assertEqual((len(self.store.puts), self.store.lookups), (1, []))
+        # another worker, which does not know the key yet, finds an original in the store
+        Uploader(lambda: self.store, workers=0).upload_later('modified', b'image')
+        self.assertEqual(len(self.store.puts), 1)
+        self.assertEqual(len(self.store.lookups), 1)
+        uploader.upload('modified', b'other image')
+        self.assertEqual(len(self.store.puts), 2)
+
+    def test_write_behind_and_flush(self):
+        uploader = Uploader(lambda: self.store, queue_size=8, workers=1)
+        self.store.release.clear()
+        url = uploader.upload_later('original', b'original', '.png')
+        self.assertTrue(url.endswith('.png'))
+        self.assertEqual(self.store.puts, [])
+        self.assertFalse(uploader.flush(timeout=0.05))
+        self.store.release.set()
+        self.assertTrue(uploader.flush(timeout=5))
+        self.assertEqual(uploader.pending(), 0)
+        self.assertEqual(len(self.store.puts), 1)
+
+    def test_full_queue_uploads_inline(self):
+        uploader = Uploader(lambda: self.store, queue_size=1, workers=1)
+        self.store.release.clear()
+        uploader.upload_later('original', b'first')
+        # wait for the upload thread to take the first image, then fill the queue
+        while uploader._queue.qsize():
+            threading.Event().wait(0.01)
+        uploader.upload_later('original', b'second')
+        # the queue is full, the third one is uploaded by its caller
+        caller = threading.Thread(target=uploader.upload_later, args=('original', b'third'), name='request')
+        caller.start()
+        caller.join(0.2)
+        self.assertTrue(caller.is_alive())
+        self.store.release.set()
+        caller.join(5)
+        self.assertTrue(uploader.flush(timeout=5))
+        self.assertEqual(self.store.threads[Uploader.key('original', b'third')], 'request')
+        self.assertEqual(len(self.store.puts), 3)
+
+    def test_failed_uploads_do_not_block_flush(self):
+        def fail(*args):
+            raise OSError('store unavailable')
+
+        self.store.put = fail
+        failed = metrics.collect()[0].get('valentine_uploads_total', {}).get((('outcome', 'failed'),), 0)
+        uploader = Uploader(lambda: self.store, workers=1)
+        uploader.upload_later('original', b'original')
+        self.assertTrue(uploader.flush(timeout=5))
+        self.assertEqual(metrics.collect()[0]['valentine_uploads_total'][(('outcome', 'failed'),)], failed + 1)
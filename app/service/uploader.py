@@ -0,0 +1,166 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from app.service.backends.object_store import ObjectStore
+from app.service.metrics import metrics
+
+
+class Uploader:
+    """
+    Stores images in the object store under content-addressed keys, ``{prefix}/{sha256}{extension}``.
+
+    Identical images map to the same key, so two uploads with the same file name never overwrite each other and an
+    image that is already stored is not uploaded again. ``upload`` stores an image before returning its URL and is
+    meant for results the client is about to fetch. Those are almost always new, so it skips only the last
+    ``known_keys`` keys this worker stored, without asking the store first, which would add a round trip to every
+    request. The same result rendered by another worker or before a restart is put again, over identical bytes.
+    ``upload_later`` only puts an image on a bounded write-behind queue that ``workers`` background threads drain,
+    checking the store first as that is off the request path; the URL is known from the key straight away. When the
+    queue is full the caller uploads the image itself, so a slow object store slows requests down instead of piling
+    up images in memory. ``upload_async`` and ``upload_later_async`` do the same on an event loop, with the store's
+    async methods.
+    """
+
+    def __init__(self, store: Callable[[], ObjectStore], call: Callable[..., Any] = None,
+                 call_async: Callable[..., Awaitable[Any]] = None, queue_size: int = 32, workers: int = 2,
+                 known_keys: int = 4096):
+        # the object store is looked up on every upload, so it is only created once it is needed
+        self.store = store
+        # runs every object store call, e.g. through Backends.call for retries
+        self.call = call or (lambda name, method, *args, **kwargs: method(*args))
+        self.call_async = call_async or Uploader.call_directly
+        self.workers = workers
+        self.known_keys = known_keys
+        self._queue: 'queue.Queue[Tuple[str, bytes]]' = queue.Queue(maxsize=max(queue_size, 1))
+        self._known: 'OrderedDict[str, None]' = OrderedDict()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prefix: str, data: bytes, extension: str = '.jpg') -> str:
+        return f"{prefix}/{hashlib.sha256(data).hexdigest()}{extension.lower()}"
+
+    def start(self) -> None:
+        """Start the upload threads. Done lazily so they are created in the serving process, not before a fork."""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for idx in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f'uploader-{idx}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def upload(self, prefix: str, data: bytes, extension: str = '.jpg') -> str:
+        """Stores ``data`` unless this worker already did, and returns its URL."""
+        key = Uploader.key(prefix, data, extension)
+        self._store(key, data, check_store=False)
+        return self.store().url(key)
+
+    def upload_later(self, prefix: str, data: bytes, extension: str = '.jpg') -> str:
+        """Queues ``data`` to be stored in the background and returns the URL it will have."""
+        key = Uploader.key(prefix, data, extension)
+        if not self._enqueue(key, data):
+            self._store(key, data)
+        return self.store().url(key)
+
+    async def upload_async(self, prefix: str, data: bytes, extension: str = '.jpg') -> str:
+        key = Uploader.key(prefix, data, extension)
+        await self._store_async(key, data, check_store=False)
+        return self.store().url(key)
+
+    async def upload_later_async(self, prefix: str, data: bytes, extension: str = '.jpg') -> str:
+        key = Uploader.key(prefix, data, extension)
+        if not self._enqueue(key, data):
+            await self._store_async(key, data)
+        return self.store().url(key)
+
+    def _enqueue(self, key: str, data: bytes) -> bool:
+        """Puts an upload on the write-behind queue; False if there is no room, or no workers, for it."""
+        if self.workers <= 0:
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait((key, data))
+        except queue.Full:
+            metrics.inc('valentine_uploads_total', outcome='queue_full')
+            return False
+        metrics.inc('valentine_uploads_total', outcome='queued')
+        return True
+
+    def pending(self) -> int:
+        """Uploads queued or in progress."""
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every queued upload is done, at most ``timeout`` seconds. Returns whether they all are."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _work(self) -> None:
+        while True:
+            key, data = self._queue.get()
+            try:
+                self._store(key, data)
+            except Exception:
+                # already retried by the outbound layer, the request that queued it has long been answered
+                metrics.inc('valentine_uploads_total', outcome='failed')
+            finally:
+                self._queue.task_done()
+
+    def _store(self, key: str, data: bytes, check_store: bool = True) -> None:
+        store = self.store()
+        with metrics.stage('upload', backend='object_store'):
+            if self._is_known(key) or (check_store and self.call('object_store', store.exists, key, idempotent=True)):
+                self._remember(key)
+                metrics.inc('valentine_uploads_total', outcome='skipped')
+                return
+            self.call('object_store', store.put, key, data)
+        self._remember(key)
+        metrics.inc('valentine_uploads_total', outcome='uploaded')
+        metrics.inc('valentine_bytes_out_total', len(data))
+
+    async def _store_async(self, key: str, data: bytes, check_store: bool = True) -> None:
+        store = self.store()
+        with metrics.stage('upload', backend='object_store'):
+            if self._is_known(key) or (check_store and await self.call_async('object_store', store.exists_async, key,
+                                                                             idempotent=True)):
+                self._remember(key)
+                metrics.inc('valentine_uploads_total', outcome='skipped')
+                return
+            await self.call_async('object_store', store.put_async, key, data)
+        self._remember(key)
+        metrics.inc('valentine_uploads_total', outcome='uploaded')
+        metrics.inc('valentine_bytes_out_total', len(data))
+
+    @staticmethod
+    async def call_directly(name: str, method: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        return await method(*args)
+
+    def _is_known(self, key: str) -> bool:
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, key: str) -> None:
+        # keys stored by this worker, so they are not even looked up again
+        with self._lock:
+            self._known[key] = None
+            self._known.move_to_end(key)
+            while len(self._known) > self.known_keys:
+                self._known.popitem(last=False)
+
+    @staticmethod
+    def extension(file_name: str) -> str:
+        return os.path.splitext(file_name)[1].lower() or '.jpg'
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from app import app, Constants
+from app.asgi import application
+from app.service import async_image_service, image_service
+from app.service.backends import Backends
+from app.service.image_service import uploader
+from app.service.result_cache import ResultCache
+
+
+def photo() -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(7).integers(0, 256, (240, 320, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class TestAsgiApp(TestCase):
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.config = mock.patch.dict(app.config, {Constants.BACKEND_MODE: 'local',
+                                                   Constants.LOCAL_OBJECT_STORE_PATH: self.store.name})
+        self.config.start()
+        Backends.reset()
+        # every test starts without cached results
+        cache = ResultCache()
+        self.caches = [mock.patch.object(module, 'result_cache', cache)
+                       for module in (image_service, async_image_service)]
+        for patch in self.caches:
+            patch.start()
+
+    def tearDown(self):
+        uploader.flush(5)
+        for patch in self.caches:
+            patch.stop()
+        self.config.stop()
+        Backends.reset()
+        self.store.cleanup()
+
+    def post(self, *requests) -> list:
+        async def send():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application),
+                                         base_url='http://valentine') as client:
+                return await asyncio.gather(*(client.post(path, files=files) for path, files in requests))
+
+        return asyncio.run(send())
+
+    def test_processes_an_image(self):
+        response, = self.post(('/process-image', {'image': ('photo.jpg', photo(), 'image/jpeg')}))
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertTrue(response.json()['imageUrl'].startswith(f'file://{self.store.name}/modified/'))
+        self.assertIn('detecting;dur=', response.headers['Server-Timing'])
+        self.assertIn('X-Request-ID', response.headers)
+
+    def test_answers_like_the_flask_route(self):
+        responses = self.post(('/process-image', {'image': ('photo.jpg', b'<html></html>', 'image/jpeg')}),
+                              ('/process-image', {'images': ('photo.jpg', photo(), 'image/jpeg')}),
+                              ('/process-image', {'image': ('photo.gif', photo(), 'image/gif')}))
+        self.assertEqual([response.status_code for response in responses], [415, 400, 400])
+        self.assertEqual(responses[1].json(), {'msg': 'No image provided'})
+
+    def test_answers_with_the_image(self):
+        async def send():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application),
+                                         base_url='http://valentine') as client:
+                files = {'image': ('photo.jpg', photo(), 'image/jpeg')}
+                response = await client.post('/process-image?output=image', files=files,
+                                             headers={'Accept': 'image/webp,*/*'})
+                repeated = await client.post('/process-image?output=image', files=files,
+                                             headers={'Accept': 'image/webp,*/*',
+                                                      'If-None-Match': response.headers.get('ETag', '')})
+                return response, repeated
+
+        response, repeated = asyncio.run(send())
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.headers['Content-Type'], 'image/webp')
+        self.assertEqual(response.headers['ETag'], f'"{hashlib.sha256(response.content).hexdigest()}"')
+        self.assertEqual(response.headers['X-Prediction-Label'], 'Mary')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        with Image.open(io.BytesIO(response.content)) as img:
+            self.assertEqual(img.format, 'WEBP')
+        # the client already has it
+        self.assertEqual((repeated.status_code, repeated.content), (304, b''))
+        # and nothing was stored for it
+        uploader.flush(5)
+        self.assertFalse(os.path.exists(os.path.join(self.store.name, 'modified')))
+
+    def test_rejects_invalid_output_parameters(self):
+        response, = self.post(('/process-image?format=gif', {'image': ('photo.jpg', photo(), 'image/jpeg')}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('gif', response.json()['msg'])
+
+    def test_other_endpoints_are_served_by_flask(self):
+        async def get():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application),
+                                         base_url='http://valentine') as client:
+                return await client.get('/health')
+
+        self.assertEqual(asyncio.run(get()).json(), {'msg': 'API is up', 'status': 'OK'})
@@ -0,0 +1,117 @@
+import os
+import threading
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+from cachetools import LRUCache
+
+from app import app, Constants
+from app.service.metrics import metrics
+from app.utils.compositor import Compositor, ScaledAsset
+
+
+class _CountingLRUCache(LRUCache):
+    """LRUCache that counts how many entries it had to evict."""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class AssetRegistry:
+    """
+    Accessory overlays decoded once per worker and split into premultiplied colour and alpha planes.
+
+    Resized versions are kept in an LRU cache keyed by the asset name and the target width rounded to
+    ``width_step`` pixels, so faces of similar size share one resize and a request never touches the disk.
+    """
+
+    def __init__(self, cache_size: int = 256, width_step: int = 8):
+        self.width_step = width_step
+        self._assets: Dict[str, ScaledAsset] = {}
+        self._cache = _CountingLRUCache(cache_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, name: str, path: str) -> None:
+        """Decode the overlay at ``path`` now and make it available as ``name``."""
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise FileNotFoundError(f"Could not read accessory image '{path}'")
+        self.register_image(name, image)
+
+    def register_image(self, name: str, image: np.ndarray) -> None:
+        """Register an already decoded BGR or BGRA overlay; images without alpha are treated as opaque."""
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        asset = Compositor.premultiply(image)
+        with self._lock:
+            self._assets[name] = asset
+            # drop stale resizes of a re-registered asset
+            for key in [key for key in self._cache if key[0] == name]:
+                del self._cache[key]
+
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self._assets)
+
+    def original(self, name: str) -> ScaledAsset:
+        return self._assets[name]
+
+    def get(self, name: str, width: float, height_scale: float = 1.0) -> ScaledAsset:
+        """
+        Returns ``name`` resized to ``width`` (rounded to the cache's width step). The height follows the
+        asset's aspect ratio, stretched by ``height_scale``.
+        """
+        bucket = max(self.width_step, int(round(width / self.width_step)) * self.width_step)
+        key = (name, bucket, height_scale)
+        with self._lock:
+            scaled = self._cache.get(key)
+            if scaled is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            original = self._assets[name]
+        metrics.inc('valentine_asset_cache_total', result='miss' if scaled is None else 'hit')
+        if scaled is not None:
+            return scaled
+
+        height = max(1, int(round(original.height * bucket / original.width * height_scale)))
+        interpolation = cv2.INTER_AREA if bucket < original.width else cv2.INTER_LINEAR
+        scaled = ScaledAsset(cv2.resize(original.colour, (bucket, height), interpolation=interpolation),
+                             cv2.resize(original.alpha, (bucket, height), interpolation=interpolation))
+        with self._lock:
+            evictions = self._cache.evictions
+            self._cache[key] = scaled
+            evicted, size = self._cache.evictions - evictions, len(self._cache)
+        if evicted:
+            metrics.inc('valentine_asset_cache_evictions_total', evicted)
+        metrics.set('valentine_asset_cache_size', size)
+        return scaled
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self._cache.evictions,
+                    'size': len(self._cache),
+                    'max_size': int(self._cache.maxsize)}
+
+
+class Assets:
+    SUNGLASSES = 'sunglasses'
+    CIGAR = 'cigar'
+    HEART = 'heart'
+
+
+asset_registry = AssetRegistry(cache_size=int(app.config.get(Constants.ASSET_CACHE_SIZE)),
+                               width_step=int(app.config.get(Constants.ASSET_WIDTH_STEP)))
+asset_registry.register(Assets.SUNGLASSES, os.path.join(app.static_folder, 'Sunglasses.png'))
+asset_registry.register(Assets.CIGAR, os.path.join(app.static_folder, 'cigar.png'))
+asset_registry.register(Assets.HEART, os.path.join(app.static_folder, 'sapphire_heart.png'))
@@ -0,0 +1,101 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.asset_registry import Assets, asset_registry
+from app.utils.compositor import ScaledAsset
+
+# the landmarks the accessories are placed on, in the order Rekognition lists them
+EYE_LEFT, EYE_RIGHT, MOUTH_LEFT, MOUTH_RIGHT = range(4)
+
+
+class Decorations:
+    HEARTS = 'hearts'
+    SUNGLASSES_AND_CIGAR = 'sunglasses_and_cigar'
+
+
+class FaceGeometry:
+    """
+    Face crops and accessory placement for every face of an image at once. Rekognition's bounding boxes and
+    landmarks are relative to the image size; they are turned into pixels as arrays of all faces, so a face more
+    costs an asset lookup (a cache hit once its size was seen) and its blends, not another pass of arithmetic in
+    Python.
+    """
+
+    @staticmethod
+    def bounding_boxes(faces: Sequence[Dict[str, Any]], key: str = 'bounding_box') -> np.ndarray:
+        """Left, top, width and height of every face, relative to the image, as an n x 4 array."""
+        return np.array([[face[key]['Left'], face[key]['Top'], face[key]['Width'], face[key]['Height']]
+                         for face in faces], dtype=np.float64).reshape(-1, 4)
+
+    @staticmethod
+    def landmarks(faces: Sequence[Dict[str, Any]], count: int = 4, key: str = 'landmarks') -> np.ndarray:
+        """X and Y of the first ``count`` landmarks of every face, relative to the image, as an n x count x 2 array."""
+        return np.array([[(landmark['X'], landmark['Y']) for landmark in face[key][:count]] for face in faces],
+                        dtype=np.float64).reshape(-1, count, 2)
+
+    @staticmethod
+    def crop_boxes(bounding_boxes: np.ndarray, width: int, height: int, scale_factor: float = 1.2) -> np.ndarray:
+        """
+        Pixel boxes of the face crops as left, top, right and bottom: every bounding box grown by ``scale_factor``
+        around its centre, moved back inside the image at the top and left.
+        """
+        left, top, box_width, box_height = np.trunc(bounding_boxes * [width, height, width, height]).astype(np.int64).T
+        new_width = np.trunc(box_width * scale_factor).astype(np.int64)
+        new_height = np.trunc(box_height * scale_factor).astype(np.int64)
+        new_left = np.maximum(left - (new_width - box_width) // 2, 0)
+        new_top = np.maximum(top - (new_height - box_height) // 2, 0)
+        return np.stack([new_left, new_top, new_left + new_width, new_top + new_height], axis=1)
+
+    @staticmethod
+    def overlays(faces: Sequence[Dict[str, Any]], decorations: Sequence[Optional[str]], width: int,
+                 height: int) -> List[Tuple[ScaledAsset, Tuple[int, int]]]:
+        """
+        The ``(asset, (x, y))`` pairs that decorate every face with its entry of ``decorations``, in face order, ready
+        for ``Compositor.composite``. Faces without a decoration are left alone.
+        """
+        per_face: List[List[Tuple[ScaledAsset, Tuple[int, int]]]] = [[] for _ in faces]
+        for decoration, place in ((Decorations.HEARTS, FaceGeometry.hearts_on_eyes),
+                                  (Decorations.SUNGLASSES_AND_CIGAR, FaceGeometry.cigar_and_sunglasses)):
+            indices = [idx for idx, face_decoration in enumerate(decorations) if face_decoration == decoration]
+            if indices:
+                landmarks = FaceGeometry.landmarks([faces[idx] for idx in indices])
+                for idx, face_overlays in zip(indices, place(landmarks, width, height)):
+                    per_face[idx] = face_overlays
+        return [overlay for face_overlays in per_face for overlay in face_overlays]
+
+    @staticmethod
+    def hearts_on_eyes(landmarks: np.ndarray, width: int, height: int,
+                       heart_scale_factor: float = 0.8) -> List[List[Tuple[ScaledAsset, Tuple[int, int]]]]:
+        """A heart centred on each eye of every face, as wide as ``heart_scale_factor`` times the eye distance."""
+        eyes = np.trunc(landmarks[:, [EYE_LEFT, EYE_RIGHT]] * [width, height]).astype(np.int64)
+        hearts = [asset_registry.get(Assets.HEART, heart_width)
+                  for heart_width in (eyes[:, 1, 0] - eyes[:, 0, 0]) * heart_scale_factor]
+        half_sizes = np.array([(heart.width // 2, heart.height // 2) for heart in hearts], dtype=np.int64)
+        offsets = (eyes - half_sizes[:, None, :]).tolist()
+        return [[(heart, tuple(offset[0])), (heart, tuple(offset[1]))] for heart, offset in zip(hearts, offsets)]
+
+    @staticmethod
+    def cigar_and_sunglasses(landmarks: np.ndarray, width: int, height: int,
+                             sunglasses_scale_factor: float = 2.3) -> List[List[Tuple[ScaledAsset, Tuple[int, int]]]]:
+        """
+        Sunglasses spanning ``sunglasses_scale_factor`` times the eye distance, stretched vertically by it too, and a
+        cigar from one corner of the mouth to the other, for every face.
+        """
+        pixels = landmarks * [width, height]
+        eyes = np.trunc(pixels[:, [EYE_LEFT, EYE_RIGHT]]).astype(np.int64)
+        mouth_left = np.trunc(pixels[:, MOUTH_LEFT]).astype(np.int64)
+        sunglasses = [asset_registry.get(Assets.SUNGLASSES, sunglasses_width, height_scale=sunglasses_scale_factor)
+                      for sunglasses_width in (eyes[:, 1, 0] - eyes[:, 0, 0]) * sunglasses_scale_factor]
+        cigars = [asset_registry.get(Assets.CIGAR, cigar_width)
+                  for cigar_width in pixels[:, MOUTH_RIGHT, 0] - pixels[:, MOUTH_LEFT, 0]]
+        sunglasses_sizes = np.array([(asset.width, asset.height) for asset in sunglasses], dtype=np.int64)
+        cigar_heights = np.array([asset.height for asset in cigars], dtype=np.int64)
+        # sunglasses moved to the left a bit, the cigar up a little
+        sunglasses_offsets = np.stack([eyes[:, 0, 0] - np.trunc(sunglasses_sizes[:, 0] * 0.2).astype(np.int64),
+                                       eyes[:, 0, 1] - sunglasses_sizes[:, 1] // 2], axis=1).tolist()
+        cigar_offsets = np.stack([mouth_left[:, 0],
+                                  mouth_left[:, 1] - np.trunc(cigar_heights * 0.2).astype(np.int64)], axis=1).tolist()
+        return [[(asset, tuple(sunglasses_offset)), (cigar, tuple(cigar_offset))]
+                for asset, cigar, sunglasses_offset, cigar_offset
+                in zip(sunglasses, cigars, sunglasses_offsets, cigar_offsets)]
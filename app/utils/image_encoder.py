@@ -0,0 +1,163 @@
+import io
+from typing import Optional, Tuple
+
+from PIL import Image
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+
+class TargetSizeEncoder:
+    """
+    Encodes images as JPEG within a byte budget and a bounding box.
+
+    The image is first scaled down to fit ``max_size`` (and ``max_pixels``). Then the highest quality between
+    ``min_quality`` and ``max_quality`` that fits ``max_bytes`` is binary searched. If even ``min_quality`` is too
+    large, the image is scaled down by the size overshoot and searched again. Everything is encoded in memory, and
+    the number of encodes is bounded by ``quality_steps`` and ``max_rescales``.
+    """
+
+    def __init__(self, max_bytes: int, max_size: Tuple[int, int] = (4096, 4096), max_pixels: Optional[int] = None,
+                 min_quality: int = 60, max_quality: int = 95, quality_steps: int = 4, max_rescales: int = 4):
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        self.max_pixels = max_pixels
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_steps = quality_steps
+        self.max_rescales = max_rescales
+
+    def fits(self, size: Tuple[int, int]) -> bool:
+        width, height = size
+        return (width <= self.max_size[0] and height <= self.max_size[1]
+                and (self.max_pixels is None or width * height <= self.max_pixels))
+
+    def target_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """The largest size with the aspect ratio of ``size`` inside the bounding box and pixel cap."""
+        width, height = size
+        scale = min(1.0, self.max_size[0] / width, self.max_size[1] / height)
+        if self.max_pixels is not None:
+            scale = min(scale, (self.max_pixels / (width * height)) ** 0.5)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def encode_data(self, data: bytes, image: Optional[Image.Image] = None) -> bytes:
+        """
+        Returns ``data`` untouched when it is within the byte budget and its dimensions fit, otherwise a re-encode.
+        Pass the already decoded ``image`` to downscale from it; without it only a reduced-size draft of a JPEG is
+        decoded.
+        """
+        with Image.open(io.BytesIO(data)) as img:
+            if len(data) <= self.max_bytes and self.fits(img.size):
+                return data
+            exif = img.info.get('exif')
+            if image is not None:
+                return self.encode(image, exif)
+            # let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding, never below the target size
+            img.draft('RGB', self.target_size(img.size))
+            return self.encode(img, exif)
+
+    def encode(self, image: Image.Image, exif: Optional[bytes] = None) -> bytes:
+        """Encodes ``image`` within the budget, keeping ``exif`` (e.g. the orientation) when given."""
+        size = self.target_size(image.size)
+        smallest = b''
+        for _ in range(self.max_rescales + 1):
+            scaled = image if size == image.size else image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            if scaled.mode not in ('RGB', 'L'):
+                scaled = scaled.convert('RGB')
+            encoded = self._search_quality(scaled, exif)
+            if len(encoded) <= self.max_bytes:
+                return encoded
+            smallest = encoded
+            # shrink both sides by the square root of the overshoot, with some margin
+            shrink = (self.max_bytes / len(encoded)) ** 0.5 * 0.9
+            size = max(1, int(size[0] * shrink)), max(1, int(size[1] * shrink))
+        return smallest
+
+    def _search_quality(self, image: Image.Image, exif: Optional[bytes]) -> bytes:
+        """The encode at the highest quality that fits the budget, otherwise the smallest one tried."""
+        encoded = TargetSizeEncoder._jpeg(image, self.max_quality, exif)
+        if len(encoded) <= self.max_bytes:
+            return encoded
+        smallest, fitting = encoded, None
+        low, high = self.min_quality, self.max_quality - 1
+        for _ in range(self.quality_steps):
+            if low > high:
+                break
+            quality = (low + high) // 2
+            encoded = TargetSizeEncoder._jpeg(image, quality, exif)
+            if len(encoded) <= self.max_bytes:
+                fitting, low = encoded, quality + 1
+            else:
+                high = quality - 1
+            smallest = min(smallest, encoded, key=len)
+        return fitting or smallest
+
+    @staticmethod
+    def _jpeg(image: Image.Image, quality: int, exif: Optional[bytes]) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, **({'exif': exif} if exif else {}))
+        return buffer.getvalue()
+
+
+class OutputEncoder:
+    """
+    Encodes a rendered result in the format a client asked for: WebP, progressive JPEG or PNG, at ``quality`` (1-100;
+    PNG is lossless and ignores it), scaled down first so its longest side fits ``max_dimension`` if given.
+    """
+    JPEG = 'jpeg'
+    WEBP = 'webp'
+    PNG = 'png'
+    MIMETYPES = {JPEG: 'image/jpeg', WEBP: 'image/webp', PNG: 'image/png'}
+    EXTENSIONS = {JPEG: '.jpg', WEBP: '.webp', PNG: '.png'}
+
+    def __init__(self, image_format: str = JPEG, quality: int = 95, max_dimension: Optional[int] = None):
+        if image_format not in OutputEncoder.MIMETYPES:
+            raise ValueError(f"Unsupported output format '{image_format}'. Use one of: "
+                             f"{', '.join(OutputEncoder.MIMETYPES)}.")
+        if not 1 <= quality <= 100:
+            raise ValueError('The quality must be between 1 and 100.')
+        if max_dimension is not None and max_dimension < 1:
+            raise ValueError('The size must be a positive number of pixels.')
+        self.image_format = image_format
+        self.quality = quality
+        self.max_dimension = max_dimension
+
+    @staticmethod
+    def negotiate(accept: Optional[str], default: str = JPEG) -> str:
+        """
+        The format of the ``Accept`` header's best image type we can encode. Wildcards, a missing header and one
+        without an image type we support all get ``default``.
+        """
+        offers = [OutputEncoder.MIMETYPES[default]] + [mimetype for image_format, mimetype
+                                                        in OutputEncoder.MIMETYPES.items() if image_format != default]
+        best = parse_accept_header(accept, MIMEAccept).best_match(offers) if accept else None
+        return next((image_format for image_format, mimetype in OutputEncoder.MIMETYPES.items()
+                     if mimetype == best), default)
+
+    @property
+    def mimetype(self) -> str:
+        return OutputEncoder.MIMETYPES[self.image_format]
+
+    @property
+    def extension(self) -> str:
+        return OutputEncoder.EXTENSIONS[self.image_format]
+
+    @property
+    def key(self) -> str:
+        """Tells apart encodes of the same image that differ, e.g. in the result cache."""
+        return f"{self.image_format}:{self.quality}:{self.max_dimension or ''}"
+
+    def encode(self, image: Image.Image) -> bytes:
+        if self.max_dimension is not None and max(image.size) > self.max_dimension:
+            scale = self.max_dimension / max(image.size)
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                 Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        if self.image_format == OutputEncoder.JPEG:
+            image.save(buffer, format='JPEG', quality=self.quality, progressive=True)
+        elif self.image_format == OutputEncoder.WEBP:
+            image.save(buffer, format='WEBP', quality=self.quality)
+        else:
+            image.save(buffer, format='PNG')
+        return buffer.getvalue()
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+import numpy as np
+
+from app.service.metrics import metrics
+from app.utils.asset_registry import AssetRegistry, asset_registry, Assets
+from app.utils.compositor import Compositor
+
+
+class TestAssetRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = AssetRegistry(cache_size=2, width_step=8)
+        overlay = np.zeros((20, 40, 4), dtype=np.uint8)
+        overlay[..., :3] = 200
+        overlay[..., 3] = 128
+        self.registry.register_image('box', overlay)
+
+    def test_planes_are_premultiplied(self):
+        original = self.registry.original('box')
+        self.assertEqual(original.colour.shape, (20, 40, 3))
+        self.assertEqual(original.alpha.shape, (20, 40))
+        self.assertEqual(int(original.colour[0, 0, 0]), round(200 * 128 / 255))
+
+    def test_premultiplied_like_the_compositor(self):
+        overlay = np.random.default_rng(3).integers(0, 256, (16, 16, 4), dtype=np.uint8)
+        self.registry.register_image('random', overlay)
+        np.testing.assert_array_equal(self.registry.original('random').colour, Compositor.premultiply(overlay).colour)
+
+    def test_width_is_quantized_and_cached(self):
+        first = self.registry.get('box', 21)
+        second = self.registry.get('box', 23)
+        self.assertIs(first, second)
+        self.assertEqual((first.width, first.height), (24, 12))
+        self.assertEqual(self.registry.stats()['hits'], 1)
+        self.assertEqual(self.registry.stats()['misses'], 1)
+
+    def test_height_scale(self):
+        stretched = self.registry.get('box', 40, height_scale=2.0)
+        self.assertEqual((stretched.width, stretched.height), (40, 40))
+
+    def test_lru_eviction(self):
+        self.registry.get('box', 8)
+        self.registry.get('box', 16)
+        self.registry.get('box', 24)
+        stats = self.registry.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['size'], 2)
+
+    def test_lookups_are_published(self):
+        def lookups(result: str) -> float:
+            return metrics.collect()[0].get('valentine_asset_cache_total', {}).get((('result', result),), 0)
+
+        hits, misses = lookups('hit'), lookups('miss')
+        self.registry.get('box', 8)
+        self.registry.get('box', 8)
+        self.assertEqual((lookups('hit') - hits, lookups('miss') - misses), (1, 1))
+        self.assertEqual(metrics.collect()[0]['valentine_asset_cache_size'][()], 1)
+
+    def test_bundled_accessories_are_registered(self):
+        self.assertEqual(set(asset_registry.names()), {Assets.SUNGLASSES, Assets.CIGAR, Assets.HEART})
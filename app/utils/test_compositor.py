@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+import numpy as np
+
+from app.utils.compositor import Compositor
+from app.utils.utils import Utils
+
+
+class TestCompositor(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.background = rng.integers(0, 256, (50, 80, 3), dtype=np.uint8)
+        self.overlay = rng.integers(0, 256, (10, 20, 4), dtype=np.uint8)
+
+    def reference(self, background, overlay, x, y):
+        # straight-alpha float blend
+        result = background.astype(np.float64)
+        alpha = overlay[..., 3:] / 255.0
+        region = result[y:y + overlay.shape[0], x:x + overlay.shape[1]]
+        region[...] = overlay[..., :3] * alpha + region * (1 - alpha)
+        return result
+
+    def test_matches_float_blend(self):
+        expected = self.reference(self.background, self.overlay, 5, 7)
+        result = Compositor.composite(self.background.copy(), [(Compositor.premultiply(self.overlay), (5, 7))])
+        self.assertLessEqual(np.abs(result.astype(np.float64) - expected).max(), 1.0)
+
+    def test_clips_at_every_edge(self):
+        asset = Compositor.premultiply(self.overlay)
+        for location in [(-5, -3), (70, 45), (-30, 0), (0, 100)]:
+            background = self.background.copy()
+            Compositor.composite(background, [(asset, location)])
+            self.assertEqual(background.shape, self.background.shape)
+
+        background = self.background.copy()
+        Compositor.composite(background, [(asset, (75, 0))])
+        np.testing.assert_array_equal(background[:, :75], self.background[:, :75])
+
+    def test_opaque_and_transparent_pixels(self):
+        overlay = np.zeros((4, 4, 4), dtype=np.uint8)
+        overlay[:2, :, :3] = 9
+        overlay[:2, :, 3] = 255
+        background = self.background.copy()
+        Compositor.composite(background, [(Compositor.premultiply(overlay), (0, 0))])
+        self.assertTrue((background[:2, :4] == 9).all())
+        np.testing.assert_array_equal(background[2:4, :4], self.background[2:4, :4])
+
+    def test_writes_through_views(self):
+        rgbx = np.zeros((10, 10, 4), dtype=np.uint8)
+        overlay = np.full((2, 2, 4), 255, dtype=np.uint8)
+        overlay[..., 0] = 50  # blue in BGR
+        Compositor.composite(rgbx[..., 2::-1], [(Compositor.premultiply(overlay), (0, 0))])
+        self.assertEqual(tuple(rgbx[0, 0, :3]), (255, 255, 50))
+
+    def test_overlay_transparent_no_longer_raises_past_the_edge(self):
+        background = self.background.copy()
+        Utils.overlay_transparent(background, self.overlay, (75, 45))
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+import numpy as np
+
+from app.utils.compositor import Compositor
+from app.utils.face_geometry import Decorations, FaceGeometry
+from app.utils.utils import Utils
+
+
+def face(left: float, top: float, eye_distance: float) -> dict:
+    return {'bounding_box': {'Left': left, 'Top': top, 'Width': eye_distance * 2, 'Height': eye_distance * 2.5},
+            'landmarks': [{'Type': 'eyeLeft', 'X': left + eye_distance * 0.5, 'Y': top + eye_distance},
+                          {'Type': 'eyeRight', 'X': left + eye_distance * 1.5, 'Y': top + eye_distance},
+                          {'Type': 'mouthLeft', 'X': left + eye_distance * 0.6, 'Y': top + eye_distance * 2},
+                          {'Type': 'mouthRight', 'X': left + eye_distance * 1.4, 'Y': top + eye_distance * 2},
+                          {'Type': 'nose', 'X': left + eye_distance, 'Y': top + eye_distance * 1.5}]}
+
+
+class TestFaceGeometry(TestCase):
+
+    def setUp(self):
+        self.background = np.random.default_rng(7).integers(0, 256, (600, 800, 3), dtype=np.uint8)
+        # the last face hangs over the bottom right corner
+        self.faces = [face(0.05, 0.1, 0.08), face(0.4, 0.2, 0.05), face(0.6, 0.5, 0.12), face(0.9, 0.9, 0.1)]
+
+    def test_crop_boxes(self):
+        boxes = FaceGeometry.crop_boxes(FaceGeometry.bounding_boxes(self.faces), 800, 600)
+        for crop_box, face_details in zip(boxes.tolist(), self.faces):
+            box = face_details['bounding_box']
+            left, top = int(box['Left'] * 800), int(box['Top'] * 600)
+            width, height = int(box['Width'] * 800), int(box['Height'] * 600)
+            new_width, new_height = int(width * 1.2), int(height * 1.2)
+            new_left = max(left - (new_width - width) // 2, 0)
+            new_top = max(top - (new_height - height) // 2, 0)
+            self.assertEqual(crop_box, [new_left, new_top, new_left + new_width, new_top + new_height])
+
+    def test_one_pass_matches_decorating_face_by_face(self):
+        decorations = [Decorations.HEARTS, Decorations.SUNGLASSES_AND_CIGAR, None, Decorations.HEARTS]
+        one_pass = Compositor.composite(self.background.copy(),
+                                        FaceGeometry.overlays(self.faces, decorations, 800, 600))
+
+        face_by_face = self.background.copy()
+        for face_details, decoration in zip(self.faces, decorations):
+            if decoration == Decorations.HEARTS:
+                Utils.render_hearts_on_eyes(face_by_face, face_details)
+            elif decoration == Decorations.SUNGLASSES_AND_CIGAR:
+                Utils.render_cigar_and_sunglasses(face_by_face, face_details)
+        np.testing.assert_array_equal(one_pass, face_by_face)
+        # the undecorated face is untouched
+        np.testing.assert_array_equal(one_pass[300:360, 480:560], self.background[300:360, 480:560])
+
+    def test_no_faces(self):
+        self.assertEqual(FaceGeometry.overlays([], [], 800, 600), [])
+        self.assertEqual(FaceGeometry.crop_boxes(FaceGeometry.bounding_boxes([]), 800, 600).shape, (0, 4))
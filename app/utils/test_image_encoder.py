@@ -0,0 +1,97 @@
+import base64
+import io
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+from app.utils.image_encoder import OutputEncoder, TargetSizeEncoder
+from app.utils.utils import Utils
+
+
+def encode(image: Image.Image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+class TestTargetSizeEncoder(TestCase):
+
+    def setUp(self):
+        # noise barely compresses, the worst case for a byte budget
+        self.noise = Image.fromarray(np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8))
+
+    def test_meets_the_byte_budget(self):
+        for max_bytes in (200_000, 50_000, 10_000, 2_000):
+            encoded = TargetSizeEncoder(max_bytes).encode(self.noise)
+            self.assertLessEqual(len(encoded), max_bytes)
+            with Image.open(io.BytesIO(encoded)) as img:
+                self.assertEqual(img.format, 'JPEG')
+                # the aspect ratio survives the rescales
+                self.assertAlmostEqual(img.width / img.height, 800 / 600, delta=0.05)
+
+    def test_keeps_the_highest_quality_that_fits(self):
+        encoded = TargetSizeEncoder(10_000_000).encode(self.noise)
+        self.assertEqual(encoded, encode(self.noise, 'JPEG', quality=95))
+
+    def test_returns_data_untouched_when_it_fits(self):
+        data = encode(self.noise, 'PNG')
+        self.assertIs(TargetSizeEncoder(len(data), max_size=(800, 600)).encode_data(data), data)
+
+    def test_caps_the_dimensions_of_small_pngs(self):
+        # a few kilobytes on disk, 42 megapixels once decoded
+        data = encode(Image.new('RGB', (7000, 6000), (200, 30, 60)), 'PNG')
+        self.assertLess(len(data), 5242880)
+        encoded = TargetSizeEncoder(5242880, max_size=(4096, 4096)).encode_data(data)
+        with Image.open(io.BytesIO(encoded)) as img:
+            self.assertEqual(img.size, (4096, 3510))
+
+    def test_caps_pixels(self):
+        encoder = TargetSizeEncoder(5242880, max_pixels=120_000)
+        with Image.open(io.BytesIO(encoder.encode(self.noise))) as img:
+            self.assertLessEqual(img.width * img.height, 120_000)
+
+    def test_decodes_a_reduced_draft_of_large_jpegs(self):
+        data = encode(self.noise.resize((3200, 2400)), 'JPEG', quality=95)
+        encoded = TargetSizeEncoder(5242880, max_size=(400, 400)).encode_data(data)
+        with Image.open(io.BytesIO(encoded)) as img:
+            self.assertEqual(img.size, (400, 300))
+
+    def test_keeps_exif(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotated 90 degrees
+        data = encode(self.noise, 'JPEG', quality=95, exif=exif)
+        encoded = TargetSizeEncoder(len(data) // 2).encode_data(data)
+        with Image.open(io.BytesIO(encoded)) as img:
+            self.assertEqual(img.getexif()[0x0112], 6)
+
+    def test_prepare_image_fits_the_classifier_budget(self):
+        encoded = Utils.prepare_image(self.noise, max_size_bytes=20_000)
+        self.assertLessEqual(len(base64.b64decode(encoded)), 20_000)
+        with Image.open(io.BytesIO(base64.b64decode(encoded))) as img:
+            self.assertLessEqual(img.width, 800)
+            self.assertLessEqual(img.height, 600)
+
+
+class TestOutputEncoder(TestCase):
+
+    def test_negotiates_the_format(self):
+        for accept, image_format in [(None, 'jpeg'), ('*/*', 'jpeg'), ('application/json', 'jpeg'),
+                                     ('image/avif,image/webp,*/*;q=0.8', 'webp'), ('image/*', 'jpeg'),
+                                     ('image/png;q=0.9, image/webp;q=0.5', 'png')]:
+            self.assertEqual(OutputEncoder.negotiate(accept), image_format, accept)
+        self.assertEqual(OutputEncoder.negotiate('*/*', default='webp'), 'webp')
+
+    def test_encodes_every_format(self):
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (300, 400, 4), dtype=np.uint8), 'RGBX')
+        for image_format, pil_format in [('jpeg', 'JPEG'), ('webp', 'WEBP'), ('png', 'PNG')]:
+            encoded = OutputEncoder(image_format, quality=80, max_dimension=200).encode(image)
+            with Image.open(io.BytesIO(encoded)) as img:
+                self.assertEqual((img.format, img.size), (pil_format, (200, 150)))
+                if image_format == 'jpeg':
+                    self.assertTrue(img.info.get('progressive'))
+
+    def test_rejects_invalid_parameters(self):
+        for kwargs in ({'image_format': 'gif'}, {'quality': 0}, {'quality': 101}, {'max_dimension': 0}):
+            with self.assertRaises(ValueError):
+                OutputEncoder(**kwargs)
@@ -31,6 +31,14 @@ class TestUtils(TestCase):
             self.assertEqual(result.prediction_confidence, expected.prediction_confidence)
             self.assertEqual(result.prediction_id, expected.prediction_id)
 
+    def test_top_indices(self):
+        confidences = [0.2, 0.7, 0.1, 0.7, 0.5]
+        self.assertEqual(Utils.top_indices(confidences, 1), [1])
+        self.assertEqual(Utils.top_indices(confidences, 3), [1, 3, 4])
+        self.assertEqual(Utils.top_indices(confidences), [1, 3, 4, 0, 2])
+        self.assertEqual(Utils.top_indices(confidences, 10), [1, 3, 4, 0, 2])
+        self.assertEqual(Utils.top_indices([], 1), [])
+
     def test_pre_append_date(self):
         # Test case 1: Test with a sample file name
         sample_file = "example.jpg"
@@ -1,6 +1,10 @@
 import datetime
+import heapq
 import os
-from typing import Any, Dict, List, Tuple
+import sys
+import tempfile
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from PIL import Image
 
@@ -8,8 +12,12 @@ import io
 import base64
 
 from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 
 from app.model.prediction_model import PredictionModel
+from app.utils.compositor import Compositor
+from app.utils.face_geometry import FaceGeometry
+from app.utils.image_encoder import TargetSizeEncoder
 import cv2
 import numpy as np
 
@@ -33,35 +41,27 @@ class Utils:
             print(f"Directory '{directory_path}' already exists.")
 
     @staticmethod
-    def save_file_locally(file: FileStorage) -> Tuple[str, str]:
+    def save_file_locally(file: FileStorage, directory_path: str = "./tmp") -> Tuple[str, str]:
         # Save the image to a temporary file
-        # Define the path for the new directory
-        directory_path = "./tmp"
         # Check if the directory already exists
         Utils.create_dir(directory_path)
         file_name = Utils.pre_append_date(file.filename)
-        file_path = f'{directory_path}/' + file_name
+        # in a directory of its own, two uploads of the same name on the same day would overwrite each other
+        file_path = os.path.join(tempfile.mkdtemp(prefix='upload-', dir=directory_path),
+                                 secure_filename(file_name) or 'upload')
         file.save(file_path)
         return file_name, file_path
 
     @staticmethod
-    def prepare_image(file_path: str, output_size=(800, 600), quality=85):
-        # Open the image
-        with Image.open(file_path) as img:
-            # Resize the image, maintaining aspect ratio
-            img.thumbnail(output_size)
-
-            # If the image is in RGBA mode (has an alpha channel), convert it to RGB
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            # Save the image to a bytes buffer with compression
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=quality)
-            buffer.seek(0)
-
-            # Encode the modified image to base64
-            encoded_image = base64.b64encode(buffer.read()).decode("utf-8")
+    def prepare_image(source: Union[str, Image.Image], output_size=(800, 600), quality=85,
+                      max_size_bytes: Optional[int] = None) -> str:
+        # Open the image from disk, or work on an in-memory crop directly: the encoder never modifies it
+        img_context = Image.open(source) if isinstance(source, str) else nullcontext(source)
+        with img_context as img:
+            # Fit the image into output_size, keeping its aspect ratio, and into max_size_bytes if given
+            encoder = TargetSizeEncoder(max_size_bytes or sys.maxsize, max_size=output_size, max_quality=quality)
+            # Encode the JPEG to base64
+            encoded_image = base64.b64encode(encoder.encode(img)).decode("utf-8")
 
         return encoded_image
 
@@ -81,156 +81,92 @@ class Utils:
             return None
 
     @staticmethod
-    def convert_dict_to_list_of_models(prediction_dict: Dict[str, Any]) -> List[PredictionModel]:
-        # Convert the dictionary into a list of PredictionModel instances
-        prediction_models: List[PredictionModel] = [
-            PredictionModel(label, confidence, _id)
-            for label, confidence, _id in
-            zip(prediction_dict['displayNames'], prediction_dict['confidences'], prediction_dict['ids'])
-        ]
-        # Sort the list by confidence score
-        prediction_models.sort(key=lambda x: x.prediction_confidence, reverse=True)
-        return prediction_models
+    def convert_dict_to_list_of_models(prediction_dict: Dict[str, Any],
+                                       top_k: Optional[int] = None) -> List[PredictionModel]:
+        # Only the top_k most confident labels (all of them if None) become PredictionModel instances, best first
+        labels, confidences, ids = (prediction_dict['displayNames'], prediction_dict['confidences'],
+                                    prediction_dict['ids'])
+        return [PredictionModel(labels[idx], confidences[idx], ids[idx])
+                for idx in Utils.top_indices(confidences, top_k)]
+
+    @staticmethod
+    def top_indices(confidences: Sequence[float], top_k: Optional[int] = None) -> List[int]:
+        """
+        Positions of the ``top_k`` highest confidences, highest first; of all of them if ``top_k`` is None. Ties keep
+        their order. Picking the best one or few does not sort the whole list.
+        """
+        indices = range(len(confidences))
+        if top_k is None or top_k >= len(confidences):
+            return sorted(indices, key=confidences.__getitem__, reverse=True)
+        if top_k == 1:
+            return [max(indices, key=confidences.__getitem__)]
+        return heapq.nlargest(top_k, indices, key=confidences.__getitem__)
 
     @staticmethod
-    def add_cigar_and_sunglasses(image_path: str, face_details: dict, sunglasses_scale_factor: float = 2.3) -> str:
+    def add_cigar_and_sunglasses(image_path: str, face_details: dict, sunglasses_scale_factor: float = 2.3,
+                                 output_path: Optional[str] = None) -> str:
         # Load the image
         image = cv2.imread(image_path)
+        image_with_accessories = Utils.render_cigar_and_sunglasses(image, face_details, sunglasses_scale_factor)
 
-        # Define the paths to the accessories
-        sunglasses_path = "app/static/Sunglasses.png"
-        cigar_path = "app/static/cigar.png"
-
-        # Read the accessory images with transparency
-        sunglasses = cv2.imread(sunglasses_path, cv2.IMREAD_UNCHANGED)
-        cigar = cv2.imread(cigar_path, cv2.IMREAD_UNCHANGED)
-
-        # Extract face landmarks
-        left_eye = face_details['landmarks'][0]
-        right_eye = face_details['landmarks'][1]
-        mouth_left = face_details['landmarks'][2]
-        mouth_right = face_details['landmarks'][3]
-
-        # Calculate the center coordinates of each eye
-        left_eye_center = (int(left_eye['X'] * image.shape[1]), int(left_eye['Y'] * image.shape[0]))
-        right_eye_center = (int(right_eye['X'] * image.shape[1]), int(right_eye['Y'] * image.shape[0]))
-
-        # Position sunglasses based in the center of each eye
-        sunglasses_width = (right_eye_center[0] - left_eye_center[0]) * sunglasses_scale_factor
-        sunglasses_height = (sunglasses.shape[0] * sunglasses_width // sunglasses.shape[1]) * sunglasses_scale_factor
-        sunglasses_resized = cv2.resize(sunglasses, (int(sunglasses_width), int(sunglasses_height)))
-        x_offset = left_eye_center[0] - int(sunglasses_width * 0.2)  # Move sunglasses to the left a little bit
-        y_offset = left_eye_center[1] - sunglasses_resized.shape[0] // 2
-        image_with_sunglasses = Utils.overlay_transparent(image, sunglasses_resized, (x_offset, y_offset))
-
-        # Calculate the position of the cigar
-        cigar_width = mouth_right['X'] * image.shape[1] - mouth_left['X'] * image.shape[1]
-        cigar_height = cigar.shape[0] * cigar_width // cigar.shape[1]
-        cigar_resized = cv2.resize(cigar, (int(cigar_width), int(cigar_height)))
-        x_offset = int(mouth_left['X'] * image.shape[1])
-        y_offset = int(mouth_left['Y'] * image.shape[0]) - int(cigar_height * 0.2)  # Move cigar up a little bit
-        image_with_accessories = Utils.overlay_transparent(image_with_sunglasses, cigar_resized, (x_offset, y_offset))
-
-        # Save the modified image
-        output_path = "tmp/output_image_with_accessories.jpg"
+        # Save the modified image next to the original, never to a path shared by every request
+        output_path = output_path or f"{os.path.splitext(image_path)[0]}_with_accessories.jpg"
         cv2.imwrite(output_path, image_with_accessories)
 
         return output_path
 
     @staticmethod
-    def add_hearts_on_eyes(image_path: str, face_details: dict, heart_scale_factor: float = 0.8) -> str:
+    def render_cigar_and_sunglasses(image: np.ndarray, face_details: dict,
+                                    sunglasses_scale_factor: float = 2.3) -> np.ndarray:
+        # Sunglasses over the eyes and a cigar in the mouth; accessories hanging over the edge are clipped
+        [overlays] = FaceGeometry.cigar_and_sunglasses(FaceGeometry.landmarks([face_details]), image.shape[1],
+                                                       image.shape[0], sunglasses_scale_factor)
+        return Compositor.composite(image, overlays)
+
+    @staticmethod
+    def add_hearts_on_eyes(image_path: str, face_details: dict, heart_scale_factor: float = 0.8,
+                           output_path: Optional[str] = None) -> str:
         # Load the image
         image = cv2.imread(image_path)
+        image_with_hearts = Utils.render_hearts_on_eyes(image, face_details, heart_scale_factor)
 
-        # Define the path to the heart image
-        heart_path = "app/static/sapphire_heart.png"
-
-        # Read the heart image with transparency
-        heart = cv2.imread(heart_path, cv2.IMREAD_UNCHANGED)
-
-        # Extract face landmarks for left and right eyes
-        left_eye = face_details['landmarks'][0]
-        right_eye = face_details['landmarks'][1]
-
-        # Calculate the center coordinates of each eye
-        left_eye_center = (int(left_eye['X'] * image.shape[1]), int(left_eye['Y'] * image.shape[0]))
-        right_eye_center = (int(right_eye['X'] * image.shape[1]), int(right_eye['Y'] * image.shape[0]))
-
-        # Resize the heart image
-        heart_width = int((right_eye_center[0] - left_eye_center[0]) * heart_scale_factor)
-        heart_height = int(heart.shape[0] * heart_width / heart.shape[1])
-        heart_resized = cv2.resize(heart, (heart_width, heart_height))
-
-        # Position the heart on the left eye
-        x_offset_left_eye = left_eye_center[0] - int(heart_width * 0.5)
-        y_offset_left_eye = left_eye_center[1] - int(heart_height * 0.5)
-        image_with_hearts = Utils.overlay_transparent(image, heart_resized, (x_offset_left_eye, y_offset_left_eye))
-
-        # Position the heart on the right eye
-        x_offset_right_eye = right_eye_center[0] - int(heart_width * 0.5)
-        y_offset_right_eye = right_eye_center[1] - int(heart_height * 0.5)
-        image_with_hearts = Utils.overlay_transparent(image_with_hearts, heart_resized,
-                                                      (x_offset_right_eye, y_offset_right_eye))
-
-        # Save the modified image
-        output_path = "tmp/output_image_with_hearts.jpg"
+        # Save the modified image next to the original, never to a path shared by every request
+        output_path = output_path or f"{os.path.splitext(image_path)[0]}_with_hearts.jpg"
         cv2.imwrite(output_path, image_with_hearts)
 
         return output_path
 
+    @staticmethod
+    def render_hearts_on_eyes(image: np.ndarray, face_details: dict, heart_scale_factor: float = 0.8) -> np.ndarray:
+        # A heart on each eye
+        [overlays] = FaceGeometry.hearts_on_eyes(FaceGeometry.landmarks([face_details]), image.shape[1],
+                                                 image.shape[0], heart_scale_factor)
+        return Compositor.composite(image, overlays)
+
     @staticmethod
     def overlay_transparent(background, overlay, location):
         """
-        Overlay a transparent image onto another image.
+        Overlay a transparent BGRA (or opaque BGR) image onto another image, in place. Parts of the overlay that fall
+        outside the background are clipped.
         """
-        x, y = location
-
-        # Check overlay dimensions
-        if overlay.shape[:2] != background[y:y + overlay.shape[0], x:x + overlay.shape[1]].shape[:2]:
-            raise ValueError("Overlay dimensions do not match the region of interest")
-
-        # Cut the region of interest from the background
-        foreground = background[y:y + overlay.shape[0], x:x + overlay.shape[1]]
-
-        # If overlay has an alpha channel, use it for blending
-        if overlay.shape[2] == 4:
-            # Extract alpha channel
-            alpha = overlay[:, :, 3] / 255.0
+        return Compositor.composite(background, [(Compositor.premultiply(overlay), location)])
 
-            # Perform alpha blending
-            blended = np.empty_like(foreground, dtype=np.uint8)
-            for c in range(3):  # Iterate over RGB channels
-                blended[..., c] = overlay[..., c] * alpha + foreground[..., c] * (1 - alpha)
-
-            # Update the region of interest
-            background[y:y + overlay.shape[0], x:x + overlay.shape[1]] = blended
-        else:
-            # If overlay does not have an alpha channel, assume it's fully opaque
-            background[y:y + overlay.shape[0], x:x + overlay.shape[1]] = overlay
-
-        return background
+    @staticmethod
+    def compress_image(file_path: str, max_size_bytes=5242880, max_size=(4096, 4096)) -> None:
+        # Re-encode the file in place when it is over max_size_bytes or larger than max_size
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        compressed = Utils.compress_image_data(data, max_size_bytes, max_size=max_size)
+        if compressed is not data:
+            with open(file_path, 'wb') as file:
+                file.write(compressed)
 
     @staticmethod
-    def compress_image(file_path: str, max_size_bytes=5242880) -> None:
-        # Get the size of the image file
-        file_size = os.path.getsize(file_path)
-
-        # Check if the file size is greater than the maximum allowed size
-        if file_size > max_size_bytes:
-            # Open the image
-            img = Image.open(file_path)
-
-            # Calculate the new width and height to maintain the aspect ratio
-            width, height = img.size
-            aspect_ratio = width / height
-            new_width = int((max_size_bytes / file_size) ** 0.5 * width)
-            new_height = int(new_width / aspect_ratio)
-
-            # Resize the image
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-            # Save the compressed image, overwriting the original file
-            img.save(file_path, optimize=True, quality=95, exif=img.info.get('exif'))  # Adjust quality as needed
-            print(f"Image compressed to less than 5 MB. New file size: {os.path.getsize(file_path)} bytes")
-        else:
-            print("Image is already within the size limit.")
+    def compress_image_data(data: bytes, max_size_bytes=5242880, image: Optional[Image.Image] = None,
+                            max_size=(4096, 4096)) -> bytes:
+        """
+        In-memory counterpart of ``compress_image``: returns ``data`` untouched when it is within ``max_size_bytes``
+        and ``max_size``, otherwise a JPEG re-encode of it that is. Pass the already decoded ``image`` to avoid
+        decoding ``data`` a second time; only its header is read then.
+        """
+        return TargetSizeEncoder(max_size_bytes, max_size=max_size).encode_data(data, image)
@@ -0,0 +1,9 @@
+from app.asgi import application
+
+# Serves /process-image on an event loop instead of a thread per request, e.g.
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(application, host='0.0.0.0', port=5000)
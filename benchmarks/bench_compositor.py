@@ -0,0 +1,63 @@
+"""
+Microbenchmark: Compositor.composite against the original per-channel float64 Utils.overlay_transparent.
+
+    python -m benchmarks.bench_compositor [--repeat 20]
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from app.utils.compositor import Compositor
+
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+OVERLAY_WIDTHS = [64, 256, 1024]
+
+
+def legacy_overlay_transparent(background, overlay, location):
+    # The implementation Compositor replaced, kept verbatim as the baseline
+    x, y = location
+
+    if overlay.shape[:2] != background[y:y + overlay.shape[0], x:x + overlay.shape[1]].shape[:2]:
+        raise ValueError("Overlay dimensions do not match the region of interest")
+
+    foreground = background[y:y + overlay.shape[0], x:x + overlay.shape[1]]
+
+    if overlay.shape[2] == 4:
+        alpha = overlay[:, :, 3] / 255.0
+
+        blended = np.empty_like(foreground, dtype=np.uint8)
+        for c in range(3):
+            blended[..., c] = overlay[..., c] * alpha + foreground[..., c] * (1 - alpha)
+
+        background[y:y + overlay.shape[0], x:x + overlay.shape[1]] = blended
+    else:
+        background[y:y + overlay.shape[0], x:x + overlay.shape[1]] = overlay
+
+    return background
+
+
+def run(repeat: int) -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'image':>11} {'overlay':>9} {'legacy ms':>10} {'compositor ms':>14} {'speedup':>8}")
+    for width, height in IMAGE_SIZES:
+        background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for overlay_width in OVERLAY_WIDTHS:
+            overlay_width = min(overlay_width, width)
+            overlay_height = min(overlay_width // 2, height)
+            overlay = rng.integers(0, 256, (overlay_height, overlay_width, 4), dtype=np.uint8)
+            asset = Compositor.premultiply(overlay)
+            location = ((width - overlay_width) // 2, (height - overlay_height) // 2)
+
+            legacy = min(timeit.repeat(lambda: legacy_overlay_transparent(background, overlay, location),
+                                       number=1, repeat=repeat))
+            compositor = min(timeit.repeat(lambda: Compositor.composite(background, [(asset, location)]),
+                                           number=1, repeat=repeat))
+            print(f"{width:>5}x{height:<5} {overlay_width:>4}x{overlay_height:<4} {legacy * 1000:>10.3f} "
+                  f"{compositor * 1000:>14.3f} {legacy / compositor:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    run(parser.parse_args().repeat)
@@ -0,0 +1,58 @@
+"""
+Cost of turning a Vertex AI predict response into prediction lists.
+
+    python -m benchmarks.bench_predictions [--instances 1,16] [--labels 2,50] [--top-k 1] [--repeat 200]
+
+Builds a response with ``--instances`` predictions of ``--labels`` labels each, and times the previous parsing,
+``MessageToDict`` over every prediction and a full sort of its labels, against ``VertexClassifier.parse_predictions``,
+which reads the Struct fields directly and picks the ``--top-k`` best labels.
+"""
+import argparse
+import random
+import timeit
+
+from google.cloud.aiplatform_v1.types import PredictResponse
+from google.protobuf import json_format, struct_pb2
+
+from app.service.backends.classifier import VertexClassifier
+from app.utils.utils import Utils
+
+
+def build_response(instances: int, labels: int) -> PredictResponse:
+    rng = random.Random(0)
+    response = PredictResponse()
+    for _ in range(instances):
+        response.predictions.append(json_format.ParseDict({
+            'displayNames': [f'label-{idx}' for idx in range(labels)],
+            'confidences': [rng.random() for _ in range(labels)],
+            'ids': [str(rng.getrandbits(63)) for _ in range(labels)],
+        }, struct_pb2.Value()))
+    return response
+
+
+def parse_with_dicts(response: PredictResponse):
+    return [Utils.convert_dict_to_list_of_models(json_format.MessageToDict(proto_buf))
+            for proto_buf in response.predictions.__dict__['_pb']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', default='1,16', help='comma-separated predictions per response')
+    parser.add_argument('--labels', default='2,50', help='comma-separated labels per prediction')
+    parser.add_argument('--top-k', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'instances':>9} {'labels':>6} {'dicts us':>9} {'struct us':>9} {'speedup':>7}")
+    for instances in (int(value) for value in args.instances.split(',')):
+        for labels in (int(value) for value in args.labels.split(',')):
+            response = build_response(instances, labels)
+            with_dicts = min(timeit.repeat(lambda: parse_with_dicts(response), number=args.repeat, repeat=3))
+            with_struct = min(timeit.repeat(lambda: VertexClassifier.parse_predictions(response, args.top_k),
+                                            number=args.repeat, repeat=3))
+            print(f"{instances:>9} {labels:>6} {with_dicts / args.repeat * 1e6:>9.1f} "
+                  f"{with_struct / args.repeat * 1e6:>9.1f} {with_dicts / with_struct:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
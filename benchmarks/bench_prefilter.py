@@ -0,0 +1,118 @@
+"""
+False negatives and cost of the face pre-filter on a local image set.
+
+    python -m benchmarks.bench_prefilter --faces photos/faces [--no-faces photos/other]
+    python -m benchmarks.bench_prefilter --images photos/mixed [--min-neighbors 1,2,3,5] [--min-face 0.03,0.06]
+
+With ``--faces``/``--no-faces`` the directories say which images contain faces. With ``--images`` every image is
+labelled by the configured face detector (Rekognition unless FACE_DETECTOR_BACKEND=local), which is what the
+pre-filter has to agree with: an image the detector finds faces in but the pre-filter skips is a false negative,
+a user who would have been told "No faces detected" wrongly.
+
+For every combination of settings it reports the false negatives, the share of faceless images skipped (the calls
+saved) and the time the pre-filter takes per image.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+from app.model.decoded_image import DecodedImage
+from app.service.face_prefilter import FacePrefilter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def read_images(directory: str) -> List[Tuple[str, bytes]]:
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as file:
+                images.append((name, file.read()))
+    return images
+
+
+def label_with_detector(images: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes, bool]]:
+    from app.service.backends import Backends
+    from app.utils.utils import Utils
+
+    labelled = []
+    for name, data in images:
+        response = Backends.face_detector().detect_faces(Utils.compress_image_data(data))
+        labelled.append((name, data, bool(response['FaceDetails'])))
+    return labelled
+
+
+def evaluate(prefilter: FacePrefilter, images: List[Tuple[str, DecodedImage, bool]]) -> Dict[str, Any]:
+    timings, false_negatives = [], []
+    faceless, skipped = 0, 0
+    for name, image, has_faces in images:
+        started = time.perf_counter()
+        passed = prefilter.may_contain_faces(image)
+        timings.append(time.perf_counter() - started)
+        if has_faces and not passed:
+            false_negatives.append(name)
+        if not has_faces:
+            faceless += 1
+            skipped += not passed
+    with_faces = len(images) - faceless
+    timings.sort()
+    return {'false_negatives': len(false_negatives),
+            'false_negative_rate': round(len(false_negatives) / with_faces, 4) if with_faces else None,
+            'faceless_skipped_rate': round(skipped / faceless, 4) if faceless else None,
+            'median_ms': round(statistics.median(timings) * 1000, 2),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0] * 1000, 2),
+            'false_negative_files': false_negatives}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', help='directory of images that all contain faces')
+    parser.add_argument('--no-faces', help='directory of images without faces')
+    parser.add_argument('--images', help='directory of images labelled by the configured face detector')
+    parser.add_argument('--cascades', default='haarcascade_frontalface_default.xml,haarcascade_profileface.xml')
+    parser.add_argument('--min-neighbors', default='1,2,3,5')
+    parser.add_argument('--min-face', default='0.03,0.06')
+    parser.add_argument('--max-dimension', type=int, default=480)
+    parser.add_argument('--show', action='store_true', help='list the files of every false negative')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    labelled: List[Tuple[str, bytes, bool]] = []
+    if args.faces:
+        labelled += [(name, data, True) for name, data in read_images(args.faces)]
+    if args.no_faces:
+        labelled += [(name, data, False) for name, data in read_images(args.no_faces)]
+    if args.images:
+        labelled += label_with_detector(read_images(args.images))
+    if not labelled:
+        parser.error('give --faces, --no-faces or --images')
+    images = [(name, DecodedImage.from_bytes(data), has_faces) for name, data, has_faces in labelled]
+    print(f"{len(images)} images, {sum(has_faces for _, _, has_faces in images)} with faces")
+
+    cascades = [cascade.strip() for cascade in args.cascades.split(',')]
+    results = []
+    print(f"{'min_neighbors':>13} {'min_face':>8} {'false neg':>9} {'FN rate':>8} {'faceless skipped':>16} "
+          f"{'median ms':>9} {'p95 ms':>7}")
+    for min_neighbors in (int(value) for value in args.min_neighbors.split(',')):
+        for min_face in (float(value) for value in args.min_face.split(',')):
+            prefilter = FacePrefilter(cascades, min_neighbors=min_neighbors, max_dimension=args.max_dimension,
+                                      min_face=min_face)
+            run = {'min_neighbors': min_neighbors, 'min_face': min_face, **evaluate(prefilter, images)}
+            results.append(run)
+            print(f"{min_neighbors:>13} {min_face:>8} {run['false_negatives']:>9} "
+                  f"{'-' if run['false_negative_rate'] is None else run['false_negative_rate']:>8} "
+                  f"{'-' if run['faceless_skipped_rate'] is None else run['faceless_skipped_rate']:>16} "
+                  f"{run['median_ms']:>9} {run['p95_ms']:>7}")
+            if args.show and run['false_negative_files']:
+                print('    missed: ' + ', '.join(run['false_negative_files']))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'cascades': cascades, 'max_dimension': args.max_dimension, 'runs': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
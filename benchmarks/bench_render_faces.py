@@ -0,0 +1,56 @@
+"""
+Cost of decorating more faces of the same photo: placing and compositing the accessories of every face in one pass,
+then one JPEG encode, against the encode alone.
+
+    python -m benchmarks.bench_render_faces [--faces 1,2,4,8,16] [--size 1920x1080] [--repeat 20]
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from app.model.decoded_image import DecodedImage
+from app.utils.compositor import Compositor
+from app.utils.face_geometry import Decorations, FaceGeometry
+
+
+def faces_in_a_row(count: int, max_count: int) -> list:
+    # faces of the same size whatever their number
+    faces = []
+    for idx in range(count):
+        left, eye_distance = (idx + 0.25) / max_count, 0.3 / max_count
+        faces.append({'landmarks': [{'X': left, 'Y': 0.4}, {'X': left + eye_distance, 'Y': 0.4},
+                                    {'X': left + eye_distance * 0.1, 'Y': 0.6},
+                                    {'X': left + eye_distance * 0.9, 'Y': 0.6}]})
+    return faces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', default='1,2,4,8,16', help='comma-separated faces per photo')
+    parser.add_argument('--size', default='1920x1080')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    encode = min(timeit.repeat(lambda: DecodedImage(pixels.copy()).encode('JPEG', quality=95),
+                               number=args.repeat, repeat=3)) / args.repeat
+    print(f"encode only: {encode * 1000:.2f} ms")
+    print(f"{'faces':>5} {'placement ms':>12} {'composite ms':>12} {'total ms':>9}")
+    counts = [int(value) for value in args.faces.split(',')]
+    for count in counts:
+        faces = faces_in_a_row(count, max(counts))
+        decorations = [Decorations.HEARTS if idx % 2 else Decorations.SUNGLASSES_AND_CIGAR for idx in range(count)]
+        placement = min(timeit.repeat(lambda: FaceGeometry.overlays(faces, decorations, width, height),
+                                      number=args.repeat, repeat=3)) / args.repeat
+        overlays = FaceGeometry.overlays(faces, decorations, width, height)
+        image = DecodedImage(pixels.copy())
+        composite = min(timeit.repeat(lambda: Compositor.composite(image.bgr, overlays),
+                                      number=args.repeat, repeat=3)) / args.repeat
+        print(f"{count:>5} {placement * 1000:>12.3f} {composite * 1000:>12.3f} "
+              f"{(placement + composite + encode) * 1000:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
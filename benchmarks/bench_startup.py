@@ -0,0 +1,154 @@
+"""
+Startup time and memory per gunicorn worker, with and without preloading the app in the master.
+
+    python -m benchmarks.bench_startup [--workers 4] [--repeat 5] [--requests 20] [--output startup.json]
+
+Reports:
+- the time to import the app in a fresh interpreter, on its own and followed by ``warm_up()`` (the work the
+  gunicorn master does with PRELOAD_APP=true);
+- for gunicorn with PRELOAD_APP off and on: the time until /health answers, and the RSS, PSS and private memory of
+  the master and every worker after ``--requests`` requests to /process-image with the local backends. PSS splits
+  shared pages between the processes sharing them, so it shows what copy-on-write sharing saves.
+
+Memory figures are read from /proc and need Linux.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import requests
+from PIL import Image
+
+from benchmarks.load_test import ROOT, free_port
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+if {warm_up}:
+    from app.service.startup import warm_up
+    warm_up()
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+def import_times(env: Dict[str, str], repeat: int, warm_up: bool) -> Dict[str, float]:
+    imports, totals = [], []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET.format(warm_up=warm_up)], cwd=ROOT,
+                                         env=env, text=True, stderr=subprocess.DEVNULL)
+        imported, total = (float(value) for value in output.split()[-2:])
+        imports.append(imported)
+        totals.append(total)
+    return {'import_ms': round(statistics.median(imports) * 1000, 1),
+            'total_ms': round(statistics.median(totals) * 1000, 1)}
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss_kb': values.get('Rss', 0), 'pss_kb': values.get('Pss', 0),
+            'private_kb': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)}
+
+
+def children(pid: int) -> List[int]:
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+
+def gunicorn_startup(env: Dict[str, str], workers: int, preload: bool, request_count: int) -> Dict[str, Any]:
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+               '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app']
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env={**env, 'PRELOAD_APP': str(preload)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f'http://127.0.0.1:{port}'
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with {process.returncode}')
+            try:
+                if requests.get(f'{url}/health', timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                time.sleep(0.05)
+        healthy = time.perf_counter() - started
+        # wait for every worker, not just the first one to answer
+        while len(children(process.pid)) < workers:
+            time.sleep(0.05)
+
+        image = io.BytesIO()
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (720, 960, 3), dtype=np.uint8)).save(image, 'JPEG')
+        session = requests.Session()
+        for _ in range(request_count):
+            session.post(f'{url}/process-image', files={'image': ('photo.jpg', image.getvalue())}, timeout=60)
+
+        worker_memory = [memory_kb(pid) for pid in children(process.pid)]
+        return {'preload': preload,
+                'workers': workers,
+                'healthy_ms': round(healthy * 1000, 1),
+                'master': memory_kb(process.pid),
+                'per_worker': {key: round(statistics.mean(memory[key] for memory in worker_memory))
+                               for key in worker_memory[0]},
+                'total_pss_kb': memory_kb(process.pid)['pss_kb'] + sum(memory['pss_kb'] for memory in worker_memory)}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per import measurement')
+    parser.add_argument('--requests', type=int, default=20, help='requests sent before memory is measured')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # cloud backends for the import times, so the SDKs they would import are counted; no client is created
+    cloud_env = {**os.environ, 'BACKEND_MODE': 'cloud', 'AWS_REGION': os.getenv('AWS_REGION', 'us-east-1')}
+    object_store = tempfile.TemporaryDirectory(prefix='bench-startup-bucket-')
+    local_env = {**os.environ, 'BACKEND_MODE': 'local', 'RESULT_CACHE_SIZE': '0',
+                 'LOCAL_OBJECT_STORE_PATH': object_store.name}
+
+    results: Dict[str, Any] = {'import': {'lazy': import_times(cloud_env, args.repeat, warm_up=False),
+                                          'warmed_up': import_times(cloud_env, args.repeat, warm_up=True)},
+                               'gunicorn': []}
+    print(f"import main: {results['import']['lazy']['import_ms']} ms, "
+          f"with warm_up(): {results['import']['warmed_up']['total_ms']} ms")
+
+    if os.path.exists('/proc/self/smaps_rollup'):
+        print(f"{'preload':>8} {'healthy ms':>11} {'worker RSS MB':>14} {'worker PSS MB':>14} "
+              f"{'worker private MB':>18} {'total PSS MB':>13}")
+        for preload in (False, True):
+            run = gunicorn_startup(local_env, args.workers, preload, args.requests)
+            results['gunicorn'].append(run)
+            worker = run['per_worker']
+            print(f"{str(preload):>8} {run['healthy_ms']:>11.1f} {worker['rss_kb'] / 1024:>14.1f} "
+                  f"{worker['pss_kb'] / 1024:>14.1f} {worker['private_kb'] / 1024:>18.1f} "
+                  f"{run['total_pss_kb'] / 1024:>13.1f}")
+    else:
+        print('no /proc/self/smaps_rollup, skipping the gunicorn memory measurements')
+
+    object_store.cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+End-to-end load test of /process-image against the offline backend stand-ins.
+
+Starts the app (gunicorn or the Flask development server) with BACKEND_MODE=local, replays a synthetic corpus of
+images at every requested concurrency and reports throughput, latency percentiles, per-stage time (from the
+Server-Timing header) and server CPU time per request. Results are written as JSON so runs can be compared.
+
+    python -m benchmarks.load_test --concurrency 1,8,32 --requests 200
+    python -m benchmarks.load_test --worker-class sync,gthread --workers 2,4 --output results.json
+    python -m benchmarks.load_test --worker-class sync,uvicorn --workers 1 --latency-ms 200 --concurrency 1,16,64
+    python -m benchmarks.load_test --server external --url http://localhost:5000
+    python -m benchmarks.load_test --compare baseline.json --output results.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_image(width: int, height: int, image_format: str, mode: str, seed: int) -> bytes:
+    """A smooth gradient with noise, so encoded sizes are closer to photos than flat colour or pure noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.empty((height, width, len(mode)), dtype=np.uint8)
+    pixels[..., 0] = (x * 255 // max(width - 1, 1) + seed * 37) % 256
+    pixels[..., 1] = (y * 255 // max(height - 1, 1) + seed * 91) % 256
+    pixels[..., 2] = ((x + y) * 255 // max(width + height - 2, 1)) % 256
+    if mode == 'RGBA':
+        pixels[..., 3] = 255 - (x * 64 // max(width - 1, 1)).astype(np.uint8)
+    noise = rng.integers(-12, 13, pixels[..., :3].shape)
+    pixels[..., :3] = np.clip(pixels[..., :3].astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels, mode).save(output, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def build_corpus(resolutions: List[Tuple[int, int]], formats: List[str], modes: List[str],
+                 variants: int) -> List[Dict[str, Any]]:
+    corpus = []
+    for (width, height), image_format, mode in itertools.product(resolutions, formats, modes):
+        if image_format == 'JPEG' and mode == 'RGBA':
+            # JPEG has no alpha channel
+            continue
+        for variant in range(variants):
+            data = synthetic_image(width, height, image_format, mode, seed=len(corpus))
+            corpus.append({'name': f'{width}x{height}_{mode}_{variant}.{image_format.lower()}',
+                           'kind': f'{width}x{height} {image_format} {mode}',
+                           'data': data})
+    return corpus
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of ``pid`` and all its descendants, read from /proc. None where /proc is missing."""
+    if not os.path.isdir('/proc'):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    stats: Dict[int, Tuple[int, float]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields after the command name: state, ppid, ..., utime (12), stime (13)
+        stats[int(entry)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks)
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        for child, (ppid, _) in stats.items():
+            if ppid == parent and child not in tree:
+                tree.add(child)
+                frontier.append(child)
+    return sum(stats[member][1] for member in tree if member in stats)
+
+
+class Server:
+    """The app under test, started in a subprocess with the local backends."""
+
+    def __init__(self, kind: str, worker_class: str, workers: int, threads: int, env: Dict[str, str]):
+        self.kind = kind
+        self.worker_class = worker_class
+        self.workers = workers
+        self.threads = threads
+        self.env = env
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.process: Optional[subprocess.Popen] = None
+
+    def describe(self) -> Dict[str, Any]:
+        if self.kind == 'gunicorn':
+            return {'kind': self.kind, 'worker_class': self.worker_class, 'workers': self.workers,
+                    'threads': self.threads}
+        return {'kind': self.kind}
+
+    def command(self) -> List[str]:
+        if self.kind == 'gunicorn':
+            # 'uvicorn' serves the ASGI entry point instead of the WSGI app
+            asgi = self.worker_class == 'uvicorn'
+            return [sys.executable, '-m', 'gunicorn', '-w', str(self.workers),
+                    '-k', 'uvicorn.workers.UvicornWorker' if asgi else self.worker_class,
+                    '--threads', str(self.threads), '-b', f'127.0.0.1:{self.port}', '--log-level', 'warning',
+                    'asgi:application' if asgi else 'main:app']
+        return [sys.executable, '-m', 'flask', '--app', 'main', 'run', '--port', str(self.port), '--with-threads']
+
+    def start(self, log, timeout: float = 60) -> None:
+        self.process = subprocess.Popen(self.command(), cwd=ROOT, env=self.env, stdout=log, stderr=log)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{" ".join(self.command())} exited with {self.process.returncode}')
+            try:
+                if requests.get(f'{self.url}/health', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'server did not become healthy within {timeout}s')
+
+    def cpu_seconds(self) -> Optional[float]:
+        return process_tree_cpu_seconds(self.process.pid) if self.process is not None else None
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class ExternalServer(Server):
+    """An already running instance; CPU time is not measured."""
+
+    def __init__(self, url: str):
+        super().__init__('external', '', 0, 0, {})
+        self.url = url.rstrip('/')
+
+    def describe(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'url': self.url}
+
+    def start(self, log, timeout: float = 60) -> None:
+        requests.get(f'{self.url}/health', timeout=timeout).raise_for_status()
+
+    def cpu_seconds(self) -> Optional[float]:
+        return None
+
+    def stop(self) -> None:
+        pass
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for metric in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, *params = metric.split(';')
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name.strip()] = float(value)
+    return timings
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    array = np.asarray(values)
+    return {'mean': round(float(array.mean()), 2),
+            'p50': round(float(np.percentile(array, 50)), 2),
+            'p90': round(float(np.percentile(array, 90)), 2),
+            'p99': round(float(np.percentile(array, 99)), 2),
+            'max': round(float(array.max()), 2)}
+
+
+def run_workload(server: Server, corpus: List[Dict[str, Any]], concurrency: int, total_requests: int,
+                 warmup: int, timeout: float) -> Dict[str, Any]:
+    local = threading.local()
+    counter = itertools.count()
+
+    def send(_: int) -> Dict[str, Any]:
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        image = corpus[next(counter) % len(corpus)]
+        started = time.perf_counter()
+        try:
+            response = local.session.post(f'{server.url}/process-image',
+                                          files={'image': (image['name'], image['data'])}, timeout=timeout)
+            status, server_timing = response.status_code, response.headers.get('Server-Timing')
+        except requests.RequestException:
+            status, server_timing = 'error', None
+        return {'latency_ms': (time.perf_counter() - started) * 1000, 'status': status, 'kind': image['kind'],
+                'stages': parse_server_timing(server_timing)}
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, range(warmup)))
+        cpu_before = server.cpu_seconds()
+        started = time.perf_counter()
+        samples = list(pool.map(send, range(total_requests)))
+        elapsed = time.perf_counter() - started
+        cpu_after = server.cpu_seconds()
+
+    status_counts: Dict[str, int] = {}
+    for sample in samples:
+        status_counts[str(sample['status'])] = status_counts.get(str(sample['status']), 0) + 1
+    stage_samples: Dict[str, List[float]] = {}
+    for sample in samples:
+        for stage, duration in sample['stages'].items():
+            stage_samples.setdefault(stage, []).append(duration)
+    kind_samples: Dict[str, List[float]] = {}
+    for sample in samples:
+        kind_samples.setdefault(sample['kind'], []).append(sample['latency_ms'])
+
+    return {'concurrency': concurrency,
+            'requests': total_requests,
+            'duration_s': round(elapsed, 3),
+            'throughput_rps': round(total_requests / elapsed, 2),
+            # 5xx and transport errors; 400 is the expected answer for images without a known face
+            'errors': sum(count for status, count in status_counts.items()
+                          if status == 'error' or status.startswith('5')),
+            'status_counts': status_counts,
+            'latency_ms': percentiles([sample['latency_ms'] for sample in samples]),
+            'latency_ms_by_image': {kind: percentiles(values) for kind, values in sorted(kind_samples.items())},
+            'stages_ms': {stage: percentiles(values) for stage, values in stage_samples.items()},
+            'cpu_ms_per_request': round((cpu_after - cpu_before) * 1000 / total_requests, 2)
+            if cpu_before is not None and cpu_after is not None else None}
+
+
+def run_key(run: Dict[str, Any]) -> str:
+    server = run['server']
+    return ' '.join(f'{key}={server[key]}' for key in sorted(server)) + f' concurrency={run["concurrency"]}'
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any]) -> None:
+    previous = {run_key(run): run for run in baseline['runs']}
+    print(f"\n{'run':<70} {'rps':>16} {'p99 ms':>18}")
+    for run in results['runs']:
+        before = previous.get(run_key(run))
+        if before is None:
+            continue
+        rps_change = (run['throughput_rps'] / before['throughput_rps'] - 1) * 100
+        p99_change = (run['latency_ms']['p99'] / before['latency_ms']['p99'] - 1) * 100
+        print(f"{run_key(run):<70} {run['throughput_rps']:>8.1f} {rps_change:>+6.1f}% "
+              f"{run['latency_ms']['p99']:>9.1f} {p99_change:>+6.1f}%")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+
+def str_list(value: str) -> List[str]:
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['gunicorn', 'flask', 'external'], default='gunicorn')
+    parser.add_argument('--url', help='base URL of the app when --server external')
+    parser.add_argument('--worker-class', type=str_list, default=['sync'],
+                        help='comma separated gunicorn worker classes, e.g. sync,gthread,gevent, or uvicorn for the '
+                             'ASGI app')
+    parser.add_argument('--workers', type=int_list, default=[2], help='comma separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--resolutions', type=str_list, default=['640x480', '1920x1080', '4032x3024'])
+    parser.add_argument('--formats', type=str_list, default=['JPEG', 'PNG'])
+    parser.add_argument('--modes', type=str_list, default=['RGB', 'RGBA'])
+    parser.add_argument('--variants', type=int, default=2, help='different images per resolution/format/mode')
+    parser.add_argument('--faces', default='0-3', help='faces per image found by the fake detector, e.g. 1 or 0-3')
+    parser.add_argument('--label', default='Mary', help='label the fake classifier gives every face')
+    parser.add_argument('--latency-ms', default='0', help='LOCAL_BACKEND_LATENCY_MS for the stand-ins')
+    parser.add_argument('--error-rate', default='0', help='LOCAL_BACKEND_ERROR_RATE for the stand-ins')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the server, may be repeated')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    resolutions = [tuple(int(side) for side in resolution.lower().split('x')) for resolution in args.resolutions]
+    corpus = build_corpus(resolutions, [image_format.upper() for image_format in args.formats],
+                          [mode.upper() for mode in args.modes], args.variants)
+    print(f'corpus: {len(corpus)} images, {sum(len(image["data"]) for image in corpus) / 1e6:.1f} MB')
+
+    object_store = tempfile.TemporaryDirectory(prefix='load-test-bucket-')
+    env = {**os.environ,
+           'BACKEND_MODE': 'local',
+           'LOCAL_OBJECT_STORE_PATH': object_store.name,
+           'LOCAL_BACKEND_LATENCY_MS': args.latency_ms,
+           'LOCAL_BACKEND_ERROR_RATE': args.error_rate,
+           'FAKE_FACES_PER_IMAGE': args.faces,
+           'FAKE_CLASSIFIER_LABEL': args.label,
+           # every request must run the whole pipeline, the corpus is replayed many times
+           'RESULT_CACHE_SIZE': '0',
+           'RESULT_CACHE_SHARED_PATH': '',
+           'PYTHONUNBUFFERED': '1'}
+    env.update(dict(entry.split('=', 1) for entry in args.env))
+
+    if args.server == 'external':
+        servers = [ExternalServer(args.url)]
+    elif args.server == 'flask':
+        servers = [Server('flask', '', 1, 1, env)]
+    else:
+        servers = [Server('gunicorn', worker_class, workers, args.threads, env)
+                   for worker_class, workers in itertools.product(args.worker_class, args.workers)]
+
+    results = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'git_commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': os.cpu_count(),
+               'arguments': vars(args),
+               'corpus': sorted({image['kind'] for image in corpus}),
+               'runs': []}
+    log = tempfile.NamedTemporaryFile(prefix='load-test-server-', suffix='.log', delete=False)
+    skipped = False
+    try:
+        for server in servers:
+            try:
+                server.start(log)
+            except (RuntimeError, requests.RequestException) as e:
+                print(f'skipping {server.describe()}: {e} (server log: {log.name})')
+                skipped = True
+                continue
+            try:
+                for concurrency in args.concurrency:
+                    run = {'server': server.describe(),
+                           **run_workload(server, corpus, concurrency, args.requests, args.warmup, args.timeout)}
+                    results['runs'].append(run)
+                    latency = run['latency_ms']
+                    print(f"{run_key(run):<70} {run['throughput_rps']:>8.1f} rps  p50 {latency['p50']:>8.1f} ms  "
+                          f"p99 {latency['p99']:>8.1f} ms  cpu/req {run['cpu_ms_per_request']} ms  "
+                          f"errors {run['errors']}")
+            finally:
+                server.stop()
+    finally:
+        object_store.cleanup()
+        log.close()
+        if not skipped:
+            os.remove(log.name)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+
+# Settings can be overridden on the command line, e.g. gunicorn -c gunicorn.conf.py -w 8 main:app
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+# gthread runs every request of a worker on a thread of its own, gevent on a greenlet (pip install gevent); requests
+# share no mutable state, so both are safe. With gevent, CPU-bound stages hold up the worker's other requests while
+# they run, so keep ADMISSION_MAX_IN_FLIGHT low and rely on more workers for CPU parallelism.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# enough threads for the image requests admission control admits and queues (ADMISSION_MAX_IN_FLIGHT and
+# ADMISSION_MAX_QUEUED), plus a few that stay free for /health, the Swagger UI and refusing excess requests fast
+threads = int(os.getenv('GUNICORN_THREADS') or (int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '4'))
+                                                + int(os.getenv('ADMISSION_MAX_QUEUED', '4'))
+                                                + int(os.getenv('GUNICORN_RESERVED_THREADS', '2'))))
+# concurrent connections per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+# import the app once in the master and fork the workers from it, so they share its memory and start instantly
+preload_app = os.getenv('PRELOAD_APP', 'False').lower() == 'true'
+
+if worker_class == 'gevent' and preload_app:
+    # the gevent worker patches the standard library when it starts, too late for locks and threads the app created
+    # in the master; patch it before the app is imported instead
+    from gevent import monkey
+
+    monkey.patch_all()
+
+
+def when_ready(server):
+    # called in the master once the app is loaded and before any worker is forked
+    if preload_app:
+        from app.service.startup import warm_up
+
+        warm_up()
+        server.log.info('Warmed up the app before forking the workers')